@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Host environment for the Mela benchmarks.
+
+Registers the stand-in machine, network, ds1307 and micropython modules and, on CPython,
+the utime, ujson and uasyncio aliases, so lib/mela runs on a Linux box under CPython or
+the MicroPython unix port.
+"""
+import sys
+
+IS_MICROPYTHON = sys.implementation.name == 'micropython'
+
+
+def _cpython_aliases() -> None:
+    """
+    Add the MicroPython time functions to time and register utime, ujson and uasyncio.
+    """
+    import asyncio
+    import json
+    import time
+
+    period = 0x40000000
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000) % period
+
+    def ticks_us():
+        return int(time.monotonic() * 1000000) % period
+
+    def ticks_add(ticks, delta):
+        return (ticks + delta) % period
+
+    def ticks_diff(end, start):
+        return ((end - start + period // 2) % period) - period // 2
+
+    def sleep_ms(ms):
+        time.sleep(ms / 1000)
+
+    def sleep_us(us):
+        if us > 0:
+            time.sleep(us / 1000000)
+
+    async def async_sleep_ms(ms):
+        await asyncio.sleep(ms / 1000)
+
+    import gc
+    if not hasattr(gc, 'mem_alloc'):
+        import tracemalloc
+
+        heap = 8 * 1024 * 1024
+        gc.mem_alloc = lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        gc.mem_free = lambda: heap - gc.mem_alloc()
+        gc.threshold = lambda amount=None: -1
+
+    for name, func in (('ticks_ms', ticks_ms), ('ticks_us', ticks_us), ('ticks_add', ticks_add),
+                       ('ticks_diff', ticks_diff), ('sleep_ms', sleep_ms), ('sleep_us', sleep_us)):
+        setattr(time, name, func)
+    asyncio.sleep_ms = async_sleep_ms
+
+    sys.modules['utime'] = time
+    sys.modules['ujson'] = json
+    sys.modules['uasyncio'] = asyncio
+
+
+def install(paths: list = None) -> None:
+    """
+    Install the host environment.
+
+    :param paths: Import paths to add, e.g. the lib directory of the repository and the directory holding umodbus.
+    """
+    if not IS_MICROPYTHON:
+        import host_micropython
+        sys.modules['micropython'] = host_micropython
+        _cpython_aliases()
+
+    import host_machine
+    import host_network
+    import host_ds1307
+
+    sys.modules['machine'] = host_machine
+    sys.modules['network'] = host_network
+    sys.modules['ds1307'] = host_ds1307
+
+    for path in paths or []:
+        if path not in sys.path:
+            sys.path.insert(0, path)
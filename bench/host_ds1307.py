@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Stand-in DS1307 driver working on the register memory of host_machine.SoftI2C.
+"""
+
+
+class DS1307:
+    """
+    Minimal DS1307 driver, the clock registers are BCD encoded in the I2C memory.
+    """
+
+    def __init__(self, addr: int = 0x68, i2c=None):
+        self._addr = addr
+        self._i2c = i2c
+
+    @property
+    def datetime(self) -> tuple:
+        raw = self._i2c.readfrom_mem(self._addr, 0, 7)
+        bcd = [(b >> 4) * 10 + (b & 0x0F) for b in raw]
+        return (2000 + bcd[6], bcd[5], bcd[4], bcd[2], bcd[1], bcd[0] & 0x7F, bcd[3] - 1, 0)
+
+    @datetime.setter
+    def datetime(self, value: tuple) -> None:
+        year, month, day, hour, minute, second = value[:6]
+        weekday = value[6] if len(value) > 6 else 0
+        self._i2c.set_time(year, month, day, hour, minute, second, weekday)
+
+    year = property(lambda self: self.datetime[0])
+    month = property(lambda self: self.datetime[1])
+    day = property(lambda self: self.datetime[2])
+    hour = property(lambda self: self.datetime[3])
+    minute = property(lambda self: self.datetime[4])
+    second = property(lambda self: self.datetime[5])
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Stand-in machine module with loopback UARTs, pins, timers and an I2C bus holding a DS1307.
+"""
+import utime as time
+
+
+class Pin:
+    """
+    Output pin which only keeps its state.
+    """
+
+    IN = 0
+    OUT = 1
+    PULL_UP = 2
+
+    def __init__(self, pin_id, mode: int = -1, pull: int = -1, value: int = 0):
+        self.pin_id = pin_id
+        self._value = value
+
+    def value(self, value: int = None) -> int:
+        if value is not None:
+            self._value = value
+        return self._value
+
+    def on(self) -> None:
+        self._value = 1
+
+    def off(self) -> None:
+        self._value = 0
+
+
+class UART:
+    """
+    UART whose writes go to the receive buffer of its peer.
+
+    A receive callback on the peer is called after each write, which lets a slave answer
+    in the same thread: UART.link(master_uart, slave_uart, on_receive=slave.process).
+    """
+
+    def __init__(self, uart_id: int = 1, baudrate: int = 9600, bits: int = 8, parity=None, stop: int = 1, **kwargs):
+        self.uart_id = uart_id
+        self.baudrate = baudrate
+        self.bits = bits
+        self.parity = parity
+        self.stop = stop
+        self.peer = None
+        self.on_receive = None
+        self.rx = bytearray()
+        self.written = 0
+
+    @staticmethod
+    def link(first: 'UART', second: 'UART', on_receive=None) -> None:
+        """
+        Connect two UARTs, the optional callback runs when the second one receives data.
+        """
+        first.peer = second
+        second.peer = first
+        second.on_receive = on_receive
+
+    def init(self, **kwargs) -> None:
+        pass
+
+    def any(self) -> int:
+        return len(self.rx)
+
+    def read(self, nbytes: int = None):
+        if not self.rx:
+            return None
+        nbytes = len(self.rx) if nbytes is None else min(nbytes, len(self.rx))
+        data = bytes(self.rx[:nbytes])
+        self.rx = self.rx[nbytes:]
+        return data
+
+    def readinto(self, buf, nbytes: int = None):
+        nbytes = min(len(buf) if nbytes is None else nbytes, len(self.rx))
+        if not nbytes:
+            return None
+        buf[:nbytes] = self.rx[:nbytes]
+        self.rx = self.rx[nbytes:]
+        return nbytes
+
+    def write(self, data) -> int:
+        self.written += len(data)
+        if self.peer is not None:
+            self.peer.rx.extend(data)
+            if self.peer.on_receive:
+                self.peer.on_receive()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+class Timer:
+    """
+    Timer which does not fire, the benchmarks call the callbacks themselves.
+    """
+
+    PERIODIC = 1
+    ONE_SHOT = 0
+
+    def __init__(self, timer_id: int = 0):
+        self.callback = None
+
+    def init(self, mode: int = PERIODIC, period: int = 1000, callback=None) -> None:
+        self.callback = callback
+
+    def deinit(self) -> None:
+        self.callback = None
+
+
+class SoftI2C:
+    """
+    I2C bus with the register memory of a DS1307 set to the host time.
+    """
+
+    def __init__(self, scl=None, sda=None, freq: int = 400000, **kwargs):
+        self.mem = bytearray(64)
+        now = time.localtime()
+        self.set_time(now[0], now[1], now[2], now[3], now[4], now[5], now[6])
+
+    def set_time(self, year: int, month: int, day: int, hour: int, minute: int, second: int, weekday: int = 0) -> None:
+        bcd = lambda value: ((value // 10) << 4) | (value % 10)
+        self.mem[0:7] = bytes((bcd(second), bcd(minute), bcd(hour), weekday + 1, bcd(day), bcd(month), bcd(year % 100)))
+
+    def readfrom_mem(self, addr: int, memaddr: int, nbytes: int) -> bytes:
+        return bytes(self.mem[memaddr:memaddr + nbytes])
+
+    def readfrom_mem_into(self, addr: int, memaddr: int, buf) -> None:
+        buf[:] = self.mem[memaddr:memaddr + len(buf)]
+
+    def writeto_mem(self, addr: int, memaddr: int, buf) -> None:
+        self.mem[memaddr:memaddr + len(buf)] = buf
+
+
+I2C = SoftI2C
+
+
+def freq() -> int:
+    return 240000000
+
+
+def reset() -> None:
+    raise SystemExit('machine.reset()')
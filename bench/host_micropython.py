@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Stand-in micropython module for CPython, scheduled callbacks run at once.
+"""
+
+
+def schedule(func, arg) -> None:
+    func(arg)
+
+
+def const(value):
+    return value
+
+
+def native(func):
+    return func
+
+
+def viper(func):
+    return func
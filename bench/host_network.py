@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Stand-in network module, the station interface connects at once to a loopback access point.
+"""
+
+STA_IF = 0
+AP_IF = 1
+STAT_IDLE = 1000
+STAT_CONNECTING = 1001
+STAT_GOT_IP = 1010
+
+ACCESS_POINTS = [(b'LAN', b'\x02\x00\x00\x00\x00\x01', 6, -55, 3, False)]
+
+
+class WLAN:
+    """
+    Station interface with the loopback address.
+    """
+
+    _connected = False
+    _ssid = None
+
+    def __init__(self, interface: int = STA_IF):
+        self._interface = interface
+        self._active = False
+
+    def active(self, state: bool = None) -> bool:
+        if state is not None:
+            self._active = state
+        return self._active
+
+    def scan(self) -> list:
+        return list(ACCESS_POINTS)
+
+    def connect(self, ssid: str = None, key: str = None, bssid: bytes = None) -> None:
+        WLAN._connected = any(ap[0].decode() == ssid for ap in ACCESS_POINTS)
+        WLAN._ssid = ssid
+
+    def disconnect(self) -> None:
+        WLAN._connected = False
+
+    def isconnected(self) -> bool:
+        return WLAN._connected
+
+    def status(self, param: str = None):
+        if param == 'rssi':
+            return ACCESS_POINTS[0][3]
+        return STAT_GOT_IP if WLAN._connected else STAT_IDLE
+
+    def ifconfig(self) -> tuple:
+        return ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+    def config(self, param: str = None, **kwargs):
+        return {'ssid': WLAN._ssid, 'channel': ACCESS_POINTS[0][2], 'mac': b'\x02\x00\x00\x00\x00\x02'}.get(param)
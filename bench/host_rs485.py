@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Simulated RS485 bus with Modbus RTU slaves built from register definitions.
+
+The bus models the wire in real time: every character takes (start + data + parity + stop bits)
+/ baudrate, a slave sees a request only after the t3.5 silent interval and answers after its
+turnaround latency. Slaves can drop requests and corrupt the CRC of their responses.
+
+Usage:
+    bus = RS485Bus(baudrate=9600)
+    bus.add_slave(10, register_definitions, latency_ms=5)
+    master = MelaModbusMaster485({'baudrate': 9600}, uart=bus.port())
+"""
+import random
+import struct
+
+import utime as time
+
+from mela.mela import MelaModbusSlave, MelaRegisterBank
+
+
+def _crc16_table() -> list:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = _crc16_table()
+
+
+def crc16(data) -> bytes:
+    """
+    Modbus RTU checksum of a frame, little-endian as sent on the wire.
+    """
+    crc = 0xFFFF
+    for char in data:
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ char) & 0xFF]
+    return struct.pack('<H', crc)
+
+
+def chance(rate: float) -> bool:
+    return rate > 0 and random.getrandbits(16) < rate * 0x10000
+
+
+class SimulatedSlave(MelaModbusSlave):
+    """
+    Modbus RTU slave answering from a register bank, with injectable latency and faults.
+    """
+
+    def __init__(self, address: int, register_definitions: dict, latency_ms: float = 5, jitter_ms: float = 0,
+                 timeout_rate: float = 0.0, crc_error_rate: float = 0.0):
+        """
+        :param address: Slave address on the bus.
+        :param register_definitions: Register definitions as used in the slave configuration.
+        :param latency_ms: Turnaround time from the end of the request to the first response character.
+        :param jitter_ms: Maximum random delay added to the latency.
+        :param timeout_rate: Share of requests left unanswered, 1.0 for a dead unit.
+        :param crc_error_rate: Share of responses sent with a wrong checksum.
+        """
+        self.address = address
+        self.bank = MelaRegisterBank(register_definitions)
+        self.setup_codecs(register_definitions)
+        self.latency_us = int(latency_ms * 1000)
+        self.jitter_us = int(jitter_ms * 1000)
+        self.timeout_rate = timeout_rate
+        self.crc_error_rate = crc_error_rate
+        self.requests = 0
+        self.timeouts = 0
+        self.crc_errors = 0
+
+    def answer(self, pdu: memoryview) -> tuple:
+        """
+        Serve a request PDU.
+
+        :return: (response frame or None if dropped, turnaround in microseconds).
+        """
+        self.requests += 1
+        if chance(self.timeout_rate):
+            self.timeouts += 1
+            return None, 0
+        frame = bytearray((self.address,))
+        frame.extend(self.process_pdu(pdu))
+        frame.extend(crc16(frame))
+        if chance(self.crc_error_rate):
+            self.crc_errors += 1
+            frame[-1] ^= 0xFF
+        delay = self.latency_us
+        if self.jitter_us:
+            delay += (random.getrandbits(16) * self.jitter_us) >> 16
+        return frame, delay
+
+
+class RS485Port:
+    """
+    UART-like master end of the bus for MelaModbusMaster485(uart=...).
+    """
+
+    def __init__(self, bus: 'RS485Bus'):
+        self.bus = bus
+        self.rx = b''
+        self.rx_start = 0
+        self.consumed = 0
+
+    def init(self, **kwargs) -> None:
+        pass
+
+    def _available(self) -> int:
+        if not self.rx:
+            return 0
+        elapsed = time.ticks_diff(time.ticks_us(), self.rx_start)
+        return max(0, min(len(self.rx), elapsed // self.bus.char_us) - self.consumed)
+
+    def any(self) -> int:
+        return self._available()
+
+    def read(self, nbytes: int = None):
+        count = self._available()
+        if nbytes is not None:
+            count = min(count, nbytes)
+        if not count:
+            return None
+        data = self.rx[self.consumed:self.consumed + count]
+        self.consumed += count
+        return data
+
+    def readinto(self, buf, nbytes: int = None):
+        data = self.read(len(buf) if nbytes is None else nbytes)
+        if data is None:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data) -> int:
+        self.rx = b''
+        self.consumed = 0
+        frame, self.rx_start = self.bus.transfer(bytes(data))
+        if frame:
+            self.rx = bytes(frame)
+        return len(data)
+
+    def flush(self) -> None:
+        """
+        Wait until the request has left the transmitter, as UART.flush does.
+        """
+        wait = time.ticks_diff(self.bus.tx_end, time.ticks_us())
+        if wait > 0:
+            time.sleep_us(wait)
+
+
+class RS485Bus:
+    """
+    Half-duplex RS485 line with one master port and any number of simulated slaves.
+    """
+
+    def __init__(self, baudrate: int = 9600, data_bits: int = 8, stop_bits: int = 1, parity=None):
+        bits = 1 + data_bits + stop_bits + (0 if parity is None else 1)
+        self.baudrate = baudrate
+        self.char_us = (1000000 * bits + baudrate - 1) // baudrate
+        self.t35_us = 1750 if baudrate > 19200 else (self.char_us * 35 + 9) // 10
+        self.slaves = {}
+        self.tx_end = time.ticks_us()
+        self.reset_stats()
+
+    def add_slave(self, address: int, register_definitions: dict, **faults) -> SimulatedSlave:
+        """
+        Put a slave on the bus, keyword arguments as in SimulatedSlave.
+        """
+        slave = SimulatedSlave(address, register_definitions, **faults)
+        self.slaves[address] = slave
+        return slave
+
+    def port(self) -> RS485Port:
+        return RS485Port(self)
+
+    def reset_stats(self) -> None:
+        self.frames = 0
+        self.responses = 0
+        self.busy_us = 0
+        self.started = time.ticks_us()
+        for slave in self.slaves.values():
+            slave.requests = slave.timeouts = slave.crc_errors = 0
+
+    def frame_us(self, length: int) -> int:
+        """
+        Line time of a frame including the silent interval which ends it.
+        """
+        return length * self.char_us + self.t35_us
+
+    def transfer(self, request: bytes) -> tuple:
+        """
+        Put a request on the line and let the addressed slaves answer it.
+
+        :return: (response frame or None, ticks_us at which its first character starts).
+        """
+        now = time.ticks_us()
+        start = now if time.ticks_diff(self.tx_end, now) < 0 else self.tx_end
+        self.tx_end = time.ticks_add(start, len(request) * self.char_us)
+        self.frames += 1
+        self.busy_us += self.frame_us(len(request))
+        if len(request) < 4 or crc16(memoryview(request)[:-2]) != request[-2:]:
+            return None, self.tx_end
+
+        pdu = memoryview(request)[1:-2]
+        address = request[0]
+        if address == 0:
+            for slave in self.slaves.values():
+                slave.answer(pdu)
+            return None, self.tx_end
+        slave = self.slaves.get(address)
+        if slave is None:
+            return None, self.tx_end
+        frame, delay = slave.answer(pdu)
+        if frame is None:
+            return None, self.tx_end
+        self.responses += 1
+        self.busy_us += self.frame_us(len(frame))
+        # the slave starts answering after the silent interval and its turnaround, the first
+        # character is readable one character time later
+        return frame, time.ticks_add(self.tx_end, self.t35_us + delay)
+
+    def stats(self) -> dict:
+        """
+        Bus counters since the last reset_stats, 'utilization' is the share of time the line carried frames.
+        """
+        elapsed = time.ticks_diff(time.ticks_us(), self.started)
+        return {'frames': self.frames, 'responses': self.responses, 'busy_us': self.busy_us,
+                'utilization': self.busy_us / elapsed if elapsed > 0 else 0.0,
+                'timeouts': sum(s.timeouts for s in self.slaves.values()),
+                'crc_errors': sum(s.crc_errors for s in self.slaves.values())}
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Mela benchmark suite for the host.
+
+Runs the Modbus RTU and TCP slave and master wrappers over loopback UARTs and sockets
+and reports requests per second and latency percentiles per function code, the boot time
+of Mela(), the scan rate of a simulated RS485 line, the bytes allocated per served request and
+the heap kept by the register definitions of a slave.
+
+Usage: python3 bench/run.py [rtu] [tcp] [boot] [bus] [alloc] [defs] [-n REQUESTS] [-s SLAVES] [-b BAUDRATE] [-p UMODBUS_PATH]
+       micropython bench/run.py ...
+"""
+import gc
+import os
+import struct
+import sys
+
+BASE = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+sys.path.insert(0, BASE)
+
+import host
+
+SLAVE_ADDRESS = 10
+TCP_PORT = 15020
+REGISTER_DEFINITIONS = {
+    'COILS': {'COILS': {'register': 0, 'len': 16, 'val': [0] * 16}},
+    'ISTS': {'ISTS': {'register': 0, 'len': 16, 'val': [1, 0] * 8}},
+    'HREGS': {'HREGS': {'register': 0, 'len': 32, 'val': list(range(32))}},
+    'IREGS': {'IREGS': {'register': 0, 'len': 32, 'val': list(range(100, 132))},
+              'TIMESTAMP': {'register': 40, 'len': 2, 'val': [0, 0], 'type': 'u32'}}
+}
+REQUESTS = (
+    (0x01, struct.pack('>BHH', 0x01, 0, 16)),
+    (0x02, struct.pack('>BHH', 0x02, 0, 16)),
+    (0x03, struct.pack('>BHH', 0x03, 0, 32)),
+    (0x04, struct.pack('>BHH', 0x04, 0, 32)),
+    (0x05, struct.pack('>BHH', 0x05, 3, 0xFF00)),
+    (0x06, struct.pack('>BHH', 0x06, 3, 1234)),
+    (0x0F, struct.pack('>BHHBBB', 0x0F, 0, 16, 2, 0x55, 0xAA)),
+    (0x10, struct.pack('>BHHB', 0x10, 0, 16, 32) + struct.pack('>16H', *range(16)))
+)
+
+
+def ticks_us() -> int:
+    import utime as time
+    return time.ticks_us()
+
+
+def ticks_diff(end: int, start: int) -> int:
+    import utime as time
+    return time.ticks_diff(end, start)
+
+
+def report(section: str, name: str, latencies: list, elapsed_us: int) -> None:
+    """
+    Print requests per second and latency percentiles of one measurement.
+    """
+    latencies.sort()
+    count = len(latencies)
+    percentile = lambda p: latencies[min(count - 1, count * p // 100)]
+    rps = count * 1000000 / elapsed_us if elapsed_us else 0
+    print('{:<6} {:<22} {:>6} {:>9.1f} {:>8} {:>8} {:>8} {:>8}'.format(
+        section, name, count, rps, percentile(50), percentile(90), percentile(99), latencies[-1]))
+
+
+def header(title: str) -> None:
+    print()
+    print(title)
+    print('{:<6} {:<22} {:>6} {:>9} {:>8} {:>8} {:>8} {:>8}'.format('', '', 'n', 'req/s', 'p50 us', 'p90 us', 'p99 us', 'max us'))
+
+
+def slave_config(register_bank: bool, rtu_engine: bool = False) -> dict:
+    return {'address': SLAVE_ADDRESS, 'baudrate': 115200, 'load_definitions_from_config': True,
+            'register_bank': register_bank, 'rtu_engine': rtu_engine, 'register_definitions': REGISTER_DEFINITIONS}
+
+
+def rtu_pair(register_bank: bool, rtu_engine: bool = False) -> tuple:
+    """
+    Create an RTU slave and master whose UARTs are linked, the slave answers in the master's write call.
+    """
+    from machine import UART
+    from mela.mela import MelaModbusSlave485, MelaModbusMaster485
+
+    slave = MelaModbusSlave485(slave_config(register_bank, rtu_engine))
+    master = MelaModbusMaster485({'baudrate': 115200})
+    UART.link(master.connection._uart, slave.connection._itf._uart, on_receive=slave.process)
+    return slave, master
+
+
+def bench_rtu(count: int) -> None:
+    """
+    Round trips through the Mela RTU master and slave, with the umodbus register dicts, with the
+    register bank and with the register bank answered by the RTU engine.
+    """
+    for name, register_bank, rtu_engine in (('dict', False, False), ('bank', True, False), ('engine', True, True)):
+        slave, master = rtu_pair(register_bank, rtu_engine)
+        for function, pdu in REQUESTS:
+            latencies = []
+            start = ticks_us()
+            for _ in range(count):
+                begin = ticks_us()
+                master.transact(SLAVE_ADDRESS, pdu)
+                latencies.append(ticks_diff(ticks_us(), begin))
+            report('rtu', 'FC{:02d} {}'.format(function, name), latencies, ticks_diff(ticks_us(), start))
+
+
+def bench_tcp(count: int) -> None:
+    """
+    Round trips through the Mela TCP pipeline and the asyncio TCP slave, one at a time and with a window of 4.
+    """
+    import uasyncio as asyncio
+    import network
+    from mela.mela import MelaModbusSlaveTCP, MelaModbusTCPPipeline
+
+    async def run():
+        config = dict(slave_config(True), port=TCP_PORT, async_server=True)
+        slave = MelaModbusSlaveTCP(config, network.WLAN(network.STA_IF))
+        await slave.serve()
+        pipeline = MelaModbusTCPPipeline('127.0.0.1', TCP_PORT, window=1)
+        for function, pdu in REQUESTS:
+            latencies = []
+            start = ticks_us()
+            for _ in range(count):
+                begin = ticks_us()
+                await pipeline.request(SLAVE_ADDRESS, pdu)
+                latencies.append(ticks_diff(ticks_us(), begin))
+            report('tcp', 'FC{:02d} window 1'.format(function), latencies, ticks_diff(ticks_us(), start))
+        await pipeline.close()
+
+        pipeline = MelaModbusTCPPipeline('127.0.0.1', TCP_PORT, window=4)
+        latencies = []
+
+        async def timed(pdu):
+            begin = ticks_us()
+            await pipeline.request(SLAVE_ADDRESS, pdu)
+            latencies.append(ticks_diff(ticks_us(), begin))
+
+        start = ticks_us()
+        await asyncio.gather(*[timed(REQUESTS[3][1]) for _ in range(count)])
+        report('tcp', 'FC04 window 4', latencies, ticks_diff(ticks_us(), start))
+        await pipeline.close()
+        await asyncio.sleep_ms(50)
+        slave.server.close()
+
+    asyncio.run(run())
+
+
+def bench_boot(count: int) -> None:
+    """
+    Mela() boot time with a slave485 configuration, from the JSON file and from the compiled snapshot.
+    """
+    import ujson as json
+    from mela.mela import Mela
+
+    cwd = os.getcwd()
+    directory = 'bench_boot'
+    try:
+        os.mkdir(directory)
+    except OSError:
+        pass
+    os.chdir(directory)
+    try:
+        config = {'config': {
+            'wifi': {'connect_on_boot': False, 'networks': [{'ssid': 'LAN', 'key': '12345'}]},
+            'modbus': {'connect_type': 'slave485', 'slave485': slave_config(False)}
+        }}
+        with open('config.json', 'w') as config_file:
+            json.dump(config, config_file)
+        for compiled in (False, True):
+            Mela(compiled_config=compiled)
+            latencies = []
+            start = ticks_us()
+            for _ in range(count):
+                begin = ticks_us()
+                plc = Mela(compiled_config=compiled)
+                latencies.append(ticks_diff(ticks_us(), begin))
+            report('boot', 'Mela() compiled' if compiled else 'Mela() json', latencies, ticks_diff(ticks_us(), start))
+            print('       ' + plc.boot_report().replace('\n', '\n       '))
+    finally:
+        for name in os.listdir('.'):
+            os.remove(name)
+        os.chdir(cwd)
+        os.rmdir(directory)
+
+
+def allocated(func, count: int) -> int:
+    """
+    Measure the bytes allocated by one call, averaged over count calls.
+
+    On MicroPython this is the heap growth with the collector disabled, on CPython the peak
+    traced by tracemalloc above the memory in use before the call.
+    """
+    if host.IS_MICROPYTHON:
+        gc.collect()
+        gc.disable()
+        before = gc.mem_alloc()
+        for _ in range(count):
+            func()
+        used = gc.mem_alloc() - before
+        gc.enable()
+        return used // count
+
+    import tracemalloc
+
+    tracemalloc.start()
+    total = 0
+    for _ in range(count):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        func()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total // count
+
+
+def bench_alloc(count: int) -> None:
+    """
+    Bytes allocated per served request, in the Mela request handler, in the RTU engine answering
+    a received frame and in a full RTU slave request.
+    """
+    from mela.mela import modbus_crc16
+
+    print()
+    print('Bytes allocated per served request ({})'.format('heap' if host.IS_MICROPYTHON else 'tracemalloc peak'))
+    print('{:<6} {:<22} {:>10} {:>10} {:>10} {:>10}'.format('', '', 'dict', 'bank', 'engine', 'rtu bank'))
+    slaves = [rtu_pair(register_bank)[0] for register_bank in (False, True)]
+    engine = rtu_pair(True, True)[0].engine
+    slave, master = rtu_pair(True)
+    for function, pdu in REQUESTS:
+        frame = bytearray((SLAVE_ADDRESS,)) + pdu
+        crc = modbus_crc16(frame, len(frame), engine.CRC_TABLE)
+        frame += bytes((crc & 0xFF, crc >> 8))
+        engine.rx[:len(frame)] = frame
+        used = [allocated(lambda: s.process_pdu(pdu), count) for s in slaves]
+        used.append(allocated(lambda: engine.respond(len(frame)), count))
+        used.append(allocated(lambda: master.transact(SLAVE_ADDRESS, pdu), count))
+        print('{:<6} {:<22} {:>10} {:>10} {:>10} {:>10}'.format('alloc', 'FC{:02d}'.format(function), *used))
+
+
+def retained(build) -> tuple:
+    """
+    Measure the memory kept by the object a function builds.
+
+    :return: (bytes still allocated after a collection, built object).
+    """
+    if host.IS_MICROPYTHON:
+        gc.collect()
+        before = gc.mem_alloc()
+        built = build()
+        gc.collect()
+        return gc.mem_alloc() - before, built
+
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    built = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, built
+
+
+def point_rows(count: int) -> list:
+    """
+    Rows of a meter-like slave: every fourth point a scaled float32, the others u16 and u32.
+    """
+    rows = []
+    for i in range(count):
+        if i % 4 == 0:
+            rows.append(['POINT_{:04d}'.format(i), i * 2, 2, 'float32', [0, 0], {'scale': 0.1}])
+        elif i % 2:
+            rows.append(['POINT_{:04d}'.format(i), i * 2, 1, 'u16', 0])
+        else:
+            rows.append(['POINT_{:04d}'.format(i), i * 2, 2, 'u32', [0, 0]])
+    return rows
+
+
+def bench_defs() -> None:
+    """
+    Heap kept by the parsed slave configuration and by the slave built from it, with the register
+    definitions as a dictionary per point and in the compact row form kept as MelaPointTable.
+    """
+    import ujson as json
+    from mela.mela import MelaModbusSlave, MelaPointTable, MelaRegisterBank
+
+    def slave(config):
+        wrapper = MelaModbusSlave()
+        definitions = wrapper.setup_changes(config)
+        wrapper.bank = MelaRegisterBank(definitions)
+        wrapper.setup_codecs(definitions)
+        return wrapper
+
+    for count in (100, 500):
+        rows = point_rows(count)
+        forms = (
+            ('dict', {'IREGS': dict(MelaPointTable(rows).items())}, False),
+            ('compact', {'IREGS': rows}, False),
+        )
+        for name, definitions, compact in forms:
+            text = json.dumps({'register_bank': True, 'load_definitions_from_config': True,
+                               'compact_definitions': compact, 'register_definitions': definitions})
+            config_bytes, config = retained(lambda: json.loads(text))
+            slave_bytes, built = retained(lambda: slave(config))
+            del config
+            gc.collect()
+            total_bytes, built = retained(lambda: slave(json.loads(text)))
+            print('{:<6} {:<22} {:>6} {:>10} {:>10} {:>10}'.format(
+                'defs', name, count, config_bytes * 100 // count, slave_bytes * 100 // count, total_bytes * 100 // count))
+            del built
+            gc.collect()
+
+
+METER_DEFINITIONS = {
+    'IREGS': {'VOLTAGE': {'register': 0, 'len': 2, 'type': 'float32', 'val': [0x4366, 0]},
+              'CURRENT': {'register': 2, 'len': 2, 'type': 'float32', 'val': [0x40A0, 0]},
+              'POWER': {'register': 4, 'len': 2, 'type': 'float32', 'val': [0x4489, 0x8000]},
+              'ENERGY': {'register': 10, 'len': 2, 'type': 'u32', 'val': [0, 1234]}},
+    'HREGS': {'SETPOINT': {'register': 0, 'len': 1, 'val': 100}}
+}
+BUS_ADAPTIVE = {'adaptive': {'failures': 2}}
+BUS_SCENARIOS = (
+    ('healthy', {}, 0, {}),
+    ('healthy adaptive', {}, 0, BUS_ADAPTIVE),
+    ('2 dead units', {'timeout_rate': 1.0}, 2, {}),
+    ('2 dead units adaptive', {'timeout_rate': 1.0}, 2, BUS_ADAPTIVE),
+    ('latency 20 ms', {'latency_ms': 20}, -1, {}),
+    ('5% crc errors', {'crc_error_rate': 0.05}, -1, {}),
+)
+
+
+def bench_bus(count: int, slaves: int, baudrate: int) -> None:
+    """
+    Scan time of a poll plan per meter over a simulated RS485 line, healthy and with injected faults,
+    with the fixed umodbus timing and with the adaptive timeouts and circuit breaker.
+
+    One scan before the measurement lets the adaptive master learn the slaves.
+    """
+    import host_rs485
+    from mela.mela import MelaModbusMaster485, MelaPollPlan
+
+    scans = max(1, count // 100)
+    for name, faults, affected, config in BUS_SCENARIOS:
+        bus = host_rs485.RS485Bus(baudrate=baudrate)
+        for address in range(1, slaves + 1):
+            faulty = affected < 0 or address <= affected
+            bus.add_slave(address, METER_DEFINITIONS, **(faults if faulty else {}))
+        master = MelaModbusMaster485(dict(config, baudrate=baudrate), uart=bus.port())
+        plans = [MelaPollPlan.from_definitions(address, METER_DEFINITIONS) for address in bus.slaves]
+        for plan in plans:
+            master.poll(plan)
+        latencies = []
+        bus.reset_stats()
+        start = ticks_us()
+        for _ in range(scans):
+            begin = ticks_us()
+            for plan in plans:
+                master.poll(plan)
+            latencies.append(ticks_diff(ticks_us(), begin) // 1000)
+        elapsed = ticks_diff(ticks_us(), start)
+        stats = bus.stats()
+        latencies.sort()
+        print('{:<6} {:<22} {:>6} {:>9.2f} {:>8} {:>8} {:>7.0f}% {:>8}'.format(
+            'bus', name, scans, scans * 1000000 / elapsed, latencies[len(latencies) // 2], latencies[-1],
+            stats['utilization'] * 100, stats['timeouts'] + stats['crc_errors']))
+
+
+def main(argv: list) -> None:
+    count = 200
+    slaves = 30
+    baudrate = 9600
+    paths = [BASE + '/../lib']
+    sections = []
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg == '-n':
+            count = int(args.pop(0))
+        elif arg == '-s':
+            slaves = int(args.pop(0))
+        elif arg == '-b':
+            baudrate = int(args.pop(0))
+        elif arg == '-p':
+            paths.append(args.pop(0))
+        else:
+            sections.append(arg)
+    host.install(paths)
+
+    print('Mela benchmark on {} {}'.format(sys.implementation.name, sys.version.split()[0]))
+    if not sections or 'rtu' in sections:
+        header('Modbus RTU, Mela master to Mela slave over a loopback UART')
+        bench_rtu(count)
+    if not sections or 'tcp' in sections:
+        header('Modbus TCP, Mela pipeline to the asyncio Mela slave over localhost')
+        bench_tcp(count)
+    if not sections or 'boot' in sections:
+        header('Boot time')
+        bench_boot(max(1, count // 20))
+    if not sections or 'bus' in sections:
+        print()
+        print('Modbus RTU scan of {} meters over a simulated RS485 line at {} baud'.format(slaves, baudrate))
+        print('{:<6} {:<22} {:>6} {:>9} {:>8} {:>8} {:>8} {:>8}'.format('', '', 'scans', 'scans/s', 'p50 ms', 'max ms', 'line', 'errors'))
+        bench_bus(count, slaves, baudrate)
+    if not sections or 'alloc' in sections:
+        bench_alloc(max(1, count // 10))
+    if not sections or 'defs' in sections:
+        print()
+        print('Heap kept per 100 register points ({})'.format('heap' if host.IS_MICROPYTHON else 'tracemalloc'))
+        print('{:<6} {:<22} {:>6} {:>10} {:>10} {:>10}'.format('', '', 'points', 'config', 'slave', 'total'))
+        bench_defs()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,18 +2,15 @@ from machine import Timer
 
 timer_0 = Timer(0) # Between 0-3 for ESP32
 
-def interruption_handler(timer):
-  tmp_time=plc.rtc.now_em_unixtime.to_bytes(4,'big')
-  bytes_timestamp=(int.from_bytes(bytes([tmp_time[0], tmp_time[1]]),'big'),int.from_bytes(bytes([tmp_time[2], tmp_time[3]]),'big'))
-  plc.modbus_slaveTCP.connection.set_ireg(1,bytes_timestamp)
-  plc.modbus_slaveTCP.connection.set_ireg(3,int(float(plc.info.free(False))*100))
-  plc.modbus_slaveTCP.connection.set_ireg(4,int(float(plc.info.df(False))*100))
+plc.modbus_slaveTCP.publish('TIMESTAMP', lambda: plc.rtc.now_em_unixtime)
+plc.modbus_slaveTCP.publish('FREE_RAM', lambda: float(plc.info.free(False, collect=False)), 5000)
+plc.modbus_slaveTCP.publish('FREE_VFS', lambda: float(plc.info.df(False)), 60000)
 
-timer_0.init(mode=Timer.PERIODIC, period=1000, callback=interruption_handler)
+timer_0.init(mode=Timer.PERIODIC, period=1000, callback=plc.modbus_slaveTCP.timer_callback)
 
 while True:
     try:
-        result = plc.modbus_slaveTCP.connection.process()
+        result = plc.modbus_slaveTCP.process()
         if result:
           print("Response sent.")
     except KeyboardInterrupt:
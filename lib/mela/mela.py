@@ -1,5 +1,135 @@
 import gc
 import os
+import struct
+
+try:
+    from typing import Any, Callable, Dict, Tuple, Union
+except ImportError:
+    pass
+
+# Modbus function codes for reading and the register tables they address
+MODBUS_READ_TABLES = {0x01: 'COILS', 0x02: 'ISTS', 0x03: 'HREGS', 0x04: 'IREGS'}
+MODBUS_READ_FUNCTIONS = {'COILS': 0x01, 'ISTS': 0x02, 'HREGS': 0x03, 'IREGS': 0x04}
+
+
+def modbus_read_values(table: str, pdu: Union[bytes, memoryview], qty: int) -> Union[list, tuple]:
+    """
+    Decode the response PDU of a read request.
+
+    :param table: Register table: 'COILS', 'ISTS', 'HREGS' or 'IREGS'.
+    :param pdu: Response PDU starting with the function code.
+    :param qty: Number of registers or bits requested.
+    :return: Unsigned register values or bit states.
+    """
+    if pdu[0] & 0x80:
+        raise ValueError('slave returned exception code: {:d}'.format(pdu[1]))
+    if table in ('COILS', 'ISTS'):
+        return [bool((pdu[2 + (i >> 3)] >> (i & 7)) & 1) for i in range(qty)]
+    return struct.unpack_from('>%dH' % qty, pdu, 2)
+
+
+def modbus_write_pdu(table: str, address: int, values: list) -> bytes:
+    """
+    Build the request PDU of a write, single register or coil requests for one value.
+
+    :param table: Register table: 'COILS' or 'HREGS'.
+    :param address: First address.
+    :param values: List of values.
+    :return: Request PDU.
+    """
+    qty = len(values)
+    if table == 'COILS':
+        if qty == 1:
+            return struct.pack('>BHH', 0x05, address, 0xFF00 if values[0] else 0)
+        packed = bytearray((qty + 7) // 8)
+        for i, value in enumerate(values):
+            if value:
+                packed[i >> 3] |= 1 << (i & 7)
+        return struct.pack('>BHHB', 0x0F, address, qty, len(packed)) + packed
+    if table == 'HREGS':
+        if qty == 1:
+            return struct.pack('>BHH', 0x06, address, values[0] & 0xFFFF)
+        return struct.pack('>BHHB%dH' % qty, 0x10, address, qty, qty * 2, *[v & 0xFFFF for v in values])
+    raise ValueError('Error. Table {} is not writable.'.format(table))
+
+
+def modbus_serial_init(itf, config: Dict[str, Any]) -> None:
+    """
+    Change the line settings of a umodbus serial interface in place, with the timing its constructor derives from them.
+
+    :param itf: umodbus Serial interface.
+    :param config: Configuration dictionary containing optional 'baudrate', 'data_bits', 'stop_bits' and 'parity'.
+    """
+    baudrate = config.get('baudrate', 9600)
+    data_bits = config.get('data_bits', 8)
+    stop_bits = config.get('stop_bits', 1)
+    itf._uart.init(baudrate=baudrate, bits=data_bits, parity=config.get('parity', None), stop=stop_bits)
+    itf._t1char = (1000000 * (data_bits + stop_bits + 2)) // baudrate
+    itf._inter_frame_delay = (itf._t1char * 3500) // 1000 if baudrate <= 19200 else 1750
+
+
+def backoff_ms(failures: int, backoff_min: float, backoff_max: float) -> int:
+    """
+    Get the delay before the next connection attempt, doubling per failure and jittered to 50-100 %.
+
+    :param failures: Number of failures before this one.
+    :param backoff_min: First delay in seconds.
+    :param backoff_max: Maximum delay in seconds.
+    :return: Delay in milliseconds.
+    """
+    import random
+
+    delay = min(backoff_max, backoff_min * (1 << min(failures, 16)))
+    return int(delay * 1000) * (128 + random.getrandbits(7)) // 256
+
+
+def modbus_crc16_table():
+    """
+    Build the lookup table of the Modbus RTU CRC16 (polynomial 0xA001).
+
+    :return: array('H') of 256 entries.
+    """
+    from array import array
+
+    table = array('H', [0] * 256)
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table[byte] = crc
+    return table
+
+
+def modbus_crc16(buf: Union[bytes, bytearray], n: int, table) -> int:
+    """
+    Calculate the Modbus RTU CRC16 of the start of a buffer without allocating.
+
+    Replaced by a viper routine of the same signature where the port supports it.
+
+    :param buf: Frame buffer.
+    :param n: Number of bytes to include.
+    :param table: Table from modbus_crc16_table.
+    :return: CRC, the low byte is sent first.
+    """
+    crc = 0xFFFF
+    for i in range(n):
+        crc = (crc >> 8) ^ table[(crc ^ buf[i]) & 0xFF]
+    return crc
+
+
+try:
+    import micropython
+
+    @micropython.viper
+    def _modbus_crc16_viper(buf: ptr8, n: int, table: ptr16) -> int:
+        crc = 0xFFFF
+        for i in range(n):
+            crc = (crc >> 8) ^ int(table[(crc ^ int(buf[i])) & 0xFF])
+        return crc
+
+    modbus_crc16 = _modbus_crc16_viper
+except (ImportError, AttributeError, NameError):
+    pass
 #======================================================================================================
 
 #--------------------------------------------------------------------
@@ -12,32 +142,340 @@ class Mela:
     Main class for Mela board.
     """
 
-    def __init__(self):
+    NETWORK_ROLES = ('slaveTCP', 'masterTCP', 'gatewayTCP485')
+    RS485_ROLES = ('slave485', 'master485', 'gatewayTCP485')
+    ROLE_ATTRIBUTES = {'slave485': 'modbus_slave485', 'master485': 'modbus_master485', 'slaveTCP': 'modbus_slaveTCP',
+                       'masterTCP': 'modbus_masterTCP', 'gatewayTCP485': 'modbus_gateway'}
+
+    def __init__(self, compiled_config: bool = False, staged: bool = False):
         """
         Initialize the Mela board with its components and configurations.
+
+        In staged mode the board does not wait for the WLAN: the RTC and the RS485 roles
+        come up at once, the WLAN and the network roles are attached later by
+        attach_network or the network_stage coroutine.
+
+        The 'connect_type' of the modbus configuration is one role or a list of roles which
+        run side by side, e.g. ["slaveTCP", "master485"]; see start_runtime.
+
+        :param compiled_config: Boolean indicating whether to load the configuration from its compiled snapshot.
+        :param staged: Boolean indicating whether to attach the network dependent subsystems in the background.
         """
-        self.info = MelaInfo()
-        self.config = MelaConfig()
-        self.rtc = MelaRTC()
+        import utime as time
 
-        self.wifi = False
-        if self.config.wifi['connect_on_boot']:
-            self.wlan_connect()
+        self.boot_start = time.ticks_us()
+        self.boot_timeline = []
+
+        self.info = self.boot_stage('info', MelaInfo)
+        self.config = self.boot_stage('config', MelaConfig, compiled=compiled_config)
+        try:
+            self.info.setup_gc(self.config.section('memory'))
+        except KeyError:
+            self.info.setup_gc()
+        try:
+            rtc_config = self.config.section('rtc')
+        except KeyError:
+            rtc_config = None
+        self.rtc = self.boot_stage('rtc', MelaRTC, rtc_config)
 
+        self.wifi = False
+        self.wlan = None
+        self.logger = None
         self.modbus_slave485 = None
         self.modbus_master485 = None
         self.modbus_slaveTCP = None
         self.modbus_masterTCP = None
+        self.modbus_gateway = None
+        self.runtime = None
+        self.diagnostics = None
+
+        self.roles = self.parse_roles(self.config.section('modbus', children=False)['connect_type'])
+        network_roles = [role for role in self.roles if role in self.NETWORK_ROLES]
+        connect_on_boot = self.config.wifi['connect_on_boot']
+        self._network_pending = None
+        if staged and (connect_on_boot or network_roles):
+            self._network_pending = [network_roles, False]
+        elif connect_on_boot:
+            self.boot_stage('wlan', self.wlan_connect)
+
+        for role in self.roles:
+            if self._network_pending is None or role not in network_roles:
+                self.boot_stage('modbus_' + role, self.start_modbus, role)
+
+    @classmethod
+    def parse_roles(cls, connect_type: Union[bool, str, list]) -> list:
+        """
+        Get the list of Modbus roles from the 'connect_type' setting.
+
+        :param connect_type: One role, a list of roles or False for none.
+        :return: List of roles.
+        """
+        if not connect_type:
+            return []
+        roles = [connect_type] if isinstance(connect_type, str) else list(connect_type)
+        if 'slave485' in roles and len([role for role in roles if role in cls.RS485_ROLES]) > 1:
+            raise ValueError('Error. Role slave485 can not share the RS485 port with {}.'.format(roles))
+        return roles
 
-        connect_type = self.config.modbus['connect_type']
+    def start_modbus(self, connect_type: str) -> None:
+        """
+        Create the Modbus wrapper of a role.
+
+        :param connect_type: Role: 'slave485', 'master485', 'slaveTCP', 'masterTCP' or 'gatewayTCP485'.
+        """
         if connect_type == 'slave485':
             self.modbus_slave485 = MelaModbusSlave485(config=self.config.modbus_slave485)
+            self.modbus_slave485.idle = self.info.idle_collect
         elif connect_type == 'master485':
             self.modbus_master485 = MelaModbusMaster485(config=self.config.modbus_master485)
         elif connect_type == 'slaveTCP':
             self.modbus_slaveTCP = MelaModbusSlaveTCP(config=self.config.modbus_slaveTCP, wifi=self.wifi)
+            self.modbus_slaveTCP.idle = self.info.idle_collect
         elif connect_type == 'masterTCP':
             self.modbus_masterTCP = MelaModbusMasterTCP(config=self.config.modbus_masterTCP, wifi=self.wifi)
+        elif connect_type == 'gatewayTCP485':
+            if self.modbus_master485 is None:
+                self.modbus_master485 = MelaModbusMaster485(config=self.config.modbus_master485)
+            self.modbus_gateway = MelaModbusGateway(config=self.config.modbus_gatewayTCP485, wifi=self.wifi, master=self.modbus_master485)
+        self.share_diagnostics()
+
+    def share_diagnostics(self) -> Union[None, 'MelaDiagnostics']:
+        """
+        Let all Modbus roles of the board count into one MelaDiagnostics, the first one configured.
+
+        A slave with a 'diagnostics' section then mirrors the bus statistics of the masters
+        as well. Read them on the REPL with print(plc.diagnostics.report()).
+
+        :return: Shared diagnostics or None if no role has diagnostics configured.
+        """
+        slaves = [w for w in (self.modbus_slave485, self.modbus_slaveTCP) if w]
+        masters = [w for w in (self.modbus_master485, self.modbus_masterTCP) if w]
+        if self.diagnostics is None:
+            for wrapper in slaves + masters:
+                if wrapper.diagnostics is not None:
+                    self.diagnostics = wrapper.diagnostics
+                    break
+        if self.diagnostics is None:
+            return None
+        for slave in slaves:
+            slave.diagnostics = self.diagnostics
+        for master in masters:
+            if master.diagnostics is not self.diagnostics:
+                master.setup_diagnostics(diagnostics=self.diagnostics)
+        return self.diagnostics
+
+#********************************************************************
+    def reload_config(self, data: Dict[str, Any] = None, save: bool = False) -> list:
+        """
+        Apply a new configuration in place, without a reset.
+
+        Only the subsystems whose sections changed are touched: a Modbus role takes its new
+        settings with its reconfigure method, e.g. new register definitions on a running TCP
+        slave keep its socket and a new master485 baud rate leaves the WLAN alone. Roles added
+        to 'connect_type' are started, removed ones are stopped. WLAN settings are used from
+        the next connection check or roaming scan on, the connection is not dropped.
+
+        A 'config.json' which can not be read or parsed is not replaced by the default
+        configuration as on boot, the running configuration is kept instead.
+
+        :param data: New configuration tree, 'config.json' is read again if not given.
+        :param save: Boolean indicating whether to write the new configuration to 'config.json'.
+        :return: Dotted paths of the changed sections, e.g. ['modbus.master485'], empty if nothing was applied.
+        """
+        if data is None:
+            try:
+                data = self.config.load_config(strict=True)
+            except (OSError, ValueError) as e:
+                print('Failed reading configuration file: {}. Keeping the running configuration.'.format(e))
+                return []
+        if not isinstance(data, dict) or not isinstance(data.get('config'), dict):
+            print('Error. Configuration has no config section. Keeping the running configuration.')
+            return []
+        changed = self.config.apply(data)
+        if save and changed:
+            self.config.save_config()
+
+        restart = []
+        for path in changed:
+            if path == 'memory':
+                self.info.setup_gc(self.config.section('memory'))
+            elif path == 'rtc' and self.rtc:
+                rtc_config = self.config.section('rtc')
+                self.rtc.resync_interval = rtc_config.get('resync_interval', 60000)
+                self.rtc.drift_correction = rtc_config.get('drift_correction', True)
+            elif path == 'wifi' and self.wlan:
+                self.wlan.configure(self.config.wifi)
+            elif path == 'logger' and self.logger:
+                self.logger.flush()
+                self.start_logger(self.logger.source)
+            elif path == 'modbus.connect_type':
+                self._reload_roles()
+            elif path.startswith('modbus.'):
+                role = path[len('modbus.'):]
+                wrapper = getattr(self, self.ROLE_ATTRIBUTES.get(role, ''), None)
+                if wrapper is None:
+                    continue
+                if role in self.NETWORK_ROLES:
+                    if wrapper.reconfigure(self.config.section(path), self.wifi):
+                        restart.append(role)
+                elif wrapper.reconfigure(self.config.section(path)):
+                    restart.append(role)
+        self.share_diagnostics()
+
+        if self.runtime is not None:
+            for role in restart:
+                self.runtime.stop(role)
+            self.runtime.start_services()
+        return changed
+
+    def _reload_roles(self) -> None:
+        """
+        Start the roles added to 'connect_type' and stop the removed ones.
+        """
+        roles = self.parse_roles(self.config.section('modbus', children=False)['connect_type'])
+        for role in self.roles:
+            if role in roles:
+                continue
+            if role == 'master485' and 'gatewayTCP485' in roles:
+                continue
+            wrapper = getattr(self, self.ROLE_ATTRIBUTES[role])
+            if wrapper is not None and hasattr(wrapper, 'close'):
+                wrapper.close()
+            if self.runtime is not None:
+                self.runtime.stop(role)
+            setattr(self, self.ROLE_ATTRIBUTES[role], None)
+            if role == 'gatewayTCP485' and 'master485' not in roles:
+                if self.runtime is not None:
+                    self.runtime.stop('master485')
+                self.modbus_master485 = None
+
+        pending = []
+        for role in roles:
+            if role in self.roles and getattr(self, self.ROLE_ATTRIBUTES[role]) is not None:
+                continue
+            if role in self.NETWORK_ROLES and not self.wifi:
+                pending.append(role)
+            else:
+                self.start_modbus(role)
+        if pending:
+            if self._network_pending is None:
+                self._network_pending = [pending, False]
+            else:
+                self._network_pending[0].extend(role for role in pending if role not in self._network_pending[0])
+        self.roles = roles
+
+#********************************************************************
+    def start_logger(self, source: Callable = None) -> 'MelaLogger':
+        """
+        Create the register history logger from the 'logger' configuration section.
+
+        :param source: Function (table, address, qty) returning register values, the read_values of the running slave if not given.
+        :return: MelaLogger object.
+        """
+        if source is None:
+            slave = self.modbus_slave485 or self.modbus_slaveTCP
+            source = slave.read_values if slave else None
+        self.logger = MelaLogger(self.config.section('logger'), self.rtc, self.info, source)
+        return self.logger
+
+    def start_runtime(self) -> 'MelaRuntime':
+        """
+        Create the runtime which serves all Modbus roles of the board as asyncio tasks.
+
+        Usage: asyncio.run(plc.start_runtime().run())
+
+        :return: MelaRuntime object, add the master poll jobs with its poll and every methods.
+        """
+        if self.runtime is None:
+            self.runtime = MelaRuntime(self)
+        return self.runtime
+
+#********************************************************************
+    def boot_stage(self, name: str, func: Callable, *args, **kwargs) -> Any:
+        """
+        Run a boot stage and record its timing in the boot timeline.
+
+        :param name: Stage name.
+        :param func: Callable of the stage.
+        :return: Result of the callable.
+        """
+        import utime as time
+
+        start = time.ticks_us()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            end = time.ticks_us()
+            self.boot_timeline.append((name, time.ticks_diff(start, self.boot_start), time.ticks_diff(end, start)))
+
+    def boot_report(self) -> str:
+        """
+        Get the boot timeline in human-readable form.
+
+        :return: One line per stage with its start and duration in milliseconds.
+        """
+        return '\n'.join('{}: start {:.1f} ms, duration {:.1f} ms'.format(name, start / 1000, duration / 1000)
+                         for name, start, duration in self.boot_timeline)
+
+    def publish_boot_timeline(self, slave: 'MelaModbusSlave', address: int, table: str = 'IREGS') -> None:
+        """
+        Mirror the stage durations into registers of a Modbus slave, one register per stage in milliseconds.
+
+        :param slave: Modbus slave wrapper.
+        :param address: First register address.
+        :param table: Register table, default 'IREGS'.
+        """
+        slave.set_registers(table, address, [min(duration // 1000, 0xFFFF) for name, start, duration in self.boot_timeline])
+
+#********************************************************************
+    def attach_network(self) -> bool:
+        """
+        Attach the network dependent subsystems of a staged boot without blocking.
+
+        The first call starts the WLAN connection, later calls create the network role once
+        the WLAN is up. Call it from the main loop or use the network_stage coroutine.
+
+        :return: True if nothing is pending anymore, False otherwise.
+        """
+        import utime as time
+
+        if self._network_pending is None:
+            return True
+
+        roles, started = self._network_pending
+        if not self.wifi:
+            if not started:
+                self._network_pending[1] = True
+                self._wlan_start = time.ticks_us()
+            if not self.wlan_connect(wait=False):
+                return False
+            end = time.ticks_us()
+            self.boot_timeline.append(('wlan', time.ticks_diff(self._wlan_start, self.boot_start), time.ticks_diff(end, self._wlan_start)))
+
+        self._network_pending = None
+        for role in roles:
+            self.boot_stage('modbus_' + role, self.start_modbus, role)
+        return True
+
+    async def network_stage(self, timeout_ms: int = 30000) -> bool:
+        """
+        Attach the network dependent subsystems of a staged boot as an asyncio task.
+
+        Usage: asyncio.create_task(plc.network_stage())
+
+        :param timeout_ms: Time to wait for the WLAN in milliseconds.
+        :return: True if attached, False on timeout.
+        """
+        import uasyncio as asyncio
+        import utime as time
+
+        start = time.ticks_ms()
+        while not self.attach_network():
+            if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                print('WLAN connection timeout!')
+                return False
+            await asyncio.sleep_ms(100)
+        return True
 
 #********************************************************************
     def wlan_disconnect(self) -> None:
@@ -55,61 +493,256 @@ class Mela:
             raise ConnectionError('Failed to disconnect from WLAN: {}'.format(str(e)))
 
 #********************************************************************
-    def wlan_connect(self) -> bool:
+    def wlan_connect(self, wait: bool = True) -> bool:
         """
         Connect to the WLAN using the configuration provided.
 
-        :return: True if connected successfully, False otherwise.
+        The last good access point is tried directly first, a scan is only done when that fails.
+
+        :param wait: Boolean indicating whether to wait until the connection is established. When not waiting, the call starts or advances the connection, only a scan blocks.
+        :return: True if connected, False otherwise.
+        """
+        if self.wlan is None:
+            self.wlan = MelaWLAN(self.config.wifi, self.info)
+
+        try:
+            connected = self.wlan.connect() if wait else self.wlan.step()
+        except OSError as e:
+            raise ConnectionError('\nWLAN connection problem: {}'.format(str(e)))
+
+        if connected:
+            self.wifi = self.wlan.sta_if
+        return connected
+
+
+#--------------------------------------------------------------------
+#
+#    WLAN connection manager class for Mela board
+#
+#--------------------------------------------------------------------
+class MelaWLAN:
+    """
+    A class to connect the WLAN quickly and keep it connected to the best configured access point.
+    """
+
+    CACHE_FILE = 'wlan.json'
+    FAIL_STATUS = (200, 201, 202, 203, 204)
+
+    def __init__(self, config: Dict[str, Any], info: 'MelaInfo' = None):
+        """
+        Initialize the connection manager.
+
+        :param config: WiFi configuration dictionary containing 'networks' and optional 'connect_timeout' (ms), 'direct_timeout' (ms), 'roam_rssi' (dBm), 'roam_hysteresis' (dB), 'roam_interval' (ms), 'check_interval' (ms) and 'run_scan' (bool, allow run to scan, see run).
+        :param info: MelaInfo instance used for scanning.
         """
         import network
+
+        self.configure(config)
+        self.info = info or MelaInfo()
+        self.sta_if = network.WLAN(network.STA_IF)
+        self.last = self.load_last()
+        self.current = None
+        self._state = None
+        self._deadline = 0
+
+    def configure(self, config: Dict[str, Any]) -> None:
+        """
+        Take the settings of a WiFi configuration, the current connection is kept.
+
+        :param config: WiFi configuration dictionary as in the constructor.
+        """
+        self.networks = config['networks']
+        self.connect_timeout = config.get('connect_timeout', 10000)
+        self.direct_timeout = config.get('direct_timeout', 3000)
+        self.roam_rssi = config.get('roam_rssi', -75)
+        self.roam_hysteresis = config.get('roam_hysteresis', 8)
+        self.roam_interval = config.get('roam_interval', 60000)
+        self.check_interval = config.get('check_interval', 5000)
+        self.run_scan = config.get('run_scan', False)
+
+    def load_last(self) -> Union[None, Dict[str, Any]]:
+        """
+        Load the last good access point.
+
+        :return: Dictionary with 'ssid', 'bssid' and 'channel' or None.
+        """
+        import ujson as json
+
+        try:
+            with open(self.CACHE_FILE, 'r') as cache_file:
+                last = json.load(cache_file)
+            last['bssid'] = bytes.fromhex(last['bssid'])
+            return last if self._key(last['ssid']) is not None else None
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save_last(self, ssid: str, bssid: bytes, channel: int) -> None:
+        """
+        Persist the last good access point, the file is only written when it changes.
+
+        :param ssid: Network name.
+        :param bssid: MAC address of the access point.
+        :param channel: WiFi channel.
+        """
+        import ujson as json
+
+        last = {'ssid': ssid, 'bssid': bssid, 'channel': channel}
+        if last == self.last:
+            return
+        self.last = last
+        try:
+            with open(self.CACHE_FILE, 'w') as cache_file:
+                json.dump({'ssid': ssid, 'bssid': bssid.hex(), 'channel': channel}, cache_file)
+        except OSError as e:
+            print('Failed writing WLAN cache: {}'.format(e))
+
+    def _key(self, ssid: str) -> Union[None, str]:
+        """
+        Get the key of a configured network.
+        """
+        for wlan in self.networks:
+            if wlan['ssid'] == ssid:
+                return wlan['key']
+        return None
+
+    def best(self) -> Union[None, Tuple[str, bytes, int, int]]:
+        """
+        Scan and find the strongest configured access point.
+
+        The scan blocks for a few seconds.
+
+        :return: Tuple (ssid, bssid, channel, rssi) or None if no configured network was found.
+        """
+        for ssid, bssid, channel, rssi, authmode, hidden in sorted(self.info.wlan_scan(False), key=lambda x: x[3], reverse=True):
+            ssid = ssid.decode('utf-8')
+            if self._key(ssid) is not None:
+                return ssid, bssid, channel, rssi
+        return None
+
+    def _start(self, ssid: str, bssid: bytes, channel: int, state: str) -> None:
+        """
+        Start connecting to an access point.
+        """
         import utime as time
 
-        sta_if = network.WLAN(network.STA_IF)
-        sta_if.active(True)
-        
-        if sta_if.isconnected():
-            print('WLAN already connected. Board IP: {}'.format(sta_if.ifconfig()[0]))
-            self.wifi = sta_if
+        print('WLAN connecting to ssid: %s chan: %d bssid: %s' % (ssid, channel, bssid.hex('-')))
+        self.sta_if.connect(ssid, self._key(ssid), bssid=bssid)
+        self.current = (ssid, bssid, channel)
+        self._state = state
+        self._deadline = time.ticks_add(time.ticks_ms(), self.direct_timeout if state == 'direct' else self.connect_timeout)
+
+    def step(self, scan: bool = True) -> bool:
+        """
+        Start or advance the connection.
+
+        The cached access point is tried first, on failure or timeout the manager scans
+        and connects to the strongest configured access point. Only the scan blocks, for a
+        few seconds; without scan a failed direct attempt is started again instead.
+
+        :param scan: Boolean indicating whether the call may scan.
+        :return: True if connected, False otherwise.
+        """
+        import utime as time
+
+        if self.sta_if.isconnected():
+            if self._state is not None:
+                self._state = None
+                print('WLAN connected. Board IP: {}'.format(self.sta_if.ifconfig()[0]))
+                if self.current:
+                    self.save_last(self.current[0], self.current[1], self.current[2])
             return True
-        
-        try:
-            wlan_found = False
-            print('Scanning WLANs')
-            wlans = self.info.wlan_scan(False)
-            
-            for ssid, bssid, channel, rssi, authmode, hidden in sorted(wlans, key=lambda x: x[3], reverse=True):
-                ssid = ssid.decode('utf-8')
-                ssid_cf = [wlan for wlan in self.config.wifi['networks'] if wlan['ssid'] == ssid]
-                
-                if ssid_cf:
-                    print("WLAN ssid: %s found at chan: %d rssi: %d bssid: %s" % (ssid, channel, rssi, bssid.hex('-')))
-                    wlan_found = True
-                    break
-            
-            if not wlan_found:
-                print('WLAN not found!')
+
+        if self._state is None:
+            self.sta_if.active(True)
+            if self.last:
+                self._start(self.last['ssid'], self.last['bssid'], self.last['channel'], 'direct')
                 return False
-            
-            print('Trying to connect...')
-            start = time.ticks_ms()
-            sta_if.connect(ssid_cf[0]['ssid'], ssid_cf[0]['key'])
-            
-            for _ in range(100):
-                if sta_if.isconnected():
-                    print('\nConnected! Time: %d ms. Board IP: %s' % (time.ticks_diff(time.ticks_ms(), start), sta_if.ifconfig()[0]))
-                    self.wifi = sta_if
-                    return True
-                else:
-                    print('.', end='')
-                    time.sleep_ms(100)
-            
-            print('\nConnection timeout!')
-            sta_if.disconnect()
-            sta_if.active(False)
+            self._state = 'scan'
+        elif self.sta_if.status() in self.FAIL_STATUS or time.ticks_diff(time.ticks_ms(), self._deadline) > 0:
+            print('WLAN connection to {} failed.'.format(self.current[0] if self.current else '?'))
+            self.sta_if.disconnect()
+            self._state = 'scan' if self._state == 'direct' else None
+            if self._state is None:
+                return False
+        else:
             return False
-        
-        except OSError as e:
-            raise ConnectionError('\nWLAN connection problem: {}'.format(str(e)))
+
+        if not scan:
+            self._state = None
+            return False
+        found = self.best()
+        if found is None:
+            print('WLAN not found!')
+            self._state = None
+            return False
+        self._start(found[0], found[1], found[2], 'scanned')
+        return False
+
+    def connect(self, timeout_ms: int = None) -> bool:
+        """
+        Connect and wait for the connection.
+
+        :param timeout_ms: Overall timeout in milliseconds, default direct and connect timeout.
+        :return: True if connected, False otherwise.
+        """
+        import utime as time
+
+        start = time.ticks_ms()
+        timeout_ms = timeout_ms or self.direct_timeout + self.connect_timeout
+        while not self.step():
+            if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                print('WLAN connection timeout!')
+                return False
+            time.sleep_ms(50)
+        return True
+
+    async def connect_async(self, timeout_ms: int = None, scan: bool = True) -> bool:
+        """
+        Connect as an asyncio task, the loop only blocks while scanning, see step.
+
+        :param timeout_ms: Overall timeout in milliseconds, default direct and connect timeout.
+        :param scan: Boolean indicating whether to scan when the cached access point fails.
+        :return: True if connected, False otherwise.
+        """
+        import uasyncio as asyncio
+        import utime as time
+
+        start = time.ticks_ms()
+        timeout_ms = timeout_ms or self.direct_timeout + self.connect_timeout
+        while not self.step(scan):
+            if time.ticks_diff(time.ticks_ms(), start) > timeout_ms:
+                return False
+            await asyncio.sleep_ms(50)
+        return True
+
+    async def run(self) -> None:
+        """
+        Keep the WLAN connected and roam to a stronger configured access point when the signal degrades.
+
+        A scan blocks the asyncio loop, and with it every served Modbus role, for a few seconds.
+        Unless 'run_scan' is set the task therefore does not roam, and it reconnects to the last
+        access point without scanning; it only scans when no access point is cached yet.
+
+        Usage: asyncio.create_task(plc.wlan.run())
+        """
+        import uasyncio as asyncio
+        import utime as time
+
+        last_roam = time.ticks_add(time.ticks_ms(), -self.roam_interval)
+        while True:
+            if not self.sta_if.isconnected():
+                await self.connect_async(scan=self.run_scan or not self.last)
+            elif self.run_scan:
+                rssi = self.sta_if.status('rssi')
+                if rssi < self.roam_rssi and time.ticks_diff(time.ticks_ms(), last_roam) >= self.roam_interval:
+                    last_roam = time.ticks_ms()
+                    found = self.best()
+                    if found and (not self.current or found[1] != self.current[1]) and found[3] >= rssi + self.roam_hysteresis:
+                        print('WLAN roaming from rssi {} to {} ({} dBm).'.format(rssi, found[1].hex('-'), found[3]))
+                        self.sta_if.disconnect()
+                        self._start(found[0], found[1], found[2], 'scanned')
+                        await self.connect_async()
+            await asyncio.sleep_ms(self.check_interval)
 
 
 #--------------------------------------------------------------------
@@ -122,11 +755,82 @@ class MelaConfig:
     A class to manage saving and loading configuration for the Mela board.
     """
 
-    def __init__(self):
+    COMPILED_FILE = 'config.bin'
+    COMPILED_MAGIC = b'MCFG'
+
+    def __init__(self, compiled: bool = False):
         """
         Initialize the MelaConfig class and load the configuration.
+
+        In compiled mode the configuration is read from a binary snapshot of 'config.json',
+        which is rebuilt when the hash of the JSON file changes. Sections are then loaded
+        from flash on first access and kept until a new configuration is applied, the full
+        tree is only parsed when 'data' is used.
+
+        :param compiled: Boolean indicating whether to use the compiled configuration snapshot.
+        """
+        self.compiled = compiled
+        self._data = None
+        self._index = None
+        self._sections = {}
+        if compiled:
+            self._index = self.load_compiled()
+        if self._index is None:
+            self._data = self.load_config()
+        self._snapshot = self._index is not None
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """
+        Get the full configuration tree, parsing 'config.json' on first use in compiled mode.
+
+        :return: Configuration dictionary.
+        """
+        if self._data is None:
+            self._data = self.load_config()
+        return self._data
+
+    @data.setter
+    def data(self, value: Dict[str, Any]) -> None:
+        self._data = value
+        self._snapshot = False
+        self._sections = {}
+
+    def section(self, path: str, children: bool = True) -> Dict[str, Any]:
+        """
+        Get a section of the configuration.
+
+        While running from the compiled snapshot sections are read from it, even if 'data' was
+        parsed from an edited 'config.json' since, and kept until the configuration is replaced.
+
+        :param path: Dotted path below 'config', e.g. 'modbus.slave485'.
+        :param children: Boolean indicating whether to include subsections stored separately in the snapshot.
+        :return: Section dictionary.
         """
-        self.data = self.load_config()
+        if not self._snapshot:
+            section = self.data['config']
+            for key in path.split('.'):
+                section = section[key]
+            return section
+
+        section = self._sections.get((path, children))
+        if section is not None:
+            return section
+
+        import ujson as json
+
+        with open(self.COMPILED_FILE, 'rb') as compiled_file:
+            offset, length = self._index[path]
+            compiled_file.seek(offset)
+            section = json.loads(compiled_file.read(length))
+            if children:
+                prefix = path + '.'
+                for key, (offset, length) in self._index.items():
+                    if key.startswith(prefix) and '.' not in key[len(prefix):]:
+                        compiled_file.seek(offset)
+                        section[key[len(prefix):]] = json.loads(compiled_file.read(length))
+        self._sections[(path, children)] = section
+        return section
 
     @property
     def wifi(self) -> Dict[str, Any]:
@@ -135,7 +839,7 @@ class MelaConfig:
 
         :return: WiFi configuration dictionary.
         """
-        return self.data['config']['wifi']
+        return self.section('wifi')
 
     @property
     def modbus(self) -> Dict[str, Any]:
@@ -144,7 +848,7 @@ class MelaConfig:
 
         :return: Modbus configuration dictionary.
         """
-        return self.data['config']['modbus']
+        return self.section('modbus')
 
     @property
     def modbus_slave485(self) -> Dict[str, Any]:
@@ -153,7 +857,7 @@ class MelaConfig:
 
         :return: Modbus Slave 485 configuration dictionary.
         """
-        return self.data['config']['modbus']['slave485']
+        return self.section('modbus.slave485')
 
     @property
     def modbus_master485(self) -> Dict[str, Any]:
@@ -162,7 +866,7 @@ class MelaConfig:
 
         :return: Modbus Master 485 configuration dictionary.
         """
-        return self.data['config']['modbus']['master485']
+        return self.section('modbus.master485')
 
     @property
     def modbus_slaveTCP(self) -> Dict[str, Any]:
@@ -171,7 +875,7 @@ class MelaConfig:
 
         :return: Modbus Slave TCP configuration dictionary.
         """
-        return self.data['config']['modbus']['slaveTCP']
+        return self.section('modbus.slaveTCP')
 
     @property
     def modbus_masterTCP(self) -> Dict[str, Any]:
@@ -180,25 +884,152 @@ class MelaConfig:
 
         :return: Modbus Master TCP configuration dictionary.
         """
-        return self.data['config']['modbus']['masterTCP']
+        return self.section('modbus.masterTCP')
 
-    def load_config(self) -> Dict[str, Any]:
+    @property
+    def modbus_gatewayTCP485(self) -> Dict[str, Any]:
         """
-        Load the configuration from the 'config.json' file.
+        Get the Modbus TCP to RTU gateway configuration.
 
-        :return: Configuration dictionary.
+        :return: Modbus gateway configuration dictionary.
         """
-        import ujson as json
+        return self.section('modbus.gatewayTCP485')
+
+    def config_hash(self) -> Union[None, bytes]:
+        """
+        Calculate the SHA256 hash of 'config.json'.
+
+        :return: Hash digest or None if the file can not be read.
+        """
+        import hashlib
 
+        digest = hashlib.sha256()
+        buf = bytearray(256)
         try:
-            with open('config.json', 'r') as settings_file:
-                return json.load(settings_file)
-        except (OSError, json.JSONDecodeError) as e:
-            print('Failed reading configuration file: {}. Returning default configuration.'.format(e))
-            return {
-                'config': {
-                    'wifi': {'connect_on_boot': False, 'networks': [{'ssid': 'LAN', 'key': '12345'}]},
-                    'modbus': {
+            with open('config.json', 'rb') as settings_file:
+                while True:
+                    n = settings_file.readinto(buf)
+                    if not n:
+                        break
+                    digest.update(buf if n == len(buf) else buf[:n])
+        except OSError:
+            return None
+        return digest.digest()
+
+    def load_compiled(self) -> Union[None, Dict[str, Tuple[int, int]]]:
+        """
+        Load the section index of the compiled snapshot, rebuilding the snapshot if 'config.json' changed.
+
+        :return: Section index {path: (offset, length)} or None if no snapshot is available.
+        """
+        self._sections = {}
+        digest = self.config_hash()
+        if digest is None:
+            return None
+
+        try:
+            with open(self.COMPILED_FILE, 'rb') as compiled_file:
+                magic, stored_digest, count = struct.unpack('<4s32sH', compiled_file.read(38))
+                if magic == self.COMPILED_MAGIC and stored_digest == digest:
+                    index = {}
+                    for _ in range(count):
+                        name_len = compiled_file.read(1)[0]
+                        name = compiled_file.read(name_len).decode()
+                        index[name] = struct.unpack('<II', compiled_file.read(8))
+                    return index
+        except (OSError, ValueError, IndexError):
+            pass
+
+        try:
+            data = self.load_config(strict=True)
+        except (OSError, ValueError) as e:
+            print('Failed reading configuration file: {}. Not compiling the snapshot.'.format(e))
+            return None
+        print('Compiling configuration snapshot.')
+        index = self.compile(data, digest)
+        del data
+        gc.collect()
+        return index
+
+    def compile(self, data: Dict[str, Any], digest: bytes = None) -> Union[None, Dict[str, Tuple[int, int]]]:
+        """
+        Write the binary snapshot of a configuration.
+
+        Each top level section and each of its dictionary children is stored as a separate record.
+
+        :param data: Configuration dictionary.
+        :param digest: Hash of 'config.json' the snapshot belongs to.
+        :return: Section index {path: (offset, length)} or None if writing failed.
+        """
+        import ujson as json
+
+        records = []
+        for key, value in data['config'].items():
+            if isinstance(value, dict):
+                records.append((key, json.dumps(dict((k, v) for k, v in value.items() if not isinstance(v, dict))).encode()))
+                for child, child_value in value.items():
+                    if isinstance(child_value, dict):
+                        records.append((key + '.' + child, json.dumps(child_value).encode()))
+            else:
+                records.append((key, json.dumps(value).encode()))
+
+        offset = 38 + sum(1 + len(name) + 8 for name, payload in records)
+        index = {}
+        try:
+            with open(self.COMPILED_FILE + '.tmp', 'wb') as compiled_file:
+                compiled_file.write(struct.pack('<4s32sH', self.COMPILED_MAGIC, digest or self.config_hash() or bytes(32), len(records)))
+                for name, payload in records:
+                    index[name] = (offset, len(payload))
+                    compiled_file.write(bytes((len(name),)) + name.encode() + struct.pack('<II', offset, len(payload)))
+                    offset += len(payload)
+                for name, payload in records:
+                    compiled_file.write(payload)
+            self.replace_file(self.COMPILED_FILE + '.tmp', self.COMPILED_FILE)
+        except OSError as e:
+            print('Failed writing configuration snapshot: {}'.format(e))
+            return None
+        return index
+
+    @staticmethod
+    def replace_file(source: str, target: str) -> None:
+        """
+        Rename a file over another one.
+
+        FAT does not rename over an existing file, the target is removed first there, so a
+        reset in between leaves only the source.
+
+        :param source: Name of the new file.
+        :param target: Name of the file to replace.
+        """
+        try:
+            os.rename(source, target)
+        except OSError:
+            os.remove(target)
+            os.rename(source, target)
+
+    def load_config(self, strict: bool = False) -> Dict[str, Any]:
+        """
+        Load the configuration from the 'config.json' file.
+
+        :param strict: Boolean indicating whether to raise instead of returning the default configuration if the file can not be read or parsed.
+        :return: Configuration dictionary.
+        """
+        import ujson as json
+
+        try:
+            with open('config.json', 'r') as settings_file:
+                return json.load(settings_file)
+        except (OSError, ValueError) as e:
+            if strict:
+                raise
+            print('Failed reading configuration file: {}. Returning default configuration.'.format(e))
+            return {
+                'config': {
+                    'wifi': {'connect_on_boot': False, 'networks': [{'ssid': 'LAN', 'key': '12345'}]},
+                    'rtc': {'resync_interval': 60000, 'drift_correction': True},
+                    'memory': {'heap_budget': 0, 'idle_fraction': 0.5, 'idle_interval': 0},
+                    'logger': {'directory': 'log', 'registers': [['IREGS', 1, 4]], 'segment_records': 4096, 'max_segments': 16, 'min_free': 65536, 'batch': 32, 'flush_interval': 60000},
+                    'modbus': {
                         'connect_type': False,
                         'slave485': {
                             'load_definitions_from_config': True,
@@ -208,11 +1039,11 @@ class MelaConfig:
                             'stop_bits': 1,
                             'parity': None,
                             'register_definitions': {
-                                'IREGS': {
-                                    'TIMESTAMP': {'register': 1, 'len': 2, 'val': 0},
-                                    'FREE_RAM': {'register': 3, 'len': 1, 'val': 0},
-                                    'FREE_VFS': {'register': 4, 'len': 1, 'val': 0}
-                                }
+                                'IREGS': [
+                                    ['TIMESTAMP', 1, 2, 'u32', 0],
+                                    ['FREE_RAM', 3, 1, None, 0, {'scale': 0.01}],
+                                    ['FREE_VFS', 4, 1, None, 0, {'scale': 0.01}]
+                                ]
                             }
                         },
                         'master485': {'baudrate': 9600, 'data_bits': 8, 'stop_bits': 1, 'parity': None},
@@ -220,29 +1051,80 @@ class MelaConfig:
                             'load_definitions_from_config': True,
                             'port': 502,
                             'register_definitions': {
-                                'IREGS': {
-                                    'TIMESTAMP': {'register': 1, 'len': 2, 'val': 0},
-                                    'FREE_RAM': {'register': 3, 'len': 1, 'val': 0},
-                                    'FREE_VFS': {'register': 4, 'len': 1, 'val': 0}
-                                }
+                                'IREGS': [
+                                    ['TIMESTAMP', 1, 2, 'u32', 0],
+                                    ['FREE_RAM', 3, 1, None, 0, {'scale': 0.01}],
+                                    ['FREE_VFS', 4, 1, None, 0, {'scale': 0.01}]
+                                ]
                             }
                         },
-                        'masterTCP': {'port': 502, 'slave_ip': False, 'timeout': 5, 'always_reconnect': False}
+                        'masterTCP': {'port': 502, 'slave_ip': False, 'timeout': 5, 'always_reconnect': False},
+                        'gatewayTCP485': {'port': 502, 'max_clients': 4, 'queue_size': 16}
                     }
                 }
             }
 
+    @staticmethod
+    def diff(old: Dict[str, Any], new: Dict[str, Any]) -> list:
+        """
+        Compare two configuration trees below 'config'.
+
+        The children of 'modbus' are compared one by one, the other sections as a whole.
+
+        :param old: Running configuration section dictionary.
+        :param new: New configuration section dictionary.
+        :return: Dotted paths of the sections which differ.
+        """
+        changed = []
+        for key in sorted(set(old) | set(new)):
+            before, after = old.get(key), new.get(key)
+            if key == 'modbus' and isinstance(before, dict) and isinstance(after, dict):
+                changed.extend(key + '.' + child for child in sorted(set(before) | set(after)) if before.get(child) != after.get(child))
+            elif before != after:
+                changed.append(key)
+        return changed
+
+    def apply(self, data: Dict[str, Any]) -> list:
+        """
+        Replace the running configuration.
+
+        :param data: New configuration tree.
+        :return: Dotted paths of the changed sections, see diff.
+        """
+        changed = self.diff(self.running(), data['config'])
+        self.data = data
+        return changed
+
+    def running(self) -> Dict[str, Any]:
+        """
+        Get the configuration tree below 'config' the board is running with.
+
+        In compiled mode the tree is assembled from the snapshot sections until a new
+        configuration is applied, as 'data' holds the possibly edited 'config.json'.
+
+        :return: Configuration section dictionary.
+        """
+        if not self._snapshot:
+            return self.data['config']
+        return dict((key, self.section(key)) for key in self._index if '.' not in key)
+
     def save_config(self) -> bool:
         """
         Save the current configuration to the 'config.json' file.
 
+        The file is written to 'config.json.tmp' and renamed over 'config.json', so a reset
+        while saving leaves either the old or the new configuration.
+
         :return: True if the configuration was saved successfully, False otherwise.
         """
         import ujson as json
 
         try:
-            with open('config.json', 'w') as settings_file:
+            with open('config.json.tmp', 'w') as settings_file:
                 json.dump(self.data, settings_file)
+            self.replace_file('config.json.tmp', 'config.json')
+            if self.compiled:
+                self._index = self.compile(self.data)
             return True
         except OSError as e:
             print('Failed writing configuration file: {}'.format(e))
@@ -262,9 +1144,137 @@ class MelaInfo:
         """
         Initialize the MelaInfo class and enable garbage collection if not already enabled.
         """
+        self.heap_budget = 0
+        self.idle_fraction = 0.5
+        self.idle_interval = 0
+        self.collections = 0
+        self.collect_us = 0
+        self.collect_max_us = 0
+        self.collect_last_us = 0
+        self._collected_ms = 0
+        self._alloc_after = 0
+
         if not gc.isenabled():
             gc.enable()
+        self.collect()
+
+    #********************************************************************
+    def setup_gc(self, config: Dict[str, Any] = None) -> None:
+        """
+        Set the automatic collection threshold from the heap budget.
+
+        The budget is the number of bytes which may be allocated before the allocator collects
+        on its own. It is a backstop only: idle_collect collects earlier, between served requests.
+
+        :param config: Memory configuration dictionary containing optional 'heap_budget' (bytes, default a quarter of the heap), 'idle_fraction' (part of the budget allocated before idle_collect collects) and 'idle_interval' (ms, collect in the next idle window after this time, 0 to disable).
+        """
+        config = config or {}
+        self.heap_budget = config.get('heap_budget') or (gc.mem_free() + gc.mem_alloc()) // 4
+        self.idle_fraction = config.get('idle_fraction', 0.5)
+        self.idle_interval = config.get('idle_interval', 0)
+        gc.threshold(self.heap_budget)
+
+    #********************************************************************
+    def collect(self) -> int:
+        """
+        Run a garbage collection and record its duration.
+
+        :return: Duration of the collection in microseconds.
+        """
+        import utime as time
+
+        start = time.ticks_us()
         gc.collect()
+        duration = time.ticks_diff(time.ticks_us(), start)
+        self.collections += 1
+        self.collect_us += duration
+        self.collect_last_us = duration
+        self.collect_max_us = max(self.collect_max_us, duration)
+        self._collected_ms = time.ticks_ms()
+        self._alloc_after = gc.mem_alloc()
+        return duration
+
+    #********************************************************************
+    def idle_collect(self) -> bool:
+        """
+        Collect in an idle window if enough of the heap budget was used or the idle interval passed.
+
+        Call it when no request is being served, e.g. when the slave process call returned without a request.
+
+        :return: True if a collection was run, False otherwise.
+        """
+        import utime as time
+
+        if self.heap_budget and gc.mem_alloc() - self._alloc_after >= self.heap_budget * self.idle_fraction:
+            self.collect()
+            return True
+        if self.idle_interval and time.ticks_diff(time.ticks_ms(), self._collected_ms) >= self.idle_interval:
+            self.collect()
+            return True
+        return False
+
+    #********************************************************************
+    def heap_stats(self, probe: bool = False) -> Dict[str, int]:
+        """
+        Get the heap statistics.
+
+        'free' and 'alloc' describe the MicroPython GC heap. Its largest free block is only measured
+        with probe, by allocating blocks of bisected sizes; a failing allocation makes the allocator
+        collect, so probe from an idle window only. 'idf_largest_free' is the largest free block of
+        the ESP-IDF data heaps, which hold the network and driver buffers, if the port provides
+        esp32.idf_heap_info, otherwise it is None.
+
+        :param probe: Boolean indicating whether to measure the largest free block of the GC heap.
+        :return: Dictionary with 'free', 'alloc', 'largest_free' (None without probe), 'idf_largest_free', 'collections', 'collect_last_us', 'collect_max_us' and 'collect_us'.
+        """
+        try:
+            import esp32
+            idf_largest = max([region[2] for region in esp32.idf_heap_info(esp32.HEAP_DATA)] or [0])
+        except (ImportError, AttributeError):
+            idf_largest = None
+        free = gc.mem_free()
+        return {
+            'free': free,
+            'alloc': gc.mem_alloc(),
+            'largest_free': self.largest_free(free) if probe else None,
+            'idf_largest_free': idf_largest,
+            'collections': self.collections,
+            'collect_last_us': self.collect_last_us,
+            'collect_max_us': self.collect_max_us,
+            'collect_us': self.collect_us
+        }
+
+    #********************************************************************
+    def largest_free(self, free: int = None) -> int:
+        """
+        Measure the largest block the GC heap can allocate, by bisecting the size of a test allocation.
+
+        A failing allocation makes the allocator collect, so this takes several collections on a fragmented heap.
+
+        :param free: Upper bound in bytes, default gc.mem_free().
+        :return: Size of the largest allocatable block in bytes, to 16 bytes.
+        """
+        low = 0
+        high = (gc.mem_free() if free is None else free) + 1
+        while high - low > 16:
+            size = (low + high) // 2
+            try:
+                block = bytearray(size)
+                del block
+                low = size
+            except MemoryError:
+                high = size
+        return low
+
+    #********************************************************************
+    def vfs(self) -> Tuple[int, int]:
+        """
+        Get the filesystem size and free space.
+
+        :return: Tuple (total bytes, free bytes).
+        """
+        s = os.statvfs('//')
+        return s[1] * s[2], s[0] * s[3]
 
     #********************************************************************
     def df(self, prn: bool = True) -> Union[str, float]:
@@ -274,9 +1284,9 @@ class MelaInfo:
         :param prn: Boolean indicating whether to print the information.
         :return: Filesystem usage information as a string or percentage free space as a float.
         """
-        s = os.statvfs('//')
-        total = (s[1] * s[2]) / 1048576
-        free = (s[0] * s[3]) / 1048576
+        total, free = self.vfs()
+        total = total / 1048576
+        free = free / 1048576
         percent_free = (free / total) * 100
         if prn:
             return f'VFS: Total: {total:.2f} Mb Free: {free:.2f} Mb ({percent_free:.2f}%)'
@@ -284,14 +1294,16 @@ class MelaInfo:
             return f'{percent_free:.2f}'
 
     #********************************************************************
-    def free(self, prn: bool = True) -> Union[str, float]:
+    def free(self, prn: bool = True, collect: bool = True) -> Union[str, float]:
         """
         Get the RAM usage information.
 
         :param prn: Boolean indicating whether to print the information.
+        :param collect: Boolean indicating whether to collect before reading, use False in time critical code.
         :return: RAM usage information as a string or percentage free space as a float.
         """
-        gc.collect()
+        if collect:
+            self.collect()
         free = gc.mem_free()
         allocated = gc.mem_alloc()
         total = free + allocated
@@ -353,18 +1365,116 @@ class MelaInfo:
 class MelaRTC:
     """
     A class to manage the DS1307 RTC module.
+
+    The clock registers are read in a single I2C burst and anchored to ticks_ms; the time is then
+    served from the anchor and the DS1307 is only read again when the resync interval expires.
     """
 
-    def __init__(self):
+    EPOCH_OFFSET = 946684800
+    DRIFT_RESOLUTION = 1000
+    DRIFT_NOISE = 20
+    DRIFT_BASELINE = DRIFT_RESOLUTION * 1000000 // DRIFT_NOISE
+    DRIFT_LIMIT = 1000
+
+    def __init__(self, config: Dict[str, Any] = None):
         """
         Initialize the DS1307 RTC module.
+
+        :param config: RTC configuration dictionary containing optional 'resync_interval' (ms), 'drift_correction' (bool) and 'address' (I2C address, default 0x68).
         """
         from ds1307 import DS1307
         from machine import SoftI2C, Pin
+
+        config = config or {}
+        self.resync_interval = config.get('resync_interval', 60000)
+        self.drift_correction = config.get('drift_correction', True)
+        self.drift_ppm = 0
+
+        self._addr = config.get('address', 0x68)
+        self._i2c = SoftI2C(scl=Pin(4), sda=Pin(5), freq=800000)
+        self.__ds1307_rtc = DS1307(addr=self._addr, i2c=self._i2c)
+        self._buffer = bytearray(7)
+        self._anchor_secs = None
+        self._anchor_frac = 0
+        self._anchor_ms = 0
+        self._base_secs = 0
+        self._base_ms = 0
+
+    @staticmethod
+    def _bcd(value: int) -> int:
+        return (value >> 4) * 10 + (value & 0x0F)
+
+    def read(self) -> int:
+        """
+        Read the clock registers of the DS1307 in one burst, the chip latches them so the result is never torn.
+
+        :return: Unix time for embedded boards (since 2000-01-01) stored in the DS1307.
+        """
+        import utime as time
+
+        buf = self._buffer
+        self._i2c.readfrom_mem_into(self._addr, 0x00, buf)
+        bcd = self._bcd
+        if buf[2] & 0x40:
+            hour = bcd(buf[2] & 0x1F) % 12 + (12 if buf[2] & 0x20 else 0)
+        else:
+            hour = bcd(buf[2] & 0x3F)
+        return time.mktime((2000 + bcd(buf[6]), bcd(buf[5] & 0x1F), bcd(buf[4] & 0x3F),
+                            hour, bcd(buf[1] & 0x7F), bcd(buf[0] & 0x7F), 0, 0))
+
+    def sync(self) -> None:
+        """
+        Read the DS1307 and move the anchor to it.
+
+        The sub-second phase of the anchor is kept while it still agrees with the DS1307, so the served time
+        does not step back on a resync. The drift of ticks_ms against the DS1307 is measured over a baseline of
+        at least DRIFT_BASELINE ms and applied to the time elapsed since the anchor.
+
+        Both ends of the baseline are only known to DRIFT_RESOLUTION ms, the resolution of the DS1307, so an
+        estimate is uncertain by DRIFT_RESOLUTION / baseline; the baseline is long enough to bring this below
+        DRIFT_NOISE ppm. Estimates within the uncertainty count as no drift. A step of the clock, e.g. the DS1307
+        was set, or an estimate beyond DRIFT_LIMIT ppm starts a new baseline and keeps the last estimate.
+        """
+        import utime as time
+
+        secs = self.read()
+        now = time.ticks_ms()
+        if self._anchor_secs is None:
+            self._anchor_frac = 500
+            self._base_secs, self._base_ms = secs, now
+        else:
+            total = self._anchor_frac + self._corrected(time.ticks_diff(now, self._anchor_ms))
+            predicted = self._anchor_secs + total // 1000
+            if predicted == secs:
+                self._anchor_frac = total % 1000
+            else:
+                self._anchor_frac = 999 if predicted > secs else 0
+
+            elapsed = time.ticks_diff(now, self._base_ms)
+            rebase = elapsed >= 0x10000000 or abs(predicted - secs) > 1 + time.ticks_diff(now, self._anchor_ms) * self.DRIFT_LIMIT // 1000000000
+            if self.drift_correction and elapsed >= self.DRIFT_BASELINE and not rebase:
+                drift = ((secs - self._base_secs) * 1000 - elapsed) * 1000000 // elapsed
+                if abs(drift) > self.DRIFT_LIMIT:
+                    rebase = True
+                elif abs(drift) <= self.DRIFT_RESOLUTION * 1000000 // elapsed:
+                    self.drift_ppm = 0
+                else:
+                    self.drift_ppm = drift
+            if rebase:
+                self._base_secs, self._base_ms = secs, now
+        self._anchor_secs = secs
+        self._anchor_ms = now
+
+    def _corrected(self, elapsed: int) -> int:
+        return elapsed + elapsed * self.drift_ppm // 1000000
+
+    def _seconds(self) -> int:
         import utime as time
 
-        i2c = SoftI2C(scl=Pin(4), sda=Pin(5), freq=800000)
-        self.__ds1307_rtc = DS1307(addr=0x68, i2c=i2c)
+        if self._anchor_secs is None or time.ticks_diff(time.ticks_ms(), self._anchor_ms) >= self.resync_interval:
+            self.sync()
+        elapsed = time.ticks_diff(time.ticks_ms(), self._anchor_ms)
+        return self._anchor_secs + (self._anchor_frac + self._corrected(elapsed)) // 1000
 
     @property
     def now(self) -> str:
@@ -373,7 +1483,7 @@ class MelaRTC:
 
         :return: Current date and time as a string in the format 'YYYY-MM-DD HH:MM:SS'.
         """
-        return str(self.__ds1307_rtc.year)+"-"+str('%0*d' % (2, self.__ds1307_rtc.month))+"-"+str('%0*d' % (2, self.__ds1307_rtc.day))+" "+str('%0*d' % (2, self.__ds1307_rtc.hour))+":"+str('%0*d' % (2, self.__ds1307_rtc.minute))+":"+str('%0*d' % (2, self.__ds1307_rtc.second))
+        return '%04d-%02d-%02d %02d:%02d:%02d' % self.now_raw[:6]
 
     @property
     def now_raw(self) -> Tuple[int, int, int, int, int, int, int, int]:
@@ -382,7 +1492,9 @@ class MelaRTC:
 
         :return: Current date and time as a tuple (year, month, mday, hour, minute, second, weekday, yearday).
         """
-        return self.__ds1307_rtc.datetime
+        import utime as time
+
+        return tuple(time.localtime(self._seconds()))[:8]
 
     @property
     def now_unixtime(self) -> int:
@@ -391,9 +1503,7 @@ class MelaRTC:
 
         :return: Current Unix time.
         """
-        import utime as time
-
-        return time.mktime(self.now_raw) + 946684800
+        return self._seconds() + self.EPOCH_OFFSET
 
     @property
     def now_em_unixtime(self) -> int:
@@ -402,163 +1512,4210 @@ class MelaRTC:
 
         :return: Current Unix time for embedded boards.
         """
-        import utime as time
-
-        return time.mktime(self.now_raw)
+        return self._seconds()
 
 #--------------------------------------------------------------------
 #
-#    Modbus Slave485 class
+#    Logger class
 #
 #--------------------------------------------------------------------
-class MelaModbusSlave485:
+class MelaLogger:
     """
-    A class to manage Modbus RTU slave connections over RS485.
+    A class to keep a history of register values in rotating segment files on the flash.
     """
 
-    def __init__(self, config: dict = None):
+    SEGMENT_MAGIC = b'MLOG'
+    SEGMENT_HEADER = '<4sHH'
+
+    def __init__(self, config: Dict[str, Any] = None, rtc: 'MelaRTC' = None, info: 'MelaInfo' = None, source: Callable = None):
         """
-        Initialize the Modbus RTU slave with the given configuration.
+        Initialize the logger and index the segments already on the filesystem.
+
+        Each record is the RTC time (seconds since 2000-01-01) followed by the configured registers
+        as unsigned 16 bit values. Records are buffered and appended in batches to limit flash wear.
+        A segment starts with a header holding the number of words and a hash of 'registers', the
+        segments written with other registers are kept for the rotation but not read.
 
-        :param config: Configuration dictionary containing 'address', 'baudrate', 'data_bits', 'stop_bits', 'parity', 'load_definitions_from_config', and 'register_definitions'.
+        :param config: Logger configuration dictionary containing 'registers' (list of [table, address, qty]) and optional 'directory', 'segment_records', 'max_segments', 'min_free' (bytes), 'batch' (records) and 'flush_interval' (ms).
+        :param rtc: MelaRTC object used for the timestamps.
+        :param info: MelaInfo object used to check the free space of the filesystem.
+        :param source: Function (table, address, qty) returning a list of register values, e.g. the read_values of a slave.
         """
-        from umodbus.serial import ModbusRTU
+        import utime as time
 
-        if not config:
-            raise ValueError('Error. Configuration is required.')
+        if not config or not config.get('registers'):
+            raise ValueError('Error. Logger registers are required.')
 
-        self.connection = ModbusRTU(
-            addr=config['address'],  # address on bus
-            pins=(16, 15),  # given as tuple (TX-DI, RX-RO)
-            baudrate=config.get('baudrate', 9600),  # optional, default 9600
-            data_bits=config.get('data_bits', 8),  # optional, default 8
-            stop_bits=config.get('stop_bits', 1),  # optional, default 1
-            parity=config.get('parity', None),  # optional, default None
-            ctrl_pin=7,  # optional, control DE/RE
-            uart_id=1  # optional, default 1, see port specific documentation
-        )
+        self.directory = config.get('directory', 'log')
+        self.registers = [tuple(register) for register in config['registers']]
+        self.words = sum(register[2] for register in self.registers)
+        self.record_format = '<I%dH' % self.words
+        self.record_size = struct.calcsize(self.record_format)
+        self.layout = 0
+        for table, address, qty in self.registers:
+            for char in table:
+                self.layout = (self.layout * 31 + ord(char)) & 0xFFFF
+            self.layout = (((self.layout * 31 + address) & 0xFFFF) * 31 + qty) & 0xFFFF
+        self.header = struct.pack(self.SEGMENT_HEADER, self.SEGMENT_MAGIC, self.words, self.layout)
+        self.segment_records = config.get('segment_records', 4096)
+        self.max_segments = config.get('max_segments', 16)
+        self.min_free = config.get('min_free', 65536)
+        self.batch = config.get('batch', 32)
+        self.flush_interval = config.get('flush_interval', 60000)
+        self.rtc = rtc
+        self.info = info
+        self.source = source
 
-        if config['load_definitions_from_config']:
-            self.connection.setup_registers(registers=config['register_definitions'])
+        self._buffer = bytearray(self.batch * self.record_size)
+        self._buffered = 0
+        self._flushed_ms = time.ticks_ms()
+        self.index = []
 
+        try:
+            os.stat(self.directory)
+        except OSError:
+            os.mkdir(self.directory)
+        self._scan()
 
+    def _path(self, seq: int) -> str:
+        return '{}/{:08d}.seg'.format(self.directory, seq)
 
-#--------------------------------------------------------------------
-#
-#    Modbus Master485 class
-#
-#--------------------------------------------------------------------
-class MelaModbusMaster485:
-    """
-    A class to manage Modbus RTU master connections over RS485.
-    """
+    def _scan(self) -> None:
+        """
+        Build the segment index [seq, first time, last time, records, closed] from the first and last record of each file.
 
-    def __init__(self, config: dict = None):
+        A segment with another header is indexed closed and without records, it is only removed by the rotation.
         """
-        Initialize the Modbus RTU master with the given configuration.
+        header = len(self.header)
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.seg'):
+                continue
+            seq = int(name[:-4])
+            size = os.stat(self._path(seq))[6] - header
+            with open(self._path(seq), 'rb') as segment:
+                if segment.read(header) != self.header:
+                    self.index.append([seq, 0, 0, 0, True])
+                    continue
+                count = size // self.record_size
+                entry = [seq, 0, 0, count, size % self.record_size != 0 or count >= self.segment_records]
+                if count:
+                    entry[1] = struct.unpack('<I', segment.read(4))[0]
+                    segment.seek(header + (count - 1) * self.record_size)
+                    entry[2] = struct.unpack('<I', segment.read(4))[0]
+            self.index.append(entry)
+
+    def _remove_oldest(self) -> None:
+        entry = self.index.pop(0)
+        try:
+            os.remove(self._path(entry[0]))
+        except OSError:
+            pass
 
-        :param config: Configuration dictionary containing 'baudrate', 'data_bits', 'stop_bits', and 'parity'.
+    def log(self, values: list = None, timestamp: int = None) -> None:
         """
-        from umodbus.serial import Serial as ModbusRTUMaster
+        Append one record.
 
-        if not config:
-            raise ValueError('Error. Configuration is required.')
+        A new segment is started when the current one is full, was written with other registers
+        or the time went backwards, so the records of every segment stay in time order.
 
-        self.connection = ModbusRTUMaster(
-            pins=(16, 15),  # given as tuple (TX-DI, RX-RO)
-            baudrate=config.get('baudrate', 9600),  # optional, default 9600
-            data_bits=config.get('data_bits', 8),  # optional, default 8
-            stop_bits=config.get('stop_bits', 1),  # optional, default 1
-            parity=config.get('parity', None),  # optional, default None
-            ctrl_pin=7,  # optional, control DE/RE
-            uart_id=1  # optional, default 1, see port specific documentation
-        )
+        :param values: Register values, read from the source if not given.
+        :param timestamp: Time of the record, the RTC time if not given.
+        """
+        import utime as time
 
+        if timestamp is None:
+            timestamp = self.rtc.now_em_unixtime
+        if values is None:
+            if not self.source:
+                raise ValueError('Error. Logger source is required.')
+            values = []
+            for table, address, qty in self.registers:
+                values.extend(self.source(table, address, qty) or [0] * qty)
+        if len(values) != self.words:
+            raise ValueError('Error. Logger record needs {} values.'.format(self.words))
 
-#--------------------------------------------------------------------
-#
-#    Modbus SlaveTCP class
-#
-#--------------------------------------------------------------------
-class MelaModbusSlaveTCP:
-    """
-    A class to manage Modbus TCP slave connections.
-    """
+        entry = self.index[-1] if self.index else None
+        if entry is None or entry[4] or entry[3] >= self.segment_records or timestamp < entry[2]:
+            self.flush()
+            if entry:
+                entry[4] = True
+            entry = [entry[0] + 1 if entry else 1, timestamp, timestamp, 0, False]
+            self.index.append(entry)
+            while len(self.index) > self.max_segments:
+                self._remove_oldest()
+            with open(self._path(entry[0]), 'wb') as segment:
+                segment.write(self.header)
 
-    def __init__(self, config: dict = None, wifi: bool = False):
+        struct.pack_into(self.record_format, self._buffer, self._buffered * self.record_size, timestamp, *[v & 0xFFFF for v in values])
+        self._buffered += 1
+        if not entry[3]:
+            entry[1] = timestamp
+        entry[2] = timestamp
+        entry[3] += 1
+
+        if self._buffered >= self.batch or time.ticks_diff(time.ticks_ms(), self._flushed_ms) >= self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
         """
-        Initialize the Modbus TCP slave with the given configuration and wifi status.
+        Append the buffered records to the current segment, removing the oldest segments while the filesystem is short of space.
+        """
+        import utime as time
 
-        :param config: Configuration dictionary containing 'port', 'load_definitions_from_config', and 'register_definitions'.
-        :param wifi: Wifi connection object.
+        self._flushed_ms = time.ticks_ms()
+        if not self._buffered:
+            return
+        if self.info:
+            while len(self.index) > 1 and self.info.vfs()[1] < self.min_free:
+                self._remove_oldest()
+        with open(self._path(self.index[-1][0]), 'ab') as segment:
+            segment.write(memoryview(self._buffer)[:self._buffered * self.record_size])
+        self._buffered = 0
+
+    def _search(self, segment, count: int, start: int) -> int:
         """
-        from umodbus.tcp import ModbusTCP
+        Find the first record of a segment file which is not older than start.
+        """
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            segment.seek(len(self.header) + middle * self.record_size)
+            if struct.unpack('<I', segment.read(4))[0] < start:
+                low = middle + 1
+            else:
+                high = middle
+        return low
 
-        if not wifi:
-            raise ConnectionError('Error. Wifi not connected.')
+    def query(self, start: int = 0, end: int = 0xFFFFFFFF, limit: int = 0):
+        """
+        Get the records of a time range.
 
-        if not config:
-            raise ValueError('Error. Configuration is required.')
+        Only segments overlapping the range are opened, the first record is found by a binary search.
 
-        self.connection = ModbusTCP()
-        if not self.connection.get_bound_status():
-            self.connection.bind(local_ip=wifi.ifconfig()[0], local_port=config['port'])
+        :param start: First time (seconds since 2000-01-01), inclusive.
+        :param end: Last time, inclusive.
+        :param limit: Maximum number of records, 0 for no limit.
+        :return: Generator of tuples (time, values).
+        """
+        self.flush()
+        returned = 0
+        for seq, first, last, count, closed in list(self.index):
+            if not count or last < start or first > end:
+                continue
+            with open(self._path(seq), 'rb') as segment:
+                segment.seek(len(self.header) + self._search(segment, count, start) * self.record_size)
+                while True:
+                    record = segment.read(self.record_size)
+                    if len(record) < self.record_size:
+                        break
+                    values = struct.unpack(self.record_format, record)
+                    if values[0] > end:
+                        break
+                    yield values[0], values[1:]
+                    returned += 1
+                    if returned == limit:
+                        return
 
-        if config.get('load_definitions_from_config'):
-            self.connection.setup_registers(registers=config['register_definitions'])
+    @property
+    def records(self) -> int:
+        """
+        Get the number of records kept.
+
+        :return: Number of records in all segments.
+        """
+        return sum(entry[3] for entry in self.index)
 
+    @property
+    def span(self) -> Tuple[int, int]:
+        """
+        Get the time range of the history.
+
+        :return: Tuple (first time, last time), (0, 0) if empty.
+        """
+        entries = [entry for entry in self.index if entry[3]]
+        if not entries:
+            return 0, 0
+        return min(entry[1] for entry in entries), max(entry[2] for entry in entries)
 
 #--------------------------------------------------------------------
 #
-#    Modbus MasterTCP class
+#    Register codec class
 #
 #--------------------------------------------------------------------
-class MelaModbusMasterTCP:
+class MelaRegisterCodec:
     """
-    A class to manage Modbus TCP connections.
+    A class to encode and decode typed points of one register table in a preallocated buffer.
     """
 
-    def __init__(self, config: dict = None, wifi: bool = False):
+    TYPES = {'u16': ('>H', 1), 'i16': ('>h', 1), 'u32': ('>I', 2), 'i32': ('>i', 2), 'float32': ('>f', 2)}
+    KINDS = ('u16', 'i16', 'u32', 'i32', 'float32')
+    FLOAT = 4
+
+    def __init__(self, definitions: Dict[str, Dict[str, Any]]):
         """
-        Initialize the Modbus TCP master with the given configuration and wifi status.
+        Compile the point layout once.
 
-        :param config: Configuration dictionary containing 'slave_ip', 'port', 'timeout', and 'always_reconnect'.
-        :param wifi: Boolean indicating if wifi is connected.
+        Each point may set 'type' (u16, i16, u32, i32, float32; default u16), 'order' ('big' puts
+        the high word first, 'little' the low word; default 'big'), 'scale' and 'offset'
+        (value = raw * scale + offset).
+
+        A point is kept as one small integer (buffer position << 8 | KINDS index << 1 | word swap),
+        which takes no heap on MicroPython; scale and offset are kept only for the scaled points.
+        Untyped points longer than one register are raw arrays and are not part of the codec.
+
+        :param definitions: Register definitions of one table, e.g. {'TIMESTAMP': {'register': 1, 'len': 2, 'type': 'u32'}}.
         """
-        if config is None:
-            raise ValueError('Error. Configuration is required.')
-        
-        self.connection = self.reconnect(config, wifi)
+        self.points = {}
+        self.scaling = {}
+        start = None
+        end = 0
+        for name, d in definitions.items():
+            if 'type' in d or d.get('len', 1) == 1:
+                start = d['register'] if start is None else min(start, d['register'])
+        self.start = start = start or 0
+        for name, d in definitions.items():
+            if 'type' not in d and d.get('len', 1) != 1:
+                continue
+            kind = d.get('type', 'u16')
+            if kind not in self.TYPES:
+                raise ValueError('Error. Unknown type {} for point {}.'.format(kind, name))
+            words = self.TYPES[kind][1]
+            if d.get('len', words) != words:
+                raise ValueError('Error. Point {} of type {} needs len {}.'.format(name, kind, words))
+            scale = d.get('scale', 1)
+            offset = d.get('offset', 0)
+            if scale != 1 or offset != 0:
+                self.scaling[name] = (scale, offset)
+            swap = 1 if words == 2 and d.get('order', 'big') == 'little' else 0
+            self.points[name] = (d['register'] - start) * 2 << 8 | self.KINDS.index(kind) << 1 | swap
+            end = max(end, d['register'] + words)
+        end = max(end, start)
 
+        self.buffer = bytearray((end - self.start) * 2)
+        self._scratch = bytearray(4)
 
-    def reconnect(self, config: dict = None, wifi: bool = False) -> bool:
+    @classmethod
+    def initial(cls, definition: Dict[str, Any]) -> Any:
         """
-        Reconnect to the Modbus TCP slave.
+        Get the initial 'val' of a point as the register storage takes it.
 
-        :param config: Configuration dictionary containing 'slave_ip', 'port', and 'timeout', and 'always_reconnect'.
-        :param wifi: Boolean indicating if wifi is connected.
-        :return: Connection status.
+        The value of a typed or scaled point is encoded as set_point does, e.g. 1.5 of a
+        float32 point gives [0x3FC0, 0]. Lists are register values already, they and the
+        values of untyped points are returned as they are.
+
+        :param definition: Point definition, e.g. {'register': 1, 'len': 2, 'type': 'float32', 'val': 1.5}.
+        :return: Value or list of register values.
         """
-        from umodbus.tcp import TCP as ModbusTCPMaster
-        import utime as time
+        value = definition.get('val', 0)
+        if isinstance(value, (list, tuple)):
+            return value
+        if 'type' not in definition and (definition.get('len', 1) != 1 or ('scale' not in definition and 'offset' not in definition)):
+            return value
+        codec = cls({'val': dict(definition, register=0)})
+        codec.encode('val', value)
+        return [codec.word(address) for address in range(codec.span('val')[1])]
 
-        if not wifi:
-            raise ConnectionError('Error. Wifi not connected.')
+    def __contains__(self, name: str) -> bool:
+        """
+        Check if a point is part of this codec.
+        """
+        return name in self.points
 
-        if config is None:
-            raise ValueError('Error. Configuration is required.')
-        
-        while True:
-          try:
-            connection = ModbusTCPMaster(
-                slave_ip=config['slave_ip'],
-                slave_port=config['port'],
-                timeout=config.get('timeout', 5.0)  # optional, timeout in seconds, default 5.0
-            )
-            return connection
-          except Exception as e:
-            print('Error reconnecting to slave. {}'.format(e))
-            if not config.get('always_reconnect', False):
-              raise
-            print('Retrying in 5 seconds...')
-            time.sleep(5)  # Optional: wait before retrying
+    def encode(self, name: str, value: Union[int, float]) -> int:
+        """
+        Encode a value into the buffer.
+
+        :param name: Point name.
+        :param value: Engineering value.
+        :return: Register address of the point.
+        """
+        point = self.points[name]
+        pos = point >> 8
+        kind = (point >> 1) & 7
+        fmt = self.TYPES[self.KINDS[kind]][0]
+        scaling = self.scaling.get(name)
+        if scaling:
+            value = (value - scaling[1]) / scaling[0]
+        if kind != self.FLOAT:
+            value = int(round(value)) if scaling else int(value)
+        if point & 1:
+            scratch = self._scratch
+            struct.pack_into(fmt, scratch, 0, value)
+            buf = self.buffer
+            buf[pos], buf[pos + 1], buf[pos + 2], buf[pos + 3] = scratch[2], scratch[3], scratch[0], scratch[1]
+        else:
+            struct.pack_into(fmt, self.buffer, pos, value)
+        return self.start + pos // 2
+
+    def decode(self, name: str) -> Union[int, float]:
+        """
+        Decode a value from the buffer.
+
+        :param name: Point name.
+        :return: Engineering value.
+        """
+        point = self.points[name]
+        pos = point >> 8
+        fmt = self.TYPES[self.KINDS[(point >> 1) & 7]][0]
+        if point & 1:
+            scratch = self._scratch
+            buf = self.buffer
+            scratch[0], scratch[1], scratch[2], scratch[3] = buf[pos + 2], buf[pos + 3], buf[pos], buf[pos + 1]
+            value = struct.unpack_from(fmt, scratch, 0)[0]
+        else:
+            value = struct.unpack_from(fmt, self.buffer, pos)[0]
+        scaling = self.scaling.get(name)
+        if scaling:
+            value = value * scaling[0] + scaling[1]
+        return value
+
+    def load(self, values: Union[list, tuple], address: int) -> None:
+        """
+        Copy register values read from a device into the buffer.
+
+        :param values: Register values starting at address.
+        :param address: Register address of the first value.
+        """
+        buf = self.buffer
+        first = max(address, self.start)
+        last = min(address + len(values), self.start + len(buf) // 2)
+        for addr in range(first, last):
+            struct.pack_into('>H', buf, (addr - self.start) * 2, values[addr - address] & 0xFFFF)
+
+    def word(self, address: int) -> int:
+        """
+        Get one unsigned register of the buffer.
+
+        :param address: Register address.
+        :return: Register value.
+        """
+        return struct.unpack_from('>H', self.buffer, (address - self.start) * 2)[0]
+
+    def span(self, name: str) -> Tuple[int, int]:
+        """
+        Get the registers used by a point.
+
+        :param name: Point name.
+        :return: Tuple (register address, number of registers).
+        """
+        point = self.points[name]
+        return self.start + (point >> 9), self.TYPES[self.KINDS[(point >> 1) & 7]][1]
+
+
+#--------------------------------------------------------------------
+#
+#    Register point table class
+#
+#--------------------------------------------------------------------
+class MelaPointTable:
+    """
+    A class to keep the register definitions of one table in columns instead of one dictionary per point.
+    """
+
+    TYPES = (None, 'u16', 'i16', 'u32', 'i32', 'float32')
+
+    def __init__(self, rows: list = ()):
+        """
+        Pack point rows.
+
+        A row is [name, register, len, type, val, options]: type is one of TYPES, None for an
+        untyped point, val a value or a list of register values, options a dictionary of the
+        rarely used keys such as 'scale', 'offset', 'order' or 'deadband'. Rows may end after
+        any field, e.g. ["SETPOINT", 0] is one untyped register with the value 0.
+
+        Addresses, lengths, types and initial values are arrays, only the points with options
+        keep a dictionary. Lookups by name, iteration and items yield the usual definition
+        dictionaries built on demand, so the table can stand for the dictionary of a table in
+        'register_definitions'. The name index is built on the first lookup by name.
+
+        :param rows: Point rows as in the compact form of 'register_definitions'.
+        """
+        from array import array
+
+        self.names = []
+        self.addresses = array('H')
+        self.lengths = array('H')
+        self.types = bytearray()
+        self.starts = array('H')
+        self.words = array('H')
+        self.options = {}
+        self._index = None
+        for row in rows:
+            self.append(*row)
+
+    @classmethod
+    def convert(cls, register_definitions: Dict[str, Any], compact: bool = False) -> Dict[str, Any]:
+        """
+        Get register definitions with the tables in compact form as point tables.
+
+        :param register_definitions: Register definitions, each table a dictionary of points or a list of rows.
+        :param compact: Boolean indicating whether to pack the dictionary tables as well.
+        :return: Register definitions, the tables which are lists or, with compact, all tables as MelaPointTable.
+        """
+        tables = {}
+        for table, definitions in register_definitions.items():
+            if isinstance(definitions, (list, tuple)):
+                definitions = cls(definitions)
+            elif compact and isinstance(definitions, dict):
+                definitions = cls.from_definitions(definitions)
+            tables[table] = definitions
+        return tables
+
+    @classmethod
+    def from_definitions(cls, definitions: Dict[str, Dict[str, Any]]) -> 'MelaPointTable':
+        """
+        Pack the definitions of one table given as a dictionary of points.
+
+        :param definitions: Register definitions of one table, e.g. {'TIMESTAMP': {'register': 1, 'len': 2, 'type': 'u32'}}.
+        :return: Point table.
+        """
+        points = cls()
+        for name, definition in definitions.items():
+            points[name] = definition
+        return points
+
+    def append(self, name: str, register: int, length: int = 1, kind: str = None, val: Union[int, list] = 0, options: Dict[str, Any] = None) -> None:
+        """
+        Add a point.
+
+        :param name: Point name.
+        :param register: Register address.
+        :param length: Number of registers.
+        :param kind: Point type from TYPES.
+        :param val: Initial value, encoded with the type, scale and offset of the point, or list of register values.
+        :param options: Dictionary of further definition keys.
+        """
+        if kind not in self.TYPES:
+            raise ValueError('Error. Unknown type {} for point {}.'.format(kind, name))
+        definition = dict(options or (), len=length, val=val)
+        if kind:
+            definition['type'] = kind
+        values = MelaRegisterCodec.initial(definition)
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        if options:
+            self.options[len(self.names)] = options
+        self.names.append(name)
+        self.addresses.append(register)
+        self.lengths.append(length)
+        self.types.append(self.TYPES.index(kind))
+        self.starts.append(len(self.words))
+        for i in range(length):
+            self.words.append(int(values[i]) & 0xFFFF if i < len(values) else 0)
+        if self._index is not None:
+            self._index[name] = len(self.names) - 1
+
+    def row(self, name: str) -> Union[None, int]:
+        """
+        Get the row of a point.
+
+        :param name: Point name.
+        :return: Row index, None if the point is not defined.
+        """
+        if self._index is None:
+            self._index = dict((point, i) for i, point in enumerate(self.names))
+        return self._index.get(name)
+
+    def definition(self, row: int) -> Dict[str, Any]:
+        """
+        Build the definition dictionary of a row.
+
+        'val' holds the register values, as a list for typed and scaled points, which are encoded already.
+
+        :param row: Row index.
+        :return: Definition, e.g. {'register': 1, 'len': 2, 'type': 'u32', 'val': [0, 0]}.
+        """
+        length = self.lengths[row]
+        start = self.starts[row]
+        options = self.options.get(row, ())
+        raw = length == 1 and not self.types[row] and 'scale' not in options and 'offset' not in options
+        definition = {'register': self.addresses[row], 'len': length,
+                      'val': self.words[start] if raw else list(self.words[start:start + length])}
+        if self.types[row]:
+            definition['type'] = self.TYPES[self.types[row]]
+        if row in self.options:
+            definition.update(self.options[row])
+        return definition
+
+    def rows(self) -> list:
+        """
+        Get the points as rows, e.g. to store them in 'config.json'.
+
+        :return: List of rows [name, register, len, type, val] with the options appended where set.
+        """
+        rows = []
+        for row, name in enumerate(self.names):
+            definition = self.definition(row)
+            rows.append([name, definition['register'], definition['len'], definition.get('type'), definition['val']])
+            if row in self.options:
+                rows[-1].append(self.options[row])
+        return rows
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name: str) -> bool:
+        return self.row(name) is not None
+
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        row = self.row(name)
+        if row is None:
+            raise KeyError(name)
+        return self.definition(row)
+
+    def __setitem__(self, name: str, definition: Dict[str, Any]) -> None:
+        """
+        Add a point given as a definition dictionary.
+        """
+        options = dict((k, v) for k, v in definition.items() if k not in ('register', 'len', 'type', 'val'))
+        kind = definition.get('type')
+        length = definition.get('len', MelaRegisterCodec.TYPES[kind][1] if kind in MelaRegisterCodec.TYPES else 1)
+        self.append(name, definition['register'], length, kind, definition.get('val', 0), options)
+
+    def get(self, name: str, default: Any = None) -> Any:
+        row = self.row(name)
+        return default if row is None else self.definition(row)
+
+    def keys(self):
+        return iter(self.names)
+
+    def values(self):
+        for row in range(len(self.names)):
+            yield self.definition(row)
+
+    def items(self):
+        for row, name in enumerate(self.names):
+            yield name, self.definition(row)
+
+    def copy(self) -> 'MelaPointTable':
+        """
+        Get a copy which points can be added to without changing this table.
+        """
+        from array import array
+
+        points = MelaPointTable()
+        points.names = list(self.names)
+        points.addresses = array('H', self.addresses)
+        points.lengths = array('H', self.lengths)
+        points.types = bytearray(self.types)
+        points.starts = array('H', self.starts)
+        points.words = array('H', self.words)
+        points.options = dict(self.options)
+        return points
+
+
+#--------------------------------------------------------------------
+#
+#    Register bank class
+#
+#--------------------------------------------------------------------
+class MelaRegisterBank:
+    """
+    A class to keep the registers of a slave in contiguous preallocated storage.
+    """
+
+    BIT_TABLES = ('COILS', 'ISTS')
+    MAX_GAP = 32
+
+    def __init__(self, register_definitions: Dict[str, Any]):
+        """
+        Allocate the blocks of each table covering its defined addresses.
+
+        Registers are stored as big-endian words, the wire order, so a range read is a memoryview
+        slice which is copied into the response as is. Coils and discrete inputs are a bitfield.
+        Definitions less than MAX_GAP addresses apart share a block, the addresses between them
+        read as 0 and accept writes. A larger hole starts a new block and is outside the bank,
+        so definitions at 0 and 40000 take two registers of storage, not 40001.
+        The initial value of a typed point is encoded with its type, see MelaRegisterCodec.initial.
+
+        The names of tables given as MelaPointTable are looked up in the point table, they are
+        not copied into the name index.
+
+        :param register_definitions: Register definitions as used in the slave configuration.
+        """
+        self.tables = {}
+        self.names = {}
+        self.point_tables = []
+        self.on_set = {}
+        for table, definitions in register_definitions.items():
+            if not definitions:
+                continue
+            spans = sorted((d['register'], d['register'] + d.get('len', 1)) for d in definitions.values())
+            blocks = []
+            start, end = spans[0]
+            for first, last in spans:
+                if first - end > self.MAX_GAP:
+                    blocks.append(self._allocate(table, start, end))
+                    start = first
+                end = max(end, last)
+            blocks.append(self._allocate(table, start, end))
+            self.tables[table] = blocks
+            if isinstance(definitions, MelaPointTable):
+                self.point_tables.append((table, definitions))
+            for name, d in definitions.items():
+                if not isinstance(definitions, MelaPointTable):
+                    self.names[name] = (table, d['register'], d.get('len', 1))
+                value = d.get('val', 0) if table in self.BIT_TABLES else MelaRegisterCodec.initial(d)
+                self.write(table, d['register'], value if isinstance(value, (list, tuple)) else [value])
+                if d.get('on_set_cb'):
+                    for address in range(d['register'], d['register'] + d.get('len', 1)):
+                        self.on_set[(table, address)] = d['on_set_cb']
+
+    def _allocate(self, table: str, start: int, end: int) -> tuple:
+        """
+        Allocate the storage of a block.
+
+        :return: Tuple (first address, number of addresses, storage, memoryview of the storage).
+        """
+        count = end - start
+        storage = bytearray((count + 7) // 8 if table in self.BIT_TABLES else count * 2)
+        return start, count, storage, memoryview(storage)
+
+    def block(self, table: str, address: int, qty: int) -> Union[None, tuple]:
+        """
+        Get the block holding a range, without allocating.
+
+        :param table: Register table.
+        :param address: First address.
+        :param qty: Number of registers or bits.
+        :return: Tuple (first address, number of addresses, storage, memoryview of the storage), None if no block holds the whole range.
+        """
+        blocks = self.tables.get(table)
+        if blocks is not None:
+            for block in blocks:
+                if block[0] <= address and address + qty <= block[0] + block[1]:
+                    return block
+        return None
+
+    def read(self, table: str, address: int, qty: int) -> Union[None, bytearray, memoryview]:
+        """
+        Read a range in Modbus response format.
+
+        :param table: Register table: 'COILS', 'ISTS', 'HREGS' or 'IREGS'.
+        :param address: First address.
+        :param qty: Number of registers or bits.
+        :return: Memoryview of the big-endian registers or the packed bits (first bit in the LSB), None if the range is outside the bank.
+        """
+        block = self.block(table, address, qty)
+        if block is None:
+            return None
+        offset = address - block[0]
+        storage = block[3]
+        if table not in self.BIT_TABLES:
+            return storage[offset * 2:(offset + qty) * 2]
+        packed = bytearray((qty + 7) // 8)
+        for i in range(qty):
+            bit = offset + i
+            if storage[bit >> 3] & (1 << (bit & 7)):
+                packed[i >> 3] |= 1 << (i & 7)
+        return packed
+
+    def values(self, table: str, address: int, qty: int) -> Union[None, list]:
+        """
+        Read a range as a list of values.
+
+        :param table: Register table.
+        :param address: First address.
+        :param qty: Number of registers or bits.
+        :return: List of values, None if the range is outside the bank.
+        """
+        block = self.block(table, address, qty)
+        if block is None:
+            return None
+        offset = address - block[0]
+        storage = block[3]
+        if table in self.BIT_TABLES:
+            return [(storage[bit >> 3] >> (bit & 7)) & 1 for bit in range(offset, offset + qty)]
+        return list(struct.unpack_from('>%dH' % qty, storage, offset * 2))
+
+    def write(self, table: str, address: int, values: list) -> bool:
+        """
+        Write a range of values.
+
+        :param table: Register table.
+        :param address: First address.
+        :param values: List of values.
+        :return: True if the range is inside the bank, False otherwise.
+        """
+        block = self.block(table, address, len(values))
+        if block is None:
+            return False
+        offset = address - block[0]
+        storage = block[3]
+        if table in self.BIT_TABLES:
+            for i, value in enumerate(values):
+                bit = offset + i
+                if value:
+                    storage[bit >> 3] |= 1 << (bit & 7)
+                else:
+                    storage[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+        else:
+            for i, value in enumerate(values):
+                struct.pack_into('>H', storage, (offset + i) * 2, value & 0xFFFF)
+        return True
+
+    def find(self, name: str) -> Union[None, Tuple[str, int, int]]:
+        """
+        Find a named definition.
+
+        :param name: Register name.
+        :return: Tuple (table, address, number of registers), None if the name is not defined.
+        """
+        point = self.names.get(name)
+        if point is None:
+            for table, points in self.point_tables:
+                row = points.row(name)
+                if row is not None:
+                    return table, points.addresses[row], points.lengths[row]
+        return point
+
+    def points(self):
+        """
+        Iterate over all named definitions.
+
+        :return: Generator of tuples (name, table, address, number of registers).
+        """
+        for name, (table, address, length) in self.names.items():
+            yield name, table, address, length
+        for table, points in self.point_tables:
+            for row, name in enumerate(points.names):
+                yield name, table, points.addresses[row], points.lengths[row]
+
+    def get(self, name: str) -> list:
+        """
+        Read the values of a named definition.
+
+        :param name: Register name.
+        :return: List of values.
+        """
+        point = self.find(name)
+        if point is None:
+            raise KeyError(name)
+        return self.values(*point)
+
+    def set(self, name: str, values: Union[int, list]) -> None:
+        """
+        Write the values of a named definition.
+
+        :param name: Register name.
+        :param values: Value or list of values.
+        """
+        point = self.find(name)
+        if point is None:
+            raise KeyError(name)
+        self.write(point[0], point[1], values if isinstance(values, (list, tuple)) else [values])
+
+
+#--------------------------------------------------------------------
+#
+#    Diagnostics classes
+#
+#--------------------------------------------------------------------
+class MelaHistogram:
+    """
+    A class to count durations in a fixed number of logarithmic buckets.
+    """
+
+    BUCKETS = 20
+
+    def __init__(self):
+        """
+        Initialize the empty histogram.
+
+        Bucket 0 counts durations below 64 us, bucket i durations below 64 << i us,
+        the last bucket everything longer.
+        """
+        from array import array
+
+        self.buckets = array('I', [0] * self.BUCKETS)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, us: int) -> None:
+        """
+        Count a duration.
+
+        :param us: Duration in microseconds.
+        """
+        i = 0
+        v = us >> 6
+        while v and i < self.BUCKETS - 1:
+            v >>= 1
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.total += us
+        if us > self.max:
+            self.max = us
+
+    def percentile(self, p: int) -> int:
+        """
+        Get the upper bound of the bucket holding a percentile.
+
+        :param p: Percentile from 1 to 100.
+        :return: Duration in microseconds, at most the maximum seen, 0 if empty.
+        """
+        if not self.count:
+            return 0
+        rank = (self.count * p + 99) // 100
+        seen = 0
+        for i in range(self.BUCKETS):
+            seen += self.buckets[i]
+            if seen >= rank:
+                return min(self.max, 64 << i)
+        return self.max
+
+    def reset(self) -> None:
+        """
+        Clear all counts.
+        """
+        for i in range(self.BUCKETS):
+            self.buckets[i] = 0
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+
+class MelaDiagnostics:
+    """
+    A class to measure the scan cycle, the slave service time and the master bus transactions in fixed memory.
+    """
+
+    HEADER_WORDS = 8
+    KEY_WORDS = 8
+
+    def __init__(self, max_keys: int = 8):
+        """
+        Initialize the statistics.
+
+        Transactions are kept per (slave, function code). When max_keys pairs are tracked,
+        new pairs are counted together under (0, 0).
+
+        :param max_keys: Maximum number of (slave, function code) pairs.
+        """
+        self.max_keys = max_keys
+        self.scan = MelaHistogram()
+        self.service = MelaHistogram()
+        self.transactions = {}
+        self._last_scan = None
+
+    @classmethod
+    def block_length(cls, max_keys: int = 8) -> int:
+        """
+        Get the number of registers of the diagnostic block.
+        """
+        return cls.HEADER_WORDS + cls.KEY_WORDS * max_keys
+
+    def tick(self) -> None:
+        """
+        Mark the start of a main loop iteration, the scan time is the time since the previous mark.
+
+        MelaModbusSlave.process calls it, a loop without a slave calls it once per iteration.
+        """
+        import utime as time
+
+        now = time.ticks_us()
+        if self._last_scan is not None:
+            self.scan.add(time.ticks_diff(now, self._last_scan))
+        self._last_scan = now
+
+    def served(self, us: int) -> None:
+        """
+        Count a request served by a slave.
+
+        :param us: Time from taking the request to sending the response in microseconds.
+        """
+        self.service.add(us)
+
+    def transaction(self, slave_addr: int, function: int, us: int, error: str = None) -> None:
+        """
+        Count a master transaction.
+
+        :param slave_addr: Slave address or unit ID.
+        :param function: Function code of the request.
+        :param us: Round trip time in microseconds.
+        :param error: 'timeout' for no response, 'crc' for a corrupt response, None otherwise.
+        """
+        key = (slave_addr, function & 0x7F)
+        entry = self.transactions.get(key)
+        if entry is None:
+            if len(self.transactions) >= self.max_keys - 1:
+                key = (0, 0)
+                entry = self.transactions.get(key)
+            if entry is None:
+                entry = self.transactions[key] = [MelaHistogram(), 0, 0]
+        if error == 'timeout':
+            entry[1] += 1
+        elif error == 'crc':
+            entry[2] += 1
+        else:
+            entry[0].add(us)
+
+    def registers(self, length: int = None) -> list:
+        """
+        Get the statistics as register values, durations in units of 0.1 ms.
+
+        Words 0-3: scan count, p50, p99, max; words 4-7: service count, p50, p99, max;
+        then per (slave, function code): slave, function code, count, p50, p99, max, timeouts, CRC errors.
+        Counts are taken modulo 65536, durations are limited to 65535.
+
+        :param length: Number of registers, default the block length of max_keys.
+        :return: List of unsigned register values.
+        """
+        def summary(histogram):
+            return [histogram.count & 0xFFFF] + [min(us // 100, 0xFFFF) for us in (histogram.percentile(50), histogram.percentile(99), histogram.max)]
+
+        words = summary(self.scan) + summary(self.service)
+        for (slave_addr, function), (histogram, timeouts, crc_errors) in self.transactions.items():
+            words += [slave_addr, function] + summary(histogram) + [timeouts & 0xFFFF, crc_errors & 0xFFFF]
+        if length is None:
+            length = self.block_length(self.max_keys)
+        return (words + [0] * length)[:length]
+
+    def report(self) -> str:
+        """
+        Get the statistics in human-readable form.
+
+        :return: One line per histogram with count, p50, p99 and max in milliseconds.
+        """
+        def line(name, histogram):
+            return '{}: n {}, p50 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms'.format(
+                name, histogram.count, histogram.percentile(50) / 1000, histogram.percentile(99) / 1000, histogram.max / 1000)
+
+        lines = [line('scan', self.scan), line('service', self.service)]
+        for (slave_addr, function), (histogram, timeouts, crc_errors) in self.transactions.items():
+            lines.append(line('slave {} fc {:02d}'.format(slave_addr, function), histogram) + ', timeouts {}, crc errors {}'.format(timeouts, crc_errors))
+        return '\n'.join(lines)
+
+    def reset(self) -> None:
+        """
+        Clear all statistics.
+        """
+        self.scan.reset()
+        self.service.reset()
+        self.transactions = {}
+        self._last_scan = None
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus Slave base class
+#
+#--------------------------------------------------------------------
+class MelaModbusSlave:
+    """
+    A base class with the functions shared by the Modbus RTU and TCP slaves.
+    """
+
+    connection = None
+    bank = None
+    engine = None
+    changes = None
+    diagnostics = None
+    codecs = None
+    idle = None
+    _sources = None
+    _diagnostics_block = None
+
+    DIAGNOSTICS_NAME = 'MELA_DIAGNOSTICS'
+
+    def setup_codecs(self, register_definitions: Dict[str, Any]) -> None:
+        """
+        Compile the register codecs of the 'HREGS' and 'IREGS' tables.
+
+        :param register_definitions: Register definitions as used in the slave configuration.
+        """
+        self.codecs = {}
+        for table in ('HREGS', 'IREGS'):
+            if register_definitions.get(table):
+                self.codecs[table] = MelaRegisterCodec(register_definitions[table])
+
+    def setup_registers(self, definitions: Dict[str, Any]) -> None:
+        """
+        Add the register definitions to the umodbus register dictionaries.
+
+        The initial value of a typed point is encoded with its type, see MelaRegisterCodec.initial.
+
+        :param definitions: Register definitions as used in the slave configuration.
+        """
+        registers = {}
+        for table, points in definitions.items():
+            if table in ('HREGS', 'IREGS'):
+                points = dict((name, dict(d, val=MelaRegisterCodec.initial(d))) for name, d in points.items())
+            registers[table] = points
+        self.connection.setup_registers(registers=registers)
+
+    def setup_changes(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Enable change tracking if the configuration has a 'change_tracking' section.
+
+        Registers written by a master are reported in every storage mode, with the umodbus
+        register dicts through the umodbus hook called after a write.
+
+        Tables given as lists of rows, or all tables with 'compact_definitions', are kept as MelaPointTable.
+
+        :param config: Slave configuration with 'register_definitions' and optional 'change_tracking' ({'address': 100, 'table': 'IREGS', 'max_gap': 4}) and 'compact_definitions'.
+        :return: Register definitions to set up, including the change status block.
+        """
+        definitions = MelaPointTable.convert(config['register_definitions'], config.get('compact_definitions', False))
+        tracking = config.get('change_tracking')
+        if not tracking:
+            return definitions
+        self.connection._set_changed_register = self._changed
+        self.changes = MelaChangeTracker(definitions, tracking['address'], tracking.get('table', 'IREGS'), tracking.get('max_gap', 4))
+        definitions = dict(definitions)
+        definitions[self.changes.table] = (definitions.get(self.changes.table) or {}).copy()
+        definitions[self.changes.table][MelaChangeTracker.STATUS_NAME] = self.changes.definition()
+        return definitions
+
+    def setup_diagnostics(self, config: Dict[str, Any], definitions: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Enable the diagnostics if the configuration has a 'diagnostics' section.
+
+        The statistics of MelaDiagnostics are mirrored into a reserved register block,
+        refreshed at most every 'interval' ms while requests are served.
+
+        :param config: Slave configuration with optional 'diagnostics' ({'address': 900, 'table': 'IREGS', 'max_keys': 8, 'interval': 1000}).
+        :param definitions: Register definitions to set up.
+        :return: Register definitions including the diagnostic block.
+        """
+        section = config.get('diagnostics')
+        if not section:
+            return definitions
+        max_keys = section.get('max_keys', 8)
+        table = section.get('table', 'IREGS')
+        length = MelaDiagnostics.block_length(max_keys)
+        self.diagnostics = MelaDiagnostics(max_keys)
+        self._diagnostics_block = [table, section['address'], length, section.get('interval', 1000), 0]
+        definitions = dict(definitions)
+        definitions[table] = (definitions.get(table) or {}).copy()
+        definitions[table][self.DIAGNOSTICS_NAME] = {'register': section['address'], 'len': length, 'val': [0] * length}
+        return definitions
+
+    def reload_definitions(self, config: Dict[str, Any]) -> None:
+        """
+        Replace the register definitions of the running slave, the connection stays up.
+
+        With the register bank, points defined before with the same table and length keep
+        their current values, also if their address moved. The diagnostics statistics are kept.
+
+        :param config: Slave configuration with 'register_definitions' and optional 'register_bank', 'change_tracking' and 'diagnostics'.
+        """
+        if not config.get('load_definitions_from_config'):
+            return
+        diagnostics = self.diagnostics
+        old = self.bank
+        self.changes = None
+        self._diagnostics_block = None
+        definitions = self.setup_diagnostics(config, self.setup_changes(config))
+        if diagnostics is not None:
+            self.diagnostics = diagnostics
+        if config.get('register_bank'):
+            self.bank = MelaRegisterBank(definitions)
+            if old is not None:
+                for name, table, address, length in self.bank.points():
+                    previous = old.find(name)
+                    if previous is not None and previous[0] == table and previous[2] == length:
+                        self.bank.write(table, address, old.values(*previous))
+        else:
+            self.bank = None
+            for registers in self.connection._register_dict.values():
+                registers.clear()
+            self.setup_registers(definitions)
+        self.setup_codecs(definitions)
+        if self.engine is not None:
+            self.engine.bank = self.bank
+
+    def _refresh_diagnostics(self) -> None:
+        """
+        Write the diagnostics into their register block when the refresh interval has passed.
+        """
+        import utime as time
+
+        block = self._diagnostics_block
+        if block is None or self.diagnostics is None:
+            return
+        now = time.ticks_ms()
+        if time.ticks_diff(now, block[4]) < 0:
+            return
+        block[4] = time.ticks_add(now, block[3])
+        self._store(block[0], block[1], self.diagnostics.registers(block[2]))
+
+    def _mark(self, table: str, address: int, qty: int) -> None:
+        """
+        Report a changed range in the change status block.
+        """
+        if self.changes and self.changes.mark(table, address, qty):
+            self._store(self.changes.table, self.changes.address, self.changes.status)
+
+    def _changed(self, reg_type: str, address: int, value: Union[bool, int, list]) -> None:
+        """
+        Replacement of the umodbus hook called after a master wrote registers of the register dicts, reports them as changed.
+        """
+        type(self.connection)._set_changed_register(self.connection, reg_type, address, value)
+        self._mark(reg_type, address, len(value) if isinstance(value, (list, tuple)) else 1)
+
+    def _point_codec(self, name: str) -> Tuple[str, MelaRegisterCodec]:
+        """
+        Find the table and codec of a named point.
+        """
+        for table, codec in self.codecs.items():
+            if name in codec:
+                return table, codec
+        raise KeyError('Point {} is not defined.'.format(name))
+
+    def set_point(self, name: str, value: Union[int, float]) -> None:
+        """
+        Encode a typed value into the registers of a named point.
+
+        :param name: Point name from the register definitions.
+        :param value: Engineering value.
+        """
+        table, codec = self._point_codec(name)
+        address = codec.encode(name, value)
+        words = [codec.word(addr) for addr in range(address, address + codec.span(name)[1])]
+        deadband = self.changes.deadbands.get(name) if self.changes else None
+        if deadband is None:
+            self.set_registers(table, address, words)
+            return
+        self._store(table, address, words)
+        reported = self.changes.reported.get(name)
+        if reported is None or abs(value - reported) >= deadband:
+            self.changes.reported[name] = value
+            self._mark(table, address, len(words))
+
+    def set_registers(self, table: str, address: int, values: list) -> None:
+        """
+        Set registers of the bank from the application side, creating undefined addresses.
+
+        With change tracking, registers whose value changed are reported in the change status block.
+
+        :param table: Register table: 'COILS', 'ISTS', 'HREGS' or 'IREGS'.
+        :param address: First address.
+        :param values: List of values.
+        """
+        changed = self.changes is not None and self.read_values(table, address, len(values)) != [int(v) for v in values]
+        self._store(table, address, values)
+        if changed:
+            self._mark(table, address, len(values))
+
+    def _store(self, table: str, address: int, values: list) -> None:
+        """
+        Write registers without change tracking.
+        """
+        if self.bank:
+            if not self.bank.write(table, address, values):
+                raise ValueError('Error. Registers {}:{} are outside the register bank.'.format(table, address))
+            return
+        reg_dict = self.connection._register_dict[table]
+        for i, value in enumerate(values):
+            entry = reg_dict.get(address + i)
+            if entry is None:
+                reg_dict[address + i] = {'val': value}
+            else:
+                entry['val'] = value
+
+    def get_point(self, name: str) -> Union[int, float]:
+        """
+        Decode the typed value of a named point from its registers.
+
+        :param name: Point name from the register definitions.
+        :return: Engineering value.
+        """
+        table, codec = self._point_codec(name)
+        address, words = codec.span(name)
+        codec.load(self.read_values(table, address, words) or [0] * words, address)
+        return codec.decode(name)
+
+    def read_values(self, table: str, address: int, qty: int) -> Union[None, list]:
+        """
+        Read a range of the register bank.
+
+        Undefined addresses inside the range are read as 0, as umodbus does.
+
+        :param table: Register table: 'COILS', 'ISTS', 'HREGS' or 'IREGS'.
+        :param address: First address of the range.
+        :param qty: Number of registers or bits.
+        :return: List of values or None if the first address is not defined.
+        """
+        if self.bank:
+            return self.bank.values(table, address, qty)
+        reg_dict = self.connection._register_dict[table]
+        if address not in reg_dict:
+            return None
+        data = []
+        for addr in range(address, address + qty):
+            entry = reg_dict.get(addr)
+            data.append(int(entry['val']) if entry else 0)
+        return data
+
+    def write_values(self, table: str, address: int, values: list) -> bool:
+        """
+        Write a range of the register bank and call the 'on_set_cb' callback of the first register.
+
+        :param table: Register table: 'COILS' or 'HREGS'.
+        :param address: First address of the range.
+        :param values: List of values.
+        :return: True if all addresses are defined, False otherwise.
+        """
+        if self.bank:
+            if not self.bank.write(table, address, values):
+                return False
+            self._mark(table, address, len(values))
+            on_set_cb = self.bank.on_set.get((table, address))
+            if on_set_cb:
+                on_set_cb(reg_type=table, address=address, val=values)
+            return True
+        reg_dict = self.connection._register_dict[table]
+        for addr in range(address, address + len(values)):
+            if addr not in reg_dict:
+                return False
+        if table == 'COILS':
+            values = [bool(v) for v in values]
+        for i, value in enumerate(values):
+            reg_dict[address + i]['val'] = value
+        self._mark(table, address, len(values))
+        on_set_cb = reg_dict[address].get('on_set_cb')
+        if on_set_cb:
+            on_set_cb(reg_type=table, address=address, val=values)
+        return True
+
+    def publish(self, name: str, source: Callable[[], Union[int, float]], period_ms: int = 1000) -> None:
+        """
+        Register a telemetry source for a named point.
+
+        Sources are sampled by sample into a shadow buffer, the staged values reach the
+        register bank only in commit, between two frames.
+
+        :param name: Point name from the register definitions.
+        :param source: Function without arguments returning the engineering value.
+        :param period_ms: Sampling period in milliseconds.
+        """
+        import utime as time
+
+        self._point_codec(name)
+        if self._sources is None:
+            self._sources = []
+            self._staged = {}
+            self._spare = {}
+            self._sample_cb = self.sample
+        self._sources.append([name, source, period_ms, time.ticks_ms()])
+
+    def timer_callback(self, timer=None) -> None:
+        """
+        Timer callback which defers the sampling out of the interrupt with micropython.schedule.
+
+        Usage: Timer(0).init(mode=Timer.PERIODIC, period=1000, callback=plc.modbus_slave485.timer_callback)
+
+        :param timer: Timer object, not used.
+        """
+        import micropython
+
+        try:
+            micropython.schedule(self._sample_cb, None)
+        except RuntimeError:
+            pass
+
+    def sample(self, _=None) -> None:
+        """
+        Sample the telemetry sources which are due into the shadow buffer.
+        """
+        import utime as time
+
+        if not self._sources:
+            return
+        now = time.ticks_ms()
+        staged = self._staged
+        for source in self._sources:
+            if time.ticks_diff(now, source[3]) >= 0:
+                source[3] = time.ticks_add(now, source[2])
+                staged[source[0]] = source[1]()
+
+    def commit(self) -> int:
+        """
+        Swap the shadow buffer and write the staged values into the register bank.
+
+        The buffers are swapped with a single assignment, a sample running during the
+        commit stages into the other buffer and is written by the next commit.
+
+        :return: Number of points written.
+        """
+        if not self._sources:
+            return 0
+        staged = self._staged
+        self._staged = self._spare
+        for name, value in staged.items():
+            self.set_point(name, value)
+        count = len(staged)
+        staged.clear()
+        self._spare = staged
+        return count
+
+    def process(self) -> bool:
+        """
+        Commit the staged telemetry and process one request of the umodbus connection.
+
+        With a register bank the request is answered by process_pdu instead of umodbus.
+        The idle callback (set by Mela to MelaInfo.idle_collect) runs when no request was served.
+        With diagnostics each call is counted as one main loop scan.
+
+        :return: Result of the umodbus process call.
+        """
+        if self.diagnostics is not None:
+            self.diagnostics.tick()
+        return self._serve()
+
+    def _serve(self) -> bool:
+        """
+        Commit the staged telemetry, process one request and measure its service time.
+        """
+        self.commit()
+        diagnostics = self.diagnostics
+        if diagnostics is None:
+            result = self.engine.process() if self.engine else self._process_bank() if self.bank else self.connection.process()
+        else:
+            import utime as time
+
+            self._refresh_diagnostics()
+            start = time.ticks_us()
+            result = self.engine.process() if self.engine else self._process_bank() if self.bank else self.connection.process()
+            if result:
+                diagnostics.served(time.ticks_diff(time.ticks_us(), start))
+        if not result and self.idle:
+            self.idle()
+        return result
+
+    def _process_bank(self) -> bool:
+        """
+        Take one request from the umodbus transport and answer it from the register bank.
+
+        :return: True if a request was served, False otherwise.
+        """
+        itf = self.connection._itf
+        request = itf.get_request(unit_addr_list=self.connection._addr_list, timeout=0)
+        if request is None:
+            return False
+        function = request.function
+        if function in MODBUS_READ_TABLES:
+            pdu = struct.pack('>BHH', function, request.register_addr, request.quantity)
+        elif function in (0x0F, 0x10):
+            pdu = struct.pack('>BHHB', function, request.register_addr, request.quantity, len(request.data)) + bytes(request.data)
+        else:
+            pdu = struct.pack('>BH', function, request.register_addr) + bytes(request.data or b'')
+        itf._send(self.process_pdu(pdu), request.unit_addr)
+        return True
+
+    async def telemetry(self, interval_ms: int = 100) -> None:
+        """
+        Sample and commit the telemetry sources from an asyncio task.
+
+        Usage: asyncio.create_task(plc.modbus_slaveTCP.telemetry())
+
+        :param interval_ms: Interval between two samples in milliseconds.
+        """
+        import uasyncio as asyncio
+
+        while True:
+            self.sample()
+            self.commit()
+            if self.idle:
+                self.idle()
+            await asyncio.sleep_ms(interval_ms)
+
+    def process_pdu(self, pdu: Union[bytes, memoryview]) -> bytes:
+        """
+        Answer a Modbus request PDU from the register bank.
+
+        :param pdu: Request PDU (function code and data, without address and checksum).
+        :return: Response PDU, an exception response on errors.
+        """
+        function = pdu[0]
+        try:
+            if function in MODBUS_READ_TABLES:
+                address, qty = struct.unpack_from('>HH', pdu, 1)
+                bits = function <= 0x02
+                if qty < 1 or qty > (2000 if bits else 125):
+                    return bytes((function | 0x80, 0x03))
+                if self.bank:
+                    data = self.bank.read(MODBUS_READ_TABLES[function], address, qty)
+                    if data is None:
+                        return bytes((function | 0x80, 0x02))
+                    return bytes((function, len(data))) + data
+                data = self.read_values(MODBUS_READ_TABLES[function], address, qty)
+                if data is None:
+                    return bytes((function | 0x80, 0x02))
+                if bits:
+                    packed = bytearray((qty + 7) // 8)
+                    for i in range(qty):
+                        if data[i]:
+                            packed[i >> 3] |= 1 << (i & 7)
+                    return bytes((function, len(packed))) + packed
+                return struct.pack('>BB%dH' % qty, function, qty * 2, *[v & 0xFFFF for v in data])
+            elif function == 0x05:
+                address, value = struct.unpack_from('>HH', pdu, 1)
+                if value not in (0x0000, 0xFF00):
+                    return bytes((function | 0x80, 0x03))
+                ok = self.write_values('COILS', address, [value == 0xFF00])
+            elif function == 0x06:
+                address, value = struct.unpack_from('>HH', pdu, 1)
+                ok = self.write_values('HREGS', address, [value])
+            elif function == 0x0F:
+                address, qty, count = struct.unpack_from('>HHB', pdu, 1)
+                if qty < 1 or qty > 1968 or count != (qty + 7) // 8 or len(pdu) < 6 + count:
+                    return bytes((function | 0x80, 0x03))
+                ok = self.write_values('COILS', address, [(pdu[6 + (i >> 3)] >> (i & 7)) & 1 for i in range(qty)])
+            elif function == 0x10:
+                address, qty, count = struct.unpack_from('>HHB', pdu, 1)
+                if qty < 1 or qty > 123 or count != qty * 2 or len(pdu) < 6 + count:
+                    return bytes((function | 0x80, 0x03))
+                ok = self.write_values('HREGS', address, list(struct.unpack_from('>%dH' % qty, pdu, 6)))
+            else:
+                return bytes((function | 0x80, 0x01))
+        except (ValueError, IndexError):
+            return bytes((function | 0x80, 0x03))
+        if not ok:
+            return bytes((function | 0x80, 0x02))
+        return bytes(pdu[:5])
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus RTU frame engine class
+#
+#--------------------------------------------------------------------
+class MelaRTUEngine:
+    """
+    A class to receive and answer the Modbus RTU requests of a register bank slave in preallocated buffers.
+    """
+
+    CRC_TABLE = None
+
+    def __init__(self, slave: 'MelaModbusSlave485', address: int):
+        """
+        Allocate the frame buffers.
+
+        Requests are read into one bytearray and responses are built in place in another, sent
+        through a memoryview of the response length which is created once per length. Answering
+        a request then allocates nothing, apart from change tracking and 'on_set_cb' callbacks.
+
+        :param slave: Slave with a register bank and the umodbus RTU connection.
+        :param address: Slave address on the bus.
+        """
+        if MelaRTUEngine.CRC_TABLE is None:
+            MelaRTUEngine.CRC_TABLE = modbus_crc16_table()
+        itf = slave.connection._itf
+        self.slave = slave
+        self.bank = slave.bank
+        self.address = address
+        self.uart = itf._uart
+        self.ctrl = itf._ctrlPin
+        self.has_flush = itf._has_uart_flush
+        self.char_us = itf._t1char
+        self.gap_us = itf._inter_frame_delay
+        self.rx = bytearray(256)
+        self.tx = bytearray(256)
+        self._tx_view = memoryview(self.tx)
+        self._views = {}
+        self.frames = 0
+        self.crc_errors = 0
+
+    def receive(self) -> int:
+        """
+        Read a request frame once the line has been silent for t3.5.
+
+        :return: Number of bytes read, 0 if nothing was received.
+        """
+        import utime as time
+
+        uart = self.uart
+        n = uart.any()
+        if not n:
+            return 0
+        last = time.ticks_us()
+        while n < 256:
+            time.sleep_us(self.char_us)
+            m = uart.any()
+            now = time.ticks_us()
+            if m != n:
+                n = m
+                last = now
+            elif time.ticks_diff(now, last) >= self.gap_us:
+                break
+        return uart.readinto(self.rx, min(n, 256)) or 0
+
+    def respond(self, n: int) -> int:
+        """
+        Check a received frame and build the response in the send buffer.
+
+        :param n: Frame length in the receive buffer.
+        :return: Response length including the CRC, 0 for a served broadcast, -1 if the frame is not for this slave or corrupt.
+        """
+        rx = self.rx
+        if n < 4 or (rx[0] != self.address and rx[0] != 0):
+            return -1
+        crc = modbus_crc16(rx, n - 2, self.CRC_TABLE)
+        if rx[n - 2] != crc & 0xFF or rx[n - 1] != crc >> 8:
+            self.crc_errors += 1
+            return -1
+        self.frames += 1
+        size = self._answer(rx[1], n)
+        if rx[0] == 0:
+            return 0
+        tx = self.tx
+        tx[0] = self.address
+        crc = modbus_crc16(tx, size, self.CRC_TABLE)
+        tx[size] = crc & 0xFF
+        tx[size + 1] = crc >> 8
+        return size + 2
+
+    def _exception(self, function: int, code: int) -> int:
+        self.tx[1] = function | 0x80
+        self.tx[2] = code
+        return 3
+
+    def _echo(self) -> int:
+        rx = self.rx
+        tx = self.tx
+        for i in range(1, 6):
+            tx[i] = rx[i]
+        return 6
+
+    def _answer(self, function: int, n: int) -> int:
+        """
+        Answer the request in the receive buffer from the register bank.
+
+        :return: Response length without the CRC.
+        """
+        rx = self.rx
+        tx = self.tx
+        if n < 8:
+            return self._exception(function, 0x03)
+        address = (rx[2] << 8) | rx[3]
+        qty = (rx[4] << 8) | rx[5]
+
+        if function in MODBUS_READ_TABLES:
+            bits = function <= 0x02
+            if n != 8 or qty < 1 or qty > (2000 if bits else 125):
+                return self._exception(function, 0x03)
+            block = self.bank.block(MODBUS_READ_TABLES[function], address, qty)
+            if block is None:
+                return self._exception(function, 0x02)
+            offset = address - block[0]
+            storage = block[2]
+            tx[1] = function
+            if bits:
+                count = (qty + 7) >> 3
+                for i in range(count):
+                    tx[3 + i] = 0
+                for i in range(qty):
+                    bit = offset + i
+                    if storage[bit >> 3] & (1 << (bit & 7)):
+                        tx[3 + (i >> 3)] |= 1 << (i & 7)
+            else:
+                count = qty * 2
+                offset *= 2
+                for i in range(count):
+                    tx[3 + i] = storage[offset + i]
+            tx[2] = count
+            return 3 + count
+
+        if function == 0x05 or function == 0x0F:
+            if function == 0x05:
+                if n != 8 or (qty != 0x0000 and qty != 0xFF00):
+                    return self._exception(function, 0x03)
+                count = 1
+            elif qty < 1 or qty > 1968 or n < 9 or rx[6] != (qty + 7) >> 3 or n != 9 + rx[6]:
+                return self._exception(function, 0x03)
+            else:
+                count = qty
+            block = self.bank.block('COILS', address, count)
+            if block is None:
+                return self._exception(function, 0x02)
+            storage = block[2]
+            offset = address - block[0]
+            for i in range(count):
+                bit = offset + i
+                if qty == 0xFF00 if function == 0x05 else (rx[7 + (i >> 3)] >> (i & 7)) & 1:
+                    storage[bit >> 3] |= 1 << (bit & 7)
+                else:
+                    storage[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+            self._written('COILS', address, count)
+            return self._echo()
+
+        if function == 0x06 or function == 0x10:
+            if function == 0x06:
+                if n != 8:
+                    return self._exception(function, 0x03)
+                count = 1
+                data = 4
+            elif qty < 1 or qty > 123 or n < 9 or rx[6] != qty * 2 or n != 9 + rx[6]:
+                return self._exception(function, 0x03)
+            else:
+                count = qty
+                data = 7
+            block = self.bank.block('HREGS', address, count)
+            if block is None:
+                return self._exception(function, 0x02)
+            storage = block[2]
+            offset = (address - block[0]) * 2
+            for i in range(count * 2):
+                storage[offset + i] = rx[data + i]
+            self._written('HREGS', address, count)
+            return self._echo()
+
+        return self._exception(function, 0x01)
+
+    def _written(self, table: str, address: int, qty: int) -> None:
+        """
+        Report a master write to the change tracking and the 'on_set_cb' callback of its first register.
+        """
+        if self.slave.changes is not None:
+            self.slave._mark(table, address, qty)
+        if self.bank.on_set:
+            on_set_cb = self.bank.on_set.get((table, address))
+            if on_set_cb:
+                on_set_cb(reg_type=table, address=address, val=self.bank.values(table, address, qty))
+
+    def send(self, length: int) -> None:
+        """
+        Send the start of the send buffer, driving the DE/RE pin around the frame.
+
+        :param length: Number of bytes.
+        """
+        import utime as time
+
+        view = self._views.get(length)
+        if view is None:
+            view = self._views[length] = self._tx_view[:length]
+        if self.ctrl:
+            self.ctrl.on()
+        self.uart.write(view)
+        if self.has_flush:
+            self.uart.flush()
+            time.sleep_us(self.char_us)
+        else:
+            time.sleep_us(self.char_us * length + 100)
+        if self.ctrl:
+            self.ctrl.off()
+
+    def process(self) -> bool:
+        """
+        Receive, answer and send one request.
+
+        :return: True if a request for this slave was served, False otherwise.
+        """
+        n = self.receive()
+        if not n:
+            return False
+        length = self.respond(n)
+        if length > 0:
+            self.send(length)
+        return length >= 0
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus Slave485 class
+#
+#--------------------------------------------------------------------
+class MelaModbusSlave485(MelaModbusSlave):
+    """
+    A class to manage Modbus RTU slave connections over RS485.
+    """
+
+    def __init__(self, config: dict = None):
+        """
+        Initialize the Modbus RTU slave with the given configuration.
+
+        :param config: Configuration dictionary containing 'address', 'baudrate', 'data_bits', 'stop_bits', 'parity', 'load_definitions_from_config', 'register_definitions', and optional 'register_bank' to keep the registers in a MelaRegisterBank, 'compact_definitions' to keep the definitions as MelaPointTable, 'rtu_engine' to answer from the bank with MelaRTUEngine instead of umodbus, 'change_tracking' and 'diagnostics'.
+        """
+        from umodbus.serial import ModbusRTU
+
+        if not config:
+            raise ValueError('Error. Configuration is required.')
+
+        self.connection = ModbusRTU(
+            addr=config['address'],  # address on bus
+            pins=(16, 15),  # given as tuple (TX-DI, RX-RO)
+            baudrate=config.get('baudrate', 9600),  # optional, default 9600
+            data_bits=config.get('data_bits', 8),  # optional, default 8
+            stop_bits=config.get('stop_bits', 1),  # optional, default 1
+            parity=config.get('parity', None),  # optional, default None
+            ctrl_pin=7,  # optional, control DE/RE
+            uart_id=1  # optional, default 1, see port specific documentation
+        )
+        self.codecs = {}
+
+        if config['load_definitions_from_config']:
+            definitions = self.setup_diagnostics(config, self.setup_changes(config))
+            if config.get('register_bank'):
+                self.bank = MelaRegisterBank(definitions)
+            else:
+                self.setup_registers(definitions)
+            self.setup_codecs(definitions)
+
+        if config.get('rtu_engine'):
+            if not self.bank:
+                raise ValueError('Error. The RTU engine needs the register bank.')
+            self.engine = MelaRTUEngine(self, config['address'])
+
+    def reconfigure(self, config: dict) -> bool:
+        """
+        Take a new configuration in place: line settings, address and register definitions.
+
+        :param config: Configuration dictionary as in the constructor.
+        :return: False, the serving task keeps running.
+        """
+        if config.get('rtu_engine') and not config.get('register_bank'):
+            raise ValueError('Error. The RTU engine needs the register bank.')
+        modbus_serial_init(self.connection._itf, config)
+        self.connection._addr_list = [config['address']]
+        self.engine = None
+        self.reload_definitions(config)
+        if config.get('rtu_engine'):
+            self.engine = MelaRTUEngine(self, config['address'])
+        return False
+
+    async def serve(self, poll_ms: int = 0) -> None:
+        """
+        Serve requests from an asyncio task, woken when the UART has received a frame.
+
+        The task waits on the UART idle interrupt (UART.IRQ_RXIDLE), which fires when the line
+        goes silent after a frame. Where the port has no such interrupt it checks the UART every
+        poll_ms, by default every t3.5.
+
+        Usage: asyncio.create_task(plc.modbus_slave485.serve())
+
+        :param poll_ms: Check interval in milliseconds without the idle interrupt.
+        """
+        import uasyncio as asyncio
+
+        uart = self.connection._itf._uart
+        try:
+            ready = asyncio.ThreadSafeFlag()
+            uart.irq(handler=lambda _: ready.set(), trigger=uart.IRQ_RXIDLE)
+        except (AttributeError, TypeError, ValueError):
+            ready = None
+        poll_ms = poll_ms or max(1, self.connection._itf._inter_frame_delay // 1000)
+
+        while True:
+            if ready is not None:
+                await ready.wait()
+            else:
+                while not uart.any():
+                    await asyncio.sleep_ms(poll_ms)
+            while self._serve():
+                await asyncio.sleep_ms(0)
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus poll plan class
+#
+#--------------------------------------------------------------------
+class MelaPollPlan:
+    """
+    A class to coalesce named Modbus points into as few read requests as possible.
+    """
+
+    MAX_QTY = {'COILS': 2000, 'ISTS': 2000, 'HREGS': 125, 'IREGS': 125}
+
+    def __init__(self, points: Dict[str, Dict[str, Any]] = None, max_gap: int = 4):
+        """
+        Build the read blocks for the given points.
+
+        Points on the same slave and table are merged into one request while the hole
+        between them is not bigger than max_gap and the protocol quantity limit is kept.
+        Set max_gap to 0 for devices which reject reads of undefined addresses.
+
+        :param points: Dictionary of named points, e.g. {'TIMESTAMP': {'slave': 10, 'table': 'IREGS', 'register': 1, 'len': 2}}, with optional 'type', 'order', 'scale' and 'offset' as in MelaRegisterCodec and 'ttl' (ms) for the master read cache, a block uses the shortest ttl of its points.
+        :param max_gap: Maximum number of unused addresses read to join two ranges.
+        """
+        if not points:
+            raise ValueError('Error. Points are required.')
+
+        self.max_gap = max_gap
+        self.blocks = []
+        self.errors = []
+
+        ordered = sorted(points.items(), key=lambda x: (x[1]['slave'], x[1]['table'], x[1]['register']))
+        block = None
+        for name, point in ordered:
+            slave, table, address = point['slave'], point['table'], point['register']
+            length = point.get('len', MelaRegisterCodec.TYPES.get(point.get('type'), (None, 1))[1])
+            if table not in self.MAX_QTY:
+                raise ValueError('Error. Unknown table {} for point {}.'.format(table, name))
+            if length > self.MAX_QTY[table]:
+                raise ValueError('Error. Point {} is longer than one request allows.'.format(name))
+
+            if (block and block[0] == slave and block[1] == table
+                    and address - (block[2] + block[3]) <= max_gap
+                    and max(block[2] + block[3], address + length) - block[2] <= self.MAX_QTY[table]):
+                block[3] = max(block[2] + block[3], address + length) - block[2]
+            else:
+                block = [slave, table, address, length, []]
+                self.blocks.append(block)
+            block[4].append((name, address - block[2], length))
+
+        for block in self.blocks:
+            typed = dict((name, points[name]) for name, offset, length in block[4] if 'type' in points[name])
+            block.append(MelaRegisterCodec(typed) if typed and block[1] in ('HREGS', 'IREGS') else None)
+            ttls = [points[name]['ttl'] for name, offset, length in block[4] if 'ttl' in points[name]]
+            block.append(min(ttls) if ttls else None)
+
+    def __len__(self) -> int:
+        """
+        Get the number of Modbus requests issued per poll.
+
+        :return: Number of read blocks.
+        """
+        return len(self.blocks)
+
+    @classmethod
+    def from_definitions(cls, slave: int, register_definitions: Dict[str, Any], max_gap: int = 4) -> 'MelaPollPlan':
+        """
+        Build a poll plan for all points of a slave's register definitions.
+
+        :param slave: Slave address on the bus or unit ID.
+        :param register_definitions: Register definitions as used in the slave configuration.
+        :param max_gap: Maximum number of unused addresses read to join two ranges.
+        :return: Poll plan instance.
+        """
+        points = {}
+        for table, registers in MelaPointTable.convert(register_definitions).items():
+            for name, reg in registers.items():
+                points[name] = dict(reg, slave=slave, table=table)
+        return cls(points, max_gap)
+
+    def read(self, master: 'MelaModbusMaster') -> Dict[str, Any]:
+        """
+        Read all blocks and split the responses back into named values.
+
+        Single-register points return a value, longer points return a tuple.
+        Points of a failed block are set to None and the error is stored in errors.
+
+        :param master: Modbus master wrapper used for reading.
+        :return: Dictionary of point values.
+        """
+        values = {}
+        self.errors = []
+        for block in self.blocks:
+            try:
+                data = master.read_block(block[0], block[1], block[2], block[3], block[6])
+            except Exception as e:
+                data = e
+            self.split(block, data, values)
+        return values
+
+    def split(self, block: list, data: Union[list, tuple, Exception], values: Dict[str, Any]) -> None:
+        """
+        Store the response of one block as named values.
+
+        :param block: Block of this plan.
+        :param data: Values read for the block or the exception raised while reading.
+        :param values: Dictionary of point values to update.
+        """
+        if isinstance(data, Exception):
+            self.errors.append((block[0], block[1], block[2], block[3], data))
+            for name, offset, length in block[4]:
+                values[name] = None
+            return
+        codec = block[5]
+        if codec:
+            codec.load(data, block[2])
+        for name, offset, length in block[4]:
+            if codec and name in codec:
+                values[name] = codec.decode(name)
+            else:
+                values[name] = data[offset] if length == 1 else tuple(data[offset:offset + length])
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus change tracking classes
+#
+#--------------------------------------------------------------------
+class MelaChangeTracker:
+    """
+    A class to report changed registers of a slave through a block of status registers.
+    """
+
+    STATUS_NAME = 'CHANGE_STATUS'
+
+    def __init__(self, register_definitions: Dict[str, Any], address: int, table: str = 'IREGS', max_gap: int = 4):
+        """
+        Split the register definitions into blocks as a poll plan does.
+
+        The status block starts with the change sequence counter followed by the sequence
+        of the last change of each block. The counter never returns to 0, which means unchanged.
+        Points with a 'deadband' are reported only when they moved at least the deadband from
+        the last reported value.
+
+        :param register_definitions: Register definitions of the slave.
+        :param address: Address of the status block.
+        :param table: Register table of the status block.
+        :param max_gap: Maximum gap of the blocks, the master must use the same value.
+        """
+        definitions = dict((t, dict((n, d) for n, d in regs.items() if n != self.STATUS_NAME))
+                           for t, regs in register_definitions.items())
+        self.plan = MelaPollPlan.from_definitions(0, definitions, max_gap)
+        self.address = address
+        self.table = table
+        self.sequence = 0
+        self.status = [0] * (1 + len(self.plan.blocks))
+        self.deadbands = {}
+        self.reported = {}
+        for regs in definitions.values():
+            for name, d in regs.items():
+                if 'deadband' in d:
+                    self.deadbands[name] = d['deadband']
+
+    def definition(self) -> Dict[str, Any]:
+        """
+        Get the register definition of the status block.
+
+        :return: Register definition.
+        """
+        return {'register': self.address, 'len': len(self.status), 'val': list(self.status)}
+
+    def mark(self, table: str, address: int, qty: int) -> bool:
+        """
+        Advance the sequence counter and stamp the blocks overlapping a changed range.
+
+        :return: True if a block was stamped, False otherwise.
+        """
+        hit = False
+        for i, block in enumerate(self.plan.blocks):
+            if block[1] == table and block[2] < address + qty and address < block[2] + block[3]:
+                if not hit:
+                    self.sequence = self.sequence % 0xFFFF + 1
+                    self.status[0] = self.sequence
+                    hit = True
+                self.status[1 + i] = self.sequence
+        return hit
+
+
+class MelaChangePoller:
+    """
+    A class to read only the blocks a slave with change tracking reports as changed.
+    """
+
+    def __init__(self, master: 'MelaModbusMaster', slave: int, register_definitions: Dict[str, Any], address: int, table: str = 'IREGS', max_gap: int = 4):
+        """
+        Build the same blocks as the slave's MelaChangeTracker.
+
+        :param master: Modbus master wrapper used for reading.
+        :param slave: Slave address on the bus or unit ID.
+        :param register_definitions: Register definitions of the slave.
+        :param address: Address of the status block.
+        :param table: Register table of the status block.
+        :param max_gap: Maximum gap of the blocks, as configured on the slave.
+        """
+        definitions = dict((t, dict((n, d) for n, d in regs.items() if n != MelaChangeTracker.STATUS_NAME))
+                           for t, regs in MelaPointTable.convert(register_definitions).items())
+        self.master = master
+        self.plan = MelaPollPlan.from_definitions(slave, definitions, max_gap)
+        self.slave = slave
+        self.address = address
+        self.table = table
+        self.seen = [None] * len(self.plan.blocks)
+        self.values = {}
+        self.reads = 0
+
+    def poll(self) -> Dict[str, Any]:
+        """
+        Read the status block and then the blocks changed since the last poll.
+
+        :return: Dictionary of the point values which were read, self.values holds all values.
+        """
+        status = self.master.read_block(self.slave, self.table, self.address, 1 + len(self.plan.blocks), 0)
+        self.reads += 1
+        changed = {}
+        self.plan.errors = []
+        for i, block in enumerate(self.plan.blocks):
+            if self.seen[i] is not None and self.seen[i] == status[1 + i]:
+                continue
+            try:
+                data = self.master.read_block(block[0], block[1], block[2], block[3], 0)
+                self.seen[i] = status[1 + i]
+            except Exception as e:
+                data = e
+            self.reads += 1
+            self.plan.split(block, data, changed)
+        self.values.update(changed)
+        return changed
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus read cache class
+#
+#--------------------------------------------------------------------
+class MelaReadCache:
+    """
+    A class to keep recent master reads for a limited time.
+    """
+
+    def __init__(self, size: int = 32, ttl: int = 1000, ttls: Dict[str, int] = None):
+        """
+        Initialize the cache.
+
+        :param size: Maximum number of cached ranges, the least recently used one is evicted first.
+        :param ttl: Default time to live of a read in milliseconds.
+        :param ttls: Time to live per register table, e.g. {'IREGS': 500, 'HREGS': 5000}.
+        """
+        self.size = size
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bus_us = 0
+        self._use = 0
+
+    def get(self, slave: int, table: str, address: int, qty: int) -> Union[None, list]:
+        """
+        Get a range from a cached read which is still valid and covers it.
+
+        :return: Values of the range, None on a miss.
+        """
+        import utime as time
+
+        now = time.ticks_ms()
+        for key, entry in self.entries.items():
+            if (key[0] == slave and key[1] == table and key[2] <= address
+                    and address + qty <= key[2] + key[3] and time.ticks_diff(entry[0], now) > 0):
+                self._use += 1
+                entry[1] = self._use
+                self.hits += 1
+                return entry[2][address - key[2]:address - key[2] + qty]
+        self.misses += 1
+        return None
+
+    def put(self, slave: int, table: str, address: int, qty: int, data: Union[list, tuple], ttl: int = None, bus_us: int = 0) -> None:
+        """
+        Store a read.
+
+        :param ttl: Time to live in milliseconds, the table or default ttl if not given.
+        :param bus_us: Time the read took on the bus, used for the saved time estimate.
+        """
+        import utime as time
+
+        self.bus_us += bus_us
+        if ttl is None:
+            ttl = self.ttls.get(table, self.ttl)
+        if ttl <= 0:
+            return
+        key = (slave, table, address, qty)
+        if key not in self.entries and len(self.entries) >= self.size:
+            oldest = min(self.entries, key=lambda k: self.entries[k][1])
+            del self.entries[oldest]
+            self.evictions += 1
+        self._use += 1
+        self.entries[key] = [time.ticks_add(time.ticks_ms(), ttl), self._use, tuple(data)]
+
+    def invalidate(self, slave: int, table: str, address: int, qty: int) -> None:
+        """
+        Drop all cached reads overlapping a range, slave 0 (broadcast) matches all slaves.
+        """
+        for key in [k for k in self.entries if (slave == 0 or k[0] == slave) and k[1] == table
+                    and k[2] < address + qty and address < k[2] + k[3]]:
+            del self.entries[key]
+
+    def clear(self) -> None:
+        """
+        Drop all cached reads.
+        """
+        self.entries = {}
+
+    @property
+    def saved_us(self) -> int:
+        """
+        Get an estimate of the bus time saved, the hits times the average time of a bus read.
+
+        :return: Saved time in microseconds.
+        """
+        return self.hits * self.bus_us // self.misses if self.misses else 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the cache counters.
+
+        :return: Dictionary with 'hits', 'misses', 'evictions', 'entries' and 'saved_us'.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'saved_us': self.saved_us}
+
+
+#--------------------------------------------------------------------
+#
+#    RS485 slave health class
+#
+#--------------------------------------------------------------------
+class MelaBusHealth:
+    """
+    A class to track the response times of RS485 slaves and to skip slaves which keep failing.
+    """
+
+    SRTT, RTTVAR, GAP, FAILURES, NEXT_TRY, REQUESTS, TIMEOUTS, CRC_ERRORS, SKIPPED = range(9)
+
+    def __init__(self, min_timeout: int = 20, max_timeout: int = 1000, failures: int = 3, retry: int = 10000, retry_max: int = 120000):
+        """
+        Initialize the tracker.
+
+        The response timeout of a slave is its smoothed first byte latency plus four times its
+        variation (as TCP computes its retransmission timeout), kept between min_timeout and
+        max_timeout. A slave without history gets max_timeout.
+
+        After the given number of failures in a row the circuit of a slave opens: requests fail at
+        once without using the bus. One probe request is let through after retry ms, each failed
+        probe doubles the interval up to retry_max.
+
+        :param min_timeout: Minimum response timeout in milliseconds.
+        :param max_timeout: Maximum response timeout in milliseconds.
+        :param failures: Failures in a row which open the circuit.
+        :param retry: First probe interval of an open circuit in milliseconds.
+        :param retry_max: Maximum probe interval in milliseconds.
+        """
+        self.min_timeout = min_timeout * 1000
+        self.max_timeout = max_timeout * 1000
+        self.failures = failures
+        self.retry = retry
+        self.retry_max = retry_max
+        self.slaves = {}
+
+    def _slave(self, slave_addr: int) -> list:
+        """
+        Get the state of a slave, creating it on first use.
+
+        :return: List [srtt us, rttvar us, gap us, failures, next try ticks_ms, requests, timeouts, crc errors, skipped].
+        """
+        state = self.slaves.get(slave_addr)
+        if state is None:
+            state = self.slaves[slave_addr] = [0, 0, 0, 0, 0, 0, 0, 0, 0]
+        return state
+
+    def allow(self, slave_addr: int) -> bool:
+        """
+        Check if a request to a slave may use the bus.
+
+        :return: False while the circuit of the slave is open and no probe is due, True otherwise.
+        """
+        import utime as time
+
+        state = self._slave(slave_addr)
+        if state[self.FAILURES] < self.failures or time.ticks_diff(time.ticks_ms(), state[self.NEXT_TRY]) >= 0:
+            state[self.REQUESTS] += 1
+            return True
+        state[self.SKIPPED] += 1
+        return False
+
+    def timeout_us(self, slave_addr: int) -> int:
+        """
+        Get the time to wait for the first byte of a response.
+
+        :return: Timeout in microseconds.
+        """
+        state = self._slave(slave_addr)
+        if not state[self.SRTT]:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, state[self.SRTT] + 4 * state[self.RTTVAR]))
+
+    def gap_us(self, slave_addr: int, inter_frame_delay: int) -> int:
+        """
+        Get the silence which ends a response frame of a slave.
+
+        :param inter_frame_delay: t3.5 of the baud rate in microseconds.
+        :return: The t3.5 time, or twice the longest gap seen inside a frame of this slave if longer.
+        """
+        return max(inter_frame_delay, 2 * self._slave(slave_addr)[self.GAP])
+
+    def success(self, slave_addr: int, latency_us: int, gap_us: int = 0) -> None:
+        """
+        Record a valid response and close the circuit of the slave.
+
+        :param latency_us: Time from the end of the request to the first response byte.
+        :param gap_us: Longest pause between two bytes of the response.
+        """
+        state = self._slave(slave_addr)
+        if state[self.SRTT]:
+            state[self.RTTVAR] += (abs(state[self.SRTT] - latency_us) - state[self.RTTVAR]) // 4
+            state[self.SRTT] += (latency_us - state[self.SRTT]) // 8
+        else:
+            state[self.SRTT] = latency_us
+            state[self.RTTVAR] = latency_us // 2
+        state[self.GAP] = max(gap_us, state[self.GAP] * 7 // 8)
+        state[self.FAILURES] = 0
+
+    def failure(self, slave_addr: int, crc: bool = False) -> None:
+        """
+        Record a missing or corrupt response, opening the circuit after too many in a row.
+
+        :param crc: True for a response with a wrong checksum, False for no response.
+        """
+        import utime as time
+
+        state = self._slave(slave_addr)
+        state[self.CRC_ERRORS if crc else self.TIMEOUTS] += 1
+        state[self.FAILURES] += 1
+        if state[self.FAILURES] >= self.failures:
+            delay = min(self.retry_max, self.retry << min(state[self.FAILURES] - self.failures, 16))
+            state[self.NEXT_TRY] = time.ticks_add(time.ticks_ms(), delay)
+
+    def is_open(self, slave_addr: int) -> bool:
+        """
+        Check if the circuit of a slave is open.
+        """
+        return self._slave(slave_addr)[self.FAILURES] >= self.failures
+
+    @property
+    def stats(self) -> Dict[int, Dict[str, int]]:
+        """
+        Get the counters and timing of each slave.
+
+        :return: Dictionary per slave address with 'latency_us', 'timeout_us', 'requests', 'timeouts', 'crc_errors', 'skipped' and 'open'.
+        """
+        return dict((addr, {'latency_us': state[self.SRTT], 'timeout_us': self.timeout_us(addr),
+                            'requests': state[self.REQUESTS], 'timeouts': state[self.TIMEOUTS],
+                            'crc_errors': state[self.CRC_ERRORS], 'skipped': state[self.SKIPPED],
+                            'open': self.is_open(addr)})
+                    for addr, state in self.slaves.items())
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus write queue classes
+#
+#--------------------------------------------------------------------
+class MelaWriteFuture:
+    """
+    A class for the handle of a queued write, completed when the frame carrying its values has been sent.
+    """
+
+    def __init__(self, callback: Callable = None):
+        """
+        Initialize a pending write.
+
+        :param callback: Function called with the handle when the write is complete.
+        """
+        self.done = False
+        self.result = None
+        self.error = None
+        self.callback = callback
+        self._frames = 0
+        self._event = None
+
+    def _complete(self) -> None:
+        self.done = True
+        if self.result is None:
+            self.result = self.error is None
+        if self._event is not None:
+            self._event.set()
+        if self.callback:
+            self.callback(self)
+
+    async def wait(self) -> bool:
+        """
+        Wait until the write is complete.
+
+        :return: True if the slave confirmed the write, False if its response did not match.
+        """
+        import uasyncio as asyncio
+
+        if not self.done:
+            if self._event is None:
+                self._event = asyncio.Event()
+            await self._event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class MelaWriteQueue:
+    """
+    A class to send the writes of a master in the background, merged into as few requests as possible.
+    """
+
+    def __init__(self, master: 'MelaModbusMaster', delay_ms: int = 10, max_registers: int = 123, max_coils: int = 1968):
+        """
+        Initialize the queue of a master.
+
+        A write returns a handle immediately. The queue keeps one pending value per slave,
+        table and address, so a newer value replaces one which has not been sent yet and both
+        handles complete with the frame carrying the newer value. Pending writes to consecutive
+        addresses of one slave are sent as one 'write_multiple_registers' or 'write_multiple_coils'
+        request, a single address as 'write_single_register' or 'write_single_coil'.
+
+        :param master: Modbus master wrapper sending the writes.
+        :param delay_ms: Time run waits after the first write of a burst before sending it.
+        :param max_registers: Maximum number of holding registers per request.
+        :param max_coils: Maximum number of coils per request.
+        """
+        import uasyncio as asyncio
+
+        self.master = master
+        self.delay_ms = delay_ms
+        self.max_registers = max_registers
+        self.max_coils = max_coils
+        self.writes = 0
+        self.replaced = 0
+        self.frames = 0
+        self.errors = 0
+        self._pending = {}
+        self._wake = asyncio.Event()
+
+    @property
+    def pending(self) -> int:
+        """
+        Get the number of addresses waiting to be written.
+
+        :return: Number of pending addresses.
+        """
+        return len(self._pending)
+
+    def write(self, slave_addr: int, table: str, address: int, values: Union[int, bool, list], callback: Callable = None) -> MelaWriteFuture:
+        """
+        Queue a write without waiting for the slave.
+
+        :param slave_addr: Slave address on the bus or unit ID.
+        :param table: Register table: 'COILS' or 'HREGS'.
+        :param address: First address.
+        :param values: Value or non-empty list of values, negative register values are sent in two's complement.
+        :param callback: Function called with the handle when the write is complete.
+        :return: Handle of the write.
+        """
+        if table not in ('COILS', 'HREGS'):
+            raise ValueError('Error. Table {} is not writable.'.format(table))
+        if not isinstance(values, (list, tuple)):
+            values = [values]
+        if not values:
+            raise ValueError('Error. No values to write.')
+        future = MelaWriteFuture(callback)
+        for i, value in enumerate(values):
+            if table == 'HREGS':
+                value &= 0xFFFF
+            key = (slave_addr, table, address + i)
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = [value, [future]]
+            else:
+                entry[0] = value
+                if future not in entry[1]:
+                    entry[1].append(future)
+                self.replaced += 1
+        self.writes += 1
+        self._wake.set()
+        return future
+
+    def _take(self) -> list:
+        """
+        Take all pending writes as requests.
+
+        :return: List of requests [slave, table, first address, values, handles].
+        """
+        pending = self._pending
+        self._pending = {}
+        frames = []
+        frame = None
+        for key in sorted(pending):
+            slave, table, address = key
+            value, futures = pending[key]
+            limit = self.max_coils if table == 'COILS' else self.max_registers
+            if (frame is None or frame[0] != slave or frame[1] != table
+                    or frame[2] + len(frame[3]) != address or len(frame[3]) >= limit):
+                frame = [slave, table, address, [], []]
+                frames.append(frame)
+            frame[3].append(value)
+            for future in futures:
+                if future not in frame[4]:
+                    frame[4].append(future)
+                    future._frames += 1
+        return frames
+
+    def _done(self, frame: list, result: bool, error: Exception = None) -> None:
+        """
+        Report the outcome of a request to its handles.
+        """
+        self.frames += 1
+        if error is not None:
+            self.errors += 1
+        for future in frame[4]:
+            if error is not None:
+                future.error = error
+            elif not result:
+                future.result = False
+            future._frames -= 1
+            if not future._frames:
+                future._complete()
+
+    def flush(self) -> int:
+        """
+        Send all pending writes with the blocking write functions of the master.
+
+        :return: Number of requests sent.
+        """
+        frames = self._take()
+        master = self.master
+        for frame in frames:
+            slave, table, address, values = frame[0], frame[1], frame[2], frame[3]
+            try:
+                if table == 'COILS':
+                    if len(values) == 1:
+                        result = master.write_single_coil(slave, address, values[0])
+                    else:
+                        result = master.write_multiple_coils(slave, address, values)
+                elif len(values) == 1:
+                    result = master.write_single_register(slave, address, values[0], False)
+                else:
+                    result = master.write_multiple_registers(slave, address, values, False)
+            except Exception as e:
+                self._done(frame, False, e)
+                continue
+            self._done(frame, bool(result))
+        return len(frames)
+
+    async def flush_async(self) -> int:
+        """
+        Send all pending writes with the master's write_async.
+
+        :return: Number of requests sent.
+        """
+        frames = self._take()
+        for frame in frames:
+            try:
+                result = await self.master.write_async(frame[0], frame[1], frame[2], frame[3])
+            except Exception as e:
+                self._done(frame, False, e)
+                continue
+            self._done(frame, result)
+        return len(frames)
+
+    async def run(self) -> None:
+        """
+        Send the queued writes from an asyncio task, a burst is collected for delay_ms before it is sent.
+
+        Usage: asyncio.create_task(plc.modbus_master485.writes.run())
+        """
+        import uasyncio as asyncio
+
+        while True:
+            while not self._pending:
+                self._wake.clear()
+                await self._wake.wait()
+            if self.delay_ms:
+                await asyncio.sleep_ms(self.delay_ms)
+            await self.flush_async()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the queue counters.
+
+        :return: Dictionary with 'writes', 'replaced' (values superseded before being sent), 'frames', 'errors' and 'pending'.
+        """
+        return {'writes': self.writes, 'replaced': self.replaced, 'frames': self.frames,
+                'errors': self.errors, 'pending': len(self._pending)}
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus Master base class
+#
+#--------------------------------------------------------------------
+class MelaModbusMaster:
+    """
+    A base class with the functions shared by the Modbus RTU and TCP masters.
+    """
+
+    connection = None
+    cache = None
+    diagnostics = None
+    writes = None
+
+    def setup_write_queue(self, delay_ms: int = 10, max_registers: int = 123, max_coils: int = 1968) -> MelaWriteQueue:
+        """
+        Enable the background write queue, its run task is started by MelaRuntime.
+
+        An existing queue takes the new settings and keeps its pending writes.
+
+        Usage: plc.modbus_master485.writes.write(10, 'HREGS', 0, 1500, callback)
+
+        :param delay_ms: Time a burst of writes is collected before it is sent.
+        :param max_registers: Maximum number of holding registers per request.
+        :param max_coils: Maximum number of coils per request.
+        :return: Write queue instance.
+        """
+        if self.writes is None:
+            self.writes = MelaWriteQueue(self, delay_ms, max_registers, max_coils)
+        else:
+            self.writes.delay_ms = delay_ms
+            self.writes.max_registers = max_registers
+            self.writes.max_coils = max_coils
+        return self.writes
+
+    def setup_diagnostics(self, max_keys: int = 8, diagnostics: MelaDiagnostics = None) -> MelaDiagnostics:
+        """
+        Enable the round trip, timeout and CRC error statistics per (slave, function code).
+
+        :param max_keys: Maximum number of (slave, function code) pairs.
+        :param diagnostics: Statistics object to share, e.g. with the slave of the board mirroring them.
+        :return: Diagnostics instance.
+        """
+        self.diagnostics = diagnostics or MelaDiagnostics(max_keys)
+        return self.diagnostics
+
+    def setup_cache(self, size: int = 32, ttl: int = 1000, ttls: Dict[str, int] = None) -> MelaReadCache:
+        """
+        Enable the read-through cache of read_block and the invalidation on writes.
+
+        :param size: Maximum number of cached ranges.
+        :param ttl: Default time to live of a read in milliseconds.
+        :param ttls: Time to live per register table.
+        :return: Cache instance.
+        """
+        self.cache = MelaReadCache(size, ttl, ttls)
+        return self.cache
+
+    def read_block(self, slave_addr: int, table: str, starting_addr: int, qty: int, ttl: int = None) -> Union[list, tuple]:
+        """
+        Read a contiguous block of one register table.
+
+        With the cache enabled a block covered by a valid cached read is not read from the slave.
+
+        :param slave_addr: Slave address on the bus or unit ID.
+        :param table: Register table: 'COILS', 'ISTS', 'HREGS' or 'IREGS'.
+        :param starting_addr: First address of the block.
+        :param qty: Number of registers or bits to read.
+        :param ttl: Time to live of this read in the cache in milliseconds, 0 to bypass the cache.
+        :return: Unsigned register values or bit states.
+        """
+        if self.cache is None or ttl == 0:
+            return self._read_block(slave_addr, table, starting_addr, qty)
+
+        import utime as time
+
+        data = self.cache.get(slave_addr, table, starting_addr, qty)
+        if data is None:
+            start = time.ticks_us()
+            data = self._read_block(slave_addr, table, starting_addr, qty)
+            self.cache.put(slave_addr, table, starting_addr, qty, data, ttl, time.ticks_diff(time.ticks_us(), start))
+        return data
+
+    def change_poller(self, slave: int, register_definitions: Dict[str, Any], address: int, table: str = 'IREGS', max_gap: int = 4) -> MelaChangePoller:
+        """
+        Create a poller which reads only the blocks a slave with change tracking reports as changed.
+
+        :param slave: Slave address on the bus or unit ID.
+        :param register_definitions: Register definitions of the slave.
+        :param address: Address of the slave's change status block.
+        :param table: Register table of the status block.
+        :param max_gap: Maximum gap of the blocks, as configured on the slave.
+        :return: Change poller instance.
+        """
+        return MelaChangePoller(self, slave, register_definitions, address, table, max_gap)
+
+    def _invalidate(self, slave_addr: int, table: str, starting_addr: int, qty: int) -> None:
+        if self.cache is not None:
+            self.cache.invalidate(slave_addr, table, starting_addr, qty)
+
+    def write_single_coil(self, slave_addr: int, output_address: int, output_value: Union[int, bool]) -> bool:
+        """
+        Write a coil and drop the cached reads containing it.
+
+        :return: Result of the umodbus write.
+        """
+        try:
+            return self.connection.write_single_coil(slave_addr=slave_addr, output_address=output_address, output_value=output_value)
+        finally:
+            self._invalidate(slave_addr, 'COILS', output_address, 1)
+
+    def write_multiple_coils(self, slave_addr: int, starting_address: int, output_values: list) -> bool:
+        """
+        Write coils and drop the cached reads overlapping them.
+
+        :return: Result of the umodbus write.
+        """
+        try:
+            return self.connection.write_multiple_coils(slave_addr=slave_addr, starting_address=starting_address, output_values=output_values)
+        finally:
+            self._invalidate(slave_addr, 'COILS', starting_address, len(output_values))
+
+    def write_single_register(self, slave_addr: int, register_address: int, register_value: int, signed: bool = True) -> bool:
+        """
+        Write a holding register and drop the cached reads containing it.
+
+        :return: Result of the umodbus write.
+        """
+        try:
+            return self.connection.write_single_register(slave_addr=slave_addr, register_address=register_address, register_value=register_value, signed=signed)
+        finally:
+            self._invalidate(slave_addr, 'HREGS', register_address, 1)
+
+    def write_multiple_registers(self, slave_addr: int, starting_address: int, register_values: list, signed: bool = True) -> bool:
+        """
+        Write holding registers and drop the cached reads overlapping them.
+
+        :return: Result of the umodbus write.
+        """
+        try:
+            return self.connection.write_multiple_registers(slave_addr=slave_addr, starting_address=starting_address, register_values=register_values, signed=signed)
+        finally:
+            self._invalidate(slave_addr, 'HREGS', starting_address, len(register_values))
+
+    async def write_async(self, slave_addr: int, table: str, starting_address: int, values: list) -> bool:
+        """
+        Write coils or holding registers with the master's transact_async and drop the cached reads overlapping them.
+
+        :param slave_addr: Slave address on the bus or unit ID, 0 for a broadcast.
+        :param table: Register table: 'COILS' or 'HREGS'.
+        :param starting_address: First address.
+        :param values: List of values, a single value is written with function code 5 or 6.
+        :return: True if the slave confirmed the write.
+        """
+        pdu = modbus_write_pdu(table, starting_address, values)
+        try:
+            response = await self.transact_async(slave_addr, pdu)
+        finally:
+            self._invalidate(slave_addr, table, starting_address, len(values))
+        if response is None:
+            return True
+        if response[0] & 0x80:
+            raise ValueError('slave returned exception code: {:d}'.format(response[1]))
+        return response == (pdu if len(values) == 1 else pdu[:5])
+
+    def _read_block(self, slave_addr: int, table: str, starting_addr: int, qty: int) -> Union[list, tuple]:
+        """
+        Read a contiguous block from the slave.
+        """
+        if table == 'HREGS':
+            return self.connection.read_holding_registers(slave_addr=slave_addr, starting_addr=starting_addr, register_qty=qty, signed=False)
+        elif table == 'IREGS':
+            return self.connection.read_input_registers(slave_addr=slave_addr, starting_addr=starting_addr, register_qty=qty, signed=False)
+        elif table == 'COILS':
+            return self.connection.read_coils(slave_addr=slave_addr, starting_addr=starting_addr, coil_qty=qty)
+        elif table == 'ISTS':
+            return self.connection.read_discrete_inputs(slave_addr=slave_addr, starting_addr=starting_addr, input_qty=qty)
+        raise ValueError('Error. Unknown table {}.'.format(table))
+
+    def poll_plan(self, points: Dict[str, Dict[str, Any]], max_gap: int = 4) -> MelaPollPlan:
+        """
+        Create a poll plan which reads the given points with a minimum of requests.
+
+        :param points: Dictionary of named points, e.g. {'TIMESTAMP': {'slave': 10, 'table': 'IREGS', 'register': 1, 'len': 2}}.
+        :param max_gap: Maximum number of unused addresses read to join two ranges.
+        :return: Poll plan instance.
+        """
+        return MelaPollPlan(points, max_gap)
+
+    def poll(self, plan: MelaPollPlan) -> Dict[str, Any]:
+        """
+        Execute a poll plan.
+
+        :param plan: Poll plan created with poll_plan.
+        :return: Dictionary of point values.
+        """
+        return plan.read(self)
+
+    async def poll_async(self, plan: MelaPollPlan) -> Dict[str, Any]:
+        """
+        Execute a poll plan from an asyncio task.
+
+        This default blocks the event loop for the whole poll, the RTU and TCP masters override it.
+
+        :param plan: Poll plan created with poll_plan.
+        :return: Dictionary of point values.
+        """
+        return plan.read(self)
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus Master485 class
+#
+#--------------------------------------------------------------------
+class MelaModbusMaster485(MelaModbusMaster):
+    """
+    A class to manage Modbus RTU master connections over RS485.
+    """
+
+    health = None
+    _last_us = 0
+    _rx_ready = False
+    _lock = None
+
+    def __init__(self, config: dict = None, uart=None):
+        """
+        Initialize the Modbus RTU master with the given configuration.
+
+        :param config: Configuration dictionary containing 'baudrate', 'data_bits', 'stop_bits', 'parity', and optional 'timeout' (ms) for transact and transact_async, 'cache' (setup_cache arguments), 'adaptive' (setup_adaptive arguments), 'diagnostics' (setup_diagnostics arguments) and 'write_queue' (setup_write_queue arguments).
+        :param uart: UART-like object used instead of UART 1 on pins 16/15, e.g. the port of a simulated RS485 bus. The DE/RE pin is not driven then.
+        """
+        from umodbus.serial import Serial as ModbusRTUMaster
+
+        if not config:
+            raise ValueError('Error. Configuration is required.')
+
+        self.connection = ModbusRTUMaster(
+            pins=(16, 15),  # given as tuple (TX-DI, RX-RO)
+            baudrate=config.get('baudrate', 9600),  # optional, default 9600
+            data_bits=config.get('data_bits', 8),  # optional, default 8
+            stop_bits=config.get('stop_bits', 1),  # optional, default 1
+            parity=config.get('parity', None),  # optional, default None
+            ctrl_pin=7,  # optional, control DE/RE
+            uart_id=1  # optional, default 1, see port specific documentation
+        )
+        if uart is not None:
+            self.connection._uart = uart
+            self.connection._ctrlPin = None
+            self.connection._has_uart_flush = callable(getattr(uart, 'flush', None))
+        self.timeout = config.get('timeout', 1000)
+        if config.get('cache'):
+            self.setup_cache(**config['cache'])
+        if config.get('adaptive'):
+            self.setup_adaptive(**config['adaptive'])
+        if config.get('diagnostics'):
+            self.setup_diagnostics(**config['diagnostics'])
+        if config.get('write_queue'):
+            self.setup_write_queue(**config['write_queue'])
+
+    def reconfigure(self, config: dict) -> bool:
+        """
+        Take a new configuration in place: line settings, 'timeout', 'cache', 'adaptive' and 'write_queue'.
+
+        The cache and the slave health start empty, the write queue keeps its pending writes.
+
+        :param config: Configuration dictionary as in the constructor.
+        :return: False, no task needs a restart.
+        """
+        modbus_serial_init(self.connection, config)
+        self.timeout = config.get('timeout', 1000)
+        self.cache = None
+        if config.get('cache'):
+            self.setup_cache(**config['cache'])
+        self.health = None
+        if config.get('adaptive'):
+            self.setup_adaptive(**config['adaptive'])
+        if config.get('write_queue'):
+            self.setup_write_queue(**config['write_queue'])
+        return False
+
+    def setup_diagnostics(self, max_keys: int = 8, diagnostics: MelaDiagnostics = None) -> MelaDiagnostics:
+        """
+        Enable the transaction statistics for all requests of this master.
+
+        The umodbus read and write functions then go through the same exchange as transact,
+        with the configured 'timeout'.
+
+        :param max_keys: Maximum number of (slave, function code) pairs.
+        :param diagnostics: Statistics object to share.
+        :return: Diagnostics instance.
+        """
+        diagnostics = super().setup_diagnostics(max_keys, diagnostics)
+        self.connection._send_receive = self._send_receive
+        return diagnostics
+
+    def setup_adaptive(self, min_timeout: int = 20, max_timeout: int = None, failures: int = 3, retry: int = 10000, retry_max: int = 120000) -> MelaBusHealth:
+        """
+        Enable the per-slave response timeouts and circuit breaker for all requests of this master.
+
+        Requests of the umodbus read and write functions then go through the same exchange as
+        transact: the master waits only as long as the slave usually needs, and a slave which
+        keeps failing is skipped without using the bus until its next probe.
+
+        :param min_timeout: Minimum response timeout in milliseconds.
+        :param max_timeout: Maximum response timeout in milliseconds, the configured 'timeout' if not given.
+        :param failures: Failures in a row which open the circuit of a slave.
+        :param retry: First probe interval of an open circuit in milliseconds.
+        :param retry_max: Maximum probe interval in milliseconds.
+        :return: Slave health tracker.
+        """
+        self.health = MelaBusHealth(min_timeout, self.timeout if max_timeout is None else max_timeout, failures, retry, retry_max)
+        self.connection._send_receive = self._send_receive
+        return self.health
+
+    def _send_receive(self, modbus_pdu: bytes, slave_addr: int, count: bool) -> bytes:
+        """
+        Replacement of the umodbus request exchange, validating the response as umodbus does.
+        """
+        return self.connection._validate_resp_hdr(response=self._exchange(slave_addr, modbus_pdu) or bytearray(),
+                                                  slave_addr=slave_addr, function_code=modbus_pdu[0], count=count)
+
+    def _check_response(self, slave_addr: int, response: bytearray) -> bytes:
+        """
+        Check address and checksum of a response frame.
+
+        :return: Response PDU, an exception response is returned as is.
+        """
+        if not response:
+            raise OSError('Error. No response from slave {}.'.format(slave_addr))
+        if len(response) < 4 or self.connection._calculate_crc16(response[:-2]) != bytes(response[-2:]):
+            raise OSError('Error. Invalid response CRC from slave {}.'.format(slave_addr))
+        if response[0] != slave_addr:
+            raise OSError('Error. Response from wrong slave {}.'.format(response[0]))
+        return bytes(response[1:-2])
+
+    def _idle_us(self) -> int:
+        """
+        Get the time left until the line has been silent for t3.5 since the last frame.
+        """
+        import utime as time
+
+        elapsed = time.ticks_diff(time.ticks_us(), self._last_us)
+        return self.connection._inter_frame_delay - elapsed if elapsed >= 0 else 0
+
+    def _begin(self, slave_addr: int, pdu: Union[bytes, bytearray]) -> Union[None, list]:
+        """
+        Send a request frame and prepare the reception of its response.
+
+        :return: Reception state [response, start, last byte, first byte latency, longest gap, timeout, frame gap, function code, request start], None for a broadcast.
+        """
+        import utime as time
+
+        if self.health is not None and not self.health.allow(slave_addr):
+            raise OSError('Error. Slave {} is skipped after repeated failures.'.format(slave_addr))
+        conn = self.connection
+        conn._uart.read()
+        begin = time.ticks_us()
+        conn._send(modbus_pdu=pdu, slave_addr=slave_addr)
+        start = time.ticks_us()
+        if slave_addr == 0:
+            self._last_us = start
+            return None
+        if self.health is None:
+            return [bytearray(), start, start, 0, 0, self.timeout * 1000, conn._inter_frame_delay, pdu[0], begin]
+        return [bytearray(), start, start, 0, 0, self.health.timeout_us(slave_addr), self.health.gap_us(slave_addr, conn._inter_frame_delay), pdu[0], begin]
+
+    def _receive(self, rx: list) -> bool:
+        """
+        Read what has arrived of a response.
+
+        The frame ends when it is complete, when the line is silent for the frame gap after the
+        first byte, or when no byte arrived within the timeout.
+
+        :param rx: Reception state from _begin.
+        :return: True when the reception has ended, False otherwise.
+        """
+        import utime as time
+
+        conn = self.connection
+        now = time.ticks_us()
+        if conn._uart.any():
+            response = rx[0]
+            if response:
+                rx[4] = max(rx[4], time.ticks_diff(now, rx[2]))
+            else:
+                rx[3] = time.ticks_diff(now, rx[1])
+            response.extend(conn._uart.read())
+            rx[2] = now
+            return conn._exit_read(response)
+        if rx[0]:
+            return time.ticks_diff(now, rx[2]) > rx[6]
+        return time.ticks_diff(now, rx[1]) > rx[5]
+
+    def _finish(self, slave_addr: int, rx: list) -> bytearray:
+        """
+        Record the outcome of a reception in the slave health and the diagnostics.
+
+        :return: Response frame.
+        """
+        import utime as time
+
+        self._last_us = time.ticks_us()
+        response = rx[0]
+        if self.health is None and self.diagnostics is None:
+            return response
+        if not response:
+            error = 'timeout'
+        elif len(response) < 4 or self.connection._calculate_crc16(response[:-2]) != bytes(response[-2:]):
+            error = 'crc'
+        else:
+            error = None
+        if self.health is not None:
+            if error:
+                self.health.failure(slave_addr, crc=error == 'crc')
+            else:
+                self.health.success(slave_addr, rx[3], rx[4])
+        if self.diagnostics is not None:
+            self.diagnostics.transaction(slave_addr, rx[7], time.ticks_diff(self._last_us, rx[8]), error)
+        return response
+
+    def _exchange(self, slave_addr: int, pdu: Union[bytes, bytearray]) -> Union[None, bytearray]:
+        """
+        Send a request frame and read its response frame, polling the UART once per character time.
+
+        :return: Response frame, empty if there was no response, None for a broadcast.
+        """
+        import utime as time
+
+        idle = self._idle_us()
+        if idle > 0:
+            time.sleep_us(idle)
+        rx = self._begin(slave_addr, pdu)
+        if rx is None:
+            return None
+        while not self._receive(rx):
+            time.sleep_us(self.connection._t1char)
+        return self._finish(slave_addr, rx)
+
+    def transact(self, slave_addr: int, pdu: Union[bytes, bytearray]) -> Union[None, bytes]:
+        """
+        Send a raw request PDU and return the raw response PDU.
+
+        :param slave_addr: Slave address on the bus, 0 for a broadcast which is not answered.
+        :param pdu: Request PDU (function code and data).
+        :return: Response PDU including exception responses, None for a broadcast.
+        """
+        response = self._exchange(slave_addr, pdu)
+        if response is None:
+            return None
+        return self._check_response(slave_addr, response)
+
+    def _rx_flag(self) -> Any:
+        """
+        Get the flag set by the UART idle interrupt (UART.IRQ_RXIDLE), set up on first use.
+
+        :return: asyncio.ThreadSafeFlag, None where the port has no such interrupt.
+        """
+        if self._rx_ready is False:
+            import uasyncio as asyncio
+
+            uart = self.connection._uart
+            try:
+                ready = asyncio.ThreadSafeFlag()
+                uart.irq(handler=lambda _: ready.set(), trigger=uart.IRQ_RXIDLE)
+            except (AttributeError, TypeError, ValueError):
+                ready = None
+            self._rx_ready = ready
+        return self._rx_ready
+
+    async def transact_async(self, slave_addr: int, pdu: Union[bytes, bytearray]) -> Union[None, bytes]:
+        """
+        Send a raw request PDU and wait for the response without blocking the event loop.
+
+        The frame ends when it is complete or the line is silent for the inter-frame delay
+        after the first byte; the request fails after the configured 'timeout' (ms), or
+        the adaptive timeout of the slave.
+
+        The task sleeps until the UART idle interrupt (UART.IRQ_RXIDLE) reports received
+        bytes or the timeout expires. Where the port has no such interrupt the UART is
+        checked once per character time. Requests of several tasks, e.g. the gateway and
+        the poll jobs of the runtime, take turns on the bus.
+
+        :param slave_addr: Slave address on the bus, 0 for a broadcast which is not answered.
+        :param pdu: Request PDU (function code and data).
+        :return: Response PDU including exception responses, None for a broadcast.
+        """
+        import uasyncio as asyncio
+        import utime as time
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            idle = self._idle_us()
+            if idle > 0:
+                await asyncio.sleep_ms((idle + 999) // 1000)
+            ready = self._rx_flag()
+            if ready is not None:
+                ready.clear()
+            rx = self._begin(slave_addr, pdu)
+            if rx is None:
+                return None
+            while not self._receive(rx):
+                if ready is None:
+                    await asyncio.sleep_ms(max(1, self.connection._t1char // 1000))
+                    continue
+                if rx[0]:
+                    wait = rx[6] - time.ticks_diff(time.ticks_us(), rx[2])
+                else:
+                    wait = rx[5] - time.ticks_diff(time.ticks_us(), rx[1])
+                try:
+                    await asyncio.wait_for_ms(ready.wait(), wait // 1000 + 1)
+                except asyncio.TimeoutError:
+                    pass
+            return self._check_response(slave_addr, self._finish(slave_addr, rx))
+
+    async def read_block_async(self, slave_addr: int, table: str, starting_addr: int, qty: int, ttl: int = None) -> Union[list, tuple]:
+        """
+        Read a contiguous block of one register table without blocking the event loop.
+
+        Arguments and cache use as in read_block.
+
+        :return: Unsigned register values or bit states.
+        """
+        import utime as time
+
+        if self.cache is not None and ttl != 0:
+            data = self.cache.get(slave_addr, table, starting_addr, qty)
+            if data is not None:
+                return data
+        start = time.ticks_us()
+        pdu = struct.pack('>BHH', MODBUS_READ_FUNCTIONS[table], starting_addr, qty)
+        data = modbus_read_values(table, await self.transact_async(slave_addr, pdu), qty)
+        if self.cache is not None and ttl != 0:
+            self.cache.put(slave_addr, table, starting_addr, qty, data, ttl, time.ticks_diff(time.ticks_us(), start))
+        return data
+
+    async def poll_async(self, plan: MelaPollPlan) -> Dict[str, Any]:
+        """
+        Execute a poll plan from an asyncio task, one block after the other.
+
+        :param plan: Poll plan created with poll_plan.
+        :return: Dictionary of point values.
+        """
+        values = {}
+        plan.errors = []
+        for block in plan.blocks:
+            try:
+                data = await self.read_block_async(block[0], block[1], block[2], block[3], block[6])
+            except Exception as e:
+                data = e
+            plan.split(block, data, values)
+        return values
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus Gateway class
+#
+#--------------------------------------------------------------------
+class MelaModbusGateway:
+    """
+    A class to forward Modbus TCP requests to the RS485 bus.
+    """
+
+    def __init__(self, config: dict = None, wifi: bool = False, master: MelaModbusMaster485 = None):
+        """
+        Initialize the gateway with the given configuration, wifi status and RTU master.
+
+        Requests of all clients are queued and forwarded one by one, the unit ID is the slave address
+        on the bus. A read which is identical to one already queued or on the bus is not sent again,
+        it gets the response of the first one, unless a write to the same unit was queued since.
+
+        :param config: Configuration dictionary containing 'port' and optional 'max_clients' and 'queue_size'.
+        :param wifi: Wifi connection object.
+        :param master: MelaModbusMaster485 object of the bus.
+        """
+        import uasyncio as asyncio
+
+        if not wifi:
+            raise ConnectionError('Error. Wifi not connected.')
+
+        if not config or not master:
+            raise ValueError('Error. Configuration and RTU master are required.')
+
+        self.local_ip = wifi.ifconfig()[0]
+        self.port = config.get('port', 502)
+        self.max_clients = config.get('max_clients', 4)
+        self.queue_size = config.get('queue_size', 16)
+        self.master = master
+        self.clients = 0
+        self.server = None
+        self.requests = 0
+        self.merged = 0
+        self.transactions = 0
+        self.errors = 0
+        self._queue = []
+        self._inflight = {}
+        self._wake = asyncio.Event()
+        self._worker = None
+
+    def reconfigure(self, config: dict, wifi: bool = False) -> bool:
+        """
+        Take a new configuration in place, the queued requests are kept.
+
+        :param config: Configuration dictionary as in the constructor.
+        :param wifi: Wifi connection object.
+        :return: True if the server has to be restarted for a new 'port', False otherwise.
+        """
+        self.max_clients = config.get('max_clients', 4)
+        self.queue_size = config.get('queue_size', 16)
+        if config.get('port', 502) == self.port:
+            return False
+        self.close()
+        if wifi:
+            self.local_ip = wifi.ifconfig()[0]
+        self.port = config.get('port', 502)
+        return True
+
+    def close(self) -> None:
+        """
+        Close the TCP server and stop the bus worker.
+        """
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    async def serve(self) -> None:
+        """
+        Start the TCP server and the bus worker.
+
+        Usage: asyncio.create_task(plc.modbus_gateway.serve())
+        """
+        import uasyncio as asyncio
+
+        self._worker = asyncio.create_task(self._bus())
+        self.server = await asyncio.start_server(self._serve_client, self.local_ip, self.port, backlog=self.max_clients)
+        print('Modbus gateway listening on {}:{}'.format(self.local_ip, self.port))
+
+    def submit(self, unit: int, pdu: bytes, writer, tid: int) -> None:
+        """
+        Queue a request, or attach it to an identical read already queued or on the bus.
+
+        A queued write ends the merging into the reads of its unit queued before it, all units for a
+        broadcast, so a read sent after a write never gets a response from before the write.
+
+        :param unit: Unit ID, the slave address on the bus.
+        :param pdu: Request PDU.
+        :param writer: Stream writer of the client connection.
+        :param tid: MBAP transaction ID of the request.
+        """
+        self.requests += 1
+        key = (unit, pdu) if pdu[0] in MODBUS_READ_TABLES else None
+        entry = self._inflight.get(key) if key else None
+        if entry:
+            entry[2].append((writer, tid))
+            self.merged += 1
+            return
+        if len(self._queue) >= self.queue_size:
+            self._reply(writer, tid, unit, bytes((pdu[0] | 0x80, 0x06)))
+            return
+        entry = [unit, pdu, [(writer, tid)], key]
+        if key:
+            self._inflight[key] = entry
+        else:
+            for read in [read for read in self._inflight if read[0] == unit or unit == 0]:
+                del self._inflight[read]
+        self._queue.append(entry)
+        self._wake.set()
+
+    def _reply(self, writer, tid: int, unit: int, response: bytes) -> None:
+        try:
+            writer.write(struct.pack('>HHHB', tid, 0, len(response) + 1, unit) + response)
+        except OSError:
+            pass
+
+    async def _bus(self) -> None:
+        """
+        Forward the queued requests to the bus in order and route the responses back.
+        """
+        while True:
+            while not self._queue:
+                self._wake.clear()
+                await self._wake.wait()
+            entry = self._queue[0]
+            unit, pdu, waiters, key = entry
+            try:
+                response = await self.master.transact_async(unit, pdu)
+            except (OSError, ValueError):
+                response = bytes((pdu[0] | 0x80, 0x0B))
+                self.errors += 1
+            self.transactions += 1
+            self._queue.pop(0)
+            if key and self._inflight.get(key) is entry:
+                del self._inflight[key]
+            if response is None:
+                continue
+            for writer, tid in waiters:
+                self._reply(writer, tid, unit, response)
+                try:
+                    await writer.drain()
+                except OSError:
+                    pass
+
+    async def _serve_client(self, reader, writer) -> None:
+        """
+        Read MBAP frames from one client and queue them until the connection is closed.
+
+        :param reader: Stream reader of the client connection.
+        :param writer: Stream writer of the client connection.
+        """
+        if self.clients >= self.max_clients:
+            writer.close()
+            await writer.wait_closed()
+            return
+
+        self.clients += 1
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                tid, pid, length, unit = struct.unpack('>HHHB', header)
+                if pid != 0 or length < 2 or length > 254:
+                    break
+                self.submit(unit, bytes(await reader.readexactly(length - 1)), writer, tid)
+        except (OSError, EOFError):
+            pass
+        finally:
+            self.clients -= 1
+            for entry in self._queue:
+                entry[2][:] = [waiter for waiter in entry[2] if waiter[0] is not writer]
+            writer.close()
+            await writer.wait_closed()
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus SlaveTCP class
+#
+#--------------------------------------------------------------------
+class MelaModbusSlaveTCP(MelaModbusSlave):
+    """
+    A class to manage Modbus TCP slave connections.
+    """
+
+    def __init__(self, config: dict = None, wifi: bool = False):
+        """
+        Initialize the Modbus TCP slave with the given configuration and wifi status.
+
+        With 'async_server' set in the configuration the umodbus socket is not bound,
+        requests are served by the serve coroutine instead. MelaRuntime always serves the
+        slave with the serve coroutine.
+
+        :param config: Configuration dictionary containing 'port', 'load_definitions_from_config', 'register_definitions', and optional 'async_server', 'max_clients', 'register_bank', 'compact_definitions' and 'change_tracking'.
+        :param wifi: Wifi connection object.
+        """
+        from umodbus.tcp import ModbusTCP
+
+        if not wifi:
+            raise ConnectionError('Error. Wifi not connected.')
+
+        if not config:
+            raise ValueError('Error. Configuration is required.')
+
+        self.local_ip = wifi.ifconfig()[0]
+        self.port = config['port']
+        self.max_clients = config.get('max_clients', 4)
+        self.clients = 0
+        self.server = None
+
+        self.async_server = bool(config.get('async_server', False))
+        self.connection = ModbusTCP()
+        if not self.async_server and not self.connection.get_bound_status():
+            self.connection.bind(local_ip=self.local_ip, local_port=self.port)
+        self.codecs = {}
+
+        if config.get('load_definitions_from_config'):
+            definitions = self.setup_diagnostics(config, self.setup_changes(config))
+            if config.get('register_bank'):
+                self.bank = MelaRegisterBank(definitions)
+            else:
+                self.setup_registers(definitions)
+            self.setup_codecs(definitions)
+
+    def reconfigure(self, config: dict, wifi: bool = False) -> bool:
+        """
+        Take a new configuration in place, new register definitions keep the socket and the connected clients.
+
+        A changed 'port' or 'async_server' closes the socket, the umodbus socket is bound again
+        at once and the asyncio server is started again by the runtime.
+
+        :param config: Configuration dictionary as in the constructor.
+        :param wifi: Wifi connection object.
+        :return: True if the serving task has to be restarted, False otherwise.
+        """
+        self.max_clients = config.get('max_clients', 4)
+        async_server = bool(config.get('async_server', False))
+        rebind = config['port'] != self.port or async_server != self.async_server
+        if rebind:
+            self.close()
+            if wifi:
+                self.local_ip = wifi.ifconfig()[0]
+            self.port = config['port']
+            self.async_server = async_server
+            if not async_server:
+                self.connection.bind(local_ip=self.local_ip, local_port=self.port)
+        self.reload_definitions(config)
+        return rebind
+
+    def close(self) -> None:
+        """
+        Close the asyncio server and the umodbus sockets.
+        """
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        itf = self.connection._itf
+        for sock in (itf._client_sock, itf._sock):
+            if sock is not None:
+                sock.close()
+        itf._client_sock = None
+        itf._sock = None
+        itf._is_bound = False
+
+    async def serve(self) -> None:
+        """
+        Start the asyncio Modbus TCP server which serves several clients at once.
+
+        Usage: asyncio.create_task(plc.modbus_slaveTCP.serve())
+        """
+        import uasyncio as asyncio
+
+        self.server = await asyncio.start_server(self._serve_client, self.local_ip, self.port, backlog=self.max_clients)
+        print('Modbus TCP server listening on {}:{}'.format(self.local_ip, self.port))
+
+    async def _serve_client(self, reader, writer) -> None:
+        """
+        Read MBAP frames from one client and answer them until the connection is closed.
+
+        :param reader: Stream reader of the client connection.
+        :param writer: Stream writer of the client connection.
+        """
+        import utime as time
+
+        if self.clients >= self.max_clients:
+            writer.close()
+            await writer.wait_closed()
+            return
+
+        self.clients += 1
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                tid, pid, length, unit = struct.unpack('>HHHB', header)
+                if pid != 0 or length < 2 or length > 254:
+                    break
+                pdu = await reader.readexactly(length - 1)
+                if self.diagnostics is not None:
+                    self._refresh_diagnostics()
+                    start = time.ticks_us()
+                response = self.process_pdu(pdu)
+                writer.write(struct.pack('>HHHB', tid, 0, len(response) + 1, unit) + response)
+                if self.diagnostics is not None:
+                    self.diagnostics.served(time.ticks_diff(time.ticks_us(), start))
+                await writer.drain()
+        except (OSError, EOFError):
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+            await writer.wait_closed()
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus TCP pipeline class
+#
+#--------------------------------------------------------------------
+class MelaModbusTCPPipeline:
+    """
+    A class to keep several Modbus TCP requests in flight on one socket.
+    """
+
+    diagnostics = None
+
+    def __init__(self, slave_ip: str, slave_port: int = 502, window: int = 4, timeout: float = 5.0):
+        """
+        Initialize the pipeline, the connection is opened on the first request.
+
+        :param slave_ip: IP address of the slave or gateway.
+        :param slave_port: TCP port of the slave.
+        :param window: Maximum number of outstanding transactions.
+        :param timeout: Timeout for one transaction in seconds.
+        """
+        import uasyncio as asyncio
+
+        self.slave_ip = slave_ip
+        self.slave_port = slave_port
+        self.window = window
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._pending = {}
+        self._trans_id = 0
+        self._window_free = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        """
+        Open the connection and start the response receiver.
+        """
+        import uasyncio as asyncio
+
+        async with self._connect_lock:
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_connection(self.slave_ip, self.slave_port)
+                self._receiver = asyncio.create_task(self._receive())
+
+    @property
+    def connected(self) -> bool:
+        """
+        Get the connection state.
+
+        :return: True if the socket is open, False otherwise.
+        """
+        return self._writer is not None
+
+    @property
+    def outstanding(self) -> int:
+        """
+        Get the number of transactions waiting for a response.
+
+        :return: Number of outstanding transactions.
+        """
+        return len(self._pending)
+
+    async def close(self) -> None:
+        """
+        Close the connection and fail all outstanding transactions.
+        """
+        if self._receiver:
+            self._receiver.cancel()
+            self._receiver = None
+        if self._writer:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+        self._fail_pending(OSError('connection closed'))
+
+    def _fail_pending(self, error: Exception) -> None:
+        """
+        Complete all outstanding transactions with an error.
+
+        :param error: Exception stored for the waiting requests.
+        """
+        for transaction in self._pending.values():
+            transaction[1] = error
+            transaction[0].set()
+        self._pending = {}
+        self._window_free.set()
+
+    async def _receive(self) -> None:
+        """
+        Read responses and complete the matching transactions in any order.
+
+        When the peer closes the connection, it fails or it sends a header which is not Modbus
+        TCP, the outstanding transactions fail and the socket is closed.
+        """
+        try:
+            while True:
+                header = await self._reader.readexactly(7)
+                tid, pid, length, unit = struct.unpack('>HHHB', header)
+                if pid != 0 or not 2 <= length <= 254:
+                    raise OSError('invalid MBAP header, protocol {} length {}'.format(pid, length))
+                pdu = await self._reader.readexactly(length - 1)
+                transaction = self._pending.pop(tid, None)
+                if transaction:
+                    transaction[1] = pdu
+                    transaction[0].set()
+                    self._window_free.set()
+        except (OSError, EOFError) as e:
+            writer = self._writer
+            self._writer = None
+            self._receiver = None
+            self._fail_pending(OSError('connection lost: {}'.format(e)))
+            if writer is not None:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+
+    async def request(self, slave_addr: int, pdu: bytes) -> bytes:
+        """
+        Send a request PDU and wait for its response.
+
+        :param slave_addr: Unit ID of the slave.
+        :param pdu: Request PDU starting with the function code.
+        :return: Response PDU.
+        """
+        import uasyncio as asyncio
+        import utime as time
+
+        if self._writer is None:
+            await self.connect()
+        while len(self._pending) >= self.window:
+            self._window_free.clear()
+            await self._window_free.wait()
+
+        self._trans_id = (self._trans_id + 1) & 0xFFFF
+        while self._trans_id in self._pending:
+            self._trans_id = (self._trans_id + 1) & 0xFFFF
+        tid = self._trans_id
+        transaction = [asyncio.Event(), None]
+        self._pending[tid] = transaction
+        start = time.ticks_us()
+
+        async with self._write_lock:
+            try:
+                if self._writer is None:
+                    raise OSError('connection lost')
+                self._writer.write(struct.pack('>HHHB', tid, 0, len(pdu) + 1, slave_addr) + pdu)
+                await self._writer.drain()
+            except OSError:
+                self._pending.pop(tid, None)
+                self._window_free.set()
+                raise
+        try:
+            await asyncio.wait_for(transaction[0].wait(), self.timeout)
+        except asyncio.TimeoutError:
+            self._pending.pop(tid, None)
+            self._window_free.set()
+            if self.diagnostics is not None:
+                self.diagnostics.transaction(slave_addr, pdu[0], time.ticks_diff(time.ticks_us(), start), 'timeout')
+            raise OSError('no response from slave {} for transaction {}'.format(slave_addr, tid))
+        if self.diagnostics is not None:
+            self.diagnostics.transaction(slave_addr, pdu[0], time.ticks_diff(time.ticks_us(), start))
+
+        if isinstance(transaction[1], Exception):
+            raise transaction[1]
+        return transaction[1]
+
+    async def read_block(self, slave_addr: int, table: str, starting_addr: int, qty: int) -> Union[list, tuple]:
+        """
+        Read a contiguous block of one register table.
+
+        :param slave_addr: Unit ID of the slave.
+        :param table: Register table: 'COILS', 'ISTS', 'HREGS' or 'IREGS'.
+        :param starting_addr: First address of the block.
+        :param qty: Number of registers or bits to read.
+        :return: Unsigned register values or bit states.
+        """
+        pdu = struct.pack('>BHH', MODBUS_READ_FUNCTIONS[table], starting_addr, qty)
+        return modbus_read_values(table, await self.request(slave_addr, pdu), qty)
+
+    async def write_single_register(self, slave_addr: int, register_address: int, register_value: int) -> bool:
+        """
+        Write one holding register.
+
+        :param slave_addr: Unit ID of the slave.
+        :param register_address: Address of the register.
+        :param register_value: Unsigned register value.
+        :return: True if the slave echoed the request.
+        """
+        pdu = struct.pack('>BHH', 0x06, register_address, register_value & 0xFFFF)
+        return await self.request(slave_addr, pdu) == pdu
+
+    async def write_multiple_registers(self, slave_addr: int, starting_address: int, register_values: list) -> bool:
+        """
+        Write consecutive holding registers.
+
+        :param slave_addr: Unit ID of the slave.
+        :param starting_address: Address of the first register.
+        :param register_values: Unsigned register values.
+        :return: True if the slave confirmed the write.
+        """
+        qty = len(register_values)
+        pdu = struct.pack('>BHHB%dH' % qty, 0x10, starting_address, qty, qty * 2, *[v & 0xFFFF for v in register_values])
+        return await self.request(slave_addr, pdu) == pdu[:5]
+
+    async def poll(self, plan: MelaPollPlan) -> Dict[str, Any]:
+        """
+        Execute all blocks of a poll plan concurrently.
+
+        :param plan: Poll plan created with MelaModbusMaster.poll_plan.
+        :return: Dictionary of point values.
+        """
+        import uasyncio as asyncio
+
+        results = await asyncio.gather(*[self.read_block(b[0], b[1], b[2], b[3]) for b in plan.blocks], return_exceptions=True)
+        values = {}
+        plan.errors = []
+        for block, data in zip(plan.blocks, results):
+            plan.split(block, data, values)
+        return values
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus TCP connection pool class
+#
+#--------------------------------------------------------------------
+class MelaModbusTCPPool:
+    """
+    A class to poll many Modbus TCP slaves without one dead slave stalling the others.
+    """
+
+    def __init__(self, timeout: float = 2.0, window: int = 1, keepalive: int = 30, backoff_min: float = 1.0, backoff_max: float = 60.0):
+        """
+        Initialize the pool, connections are opened lazily on the first request.
+
+        Endpoints are keyed by (ip, port, unit), units behind the same gateway share one socket.
+
+        :param timeout: Timeout for connects and transactions in seconds.
+        :param window: Maximum number of outstanding transactions per socket.
+        :param keepalive: Idle time in seconds after which a connection is probed.
+        :param backoff_min: First retry delay in seconds after a failure.
+        :param backoff_max: Maximum retry delay in seconds.
+        """
+        self.timeout = timeout
+        self.window = window
+        self.keepalive = keepalive
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self._connections = {}
+        self._endpoints = {}
+
+    def _endpoint(self, ip: str, port: int, unit: int) -> list:
+        """
+        Get the state of an endpoint, creating it on first use.
+
+        :return: List [failures, next try ticks_ms, last used ticks_ms].
+        """
+        import utime as time
+
+        key = (ip, port, unit)
+        endpoint = self._endpoints.get(key)
+        if endpoint is None:
+            endpoint = self._endpoints[key] = [0, time.ticks_ms(), time.ticks_ms()]
+        if (ip, port) not in self._connections:
+            self._connections[(ip, port)] = MelaModbusTCPPipeline(ip, port, self.window, self.timeout)
+        return endpoint
+
+    def _failed(self, endpoint: list) -> None:
+        """
+        Record a failure and schedule the next try with exponential backoff and jitter.
+
+        :param endpoint: Endpoint state.
+        """
+        import utime as time
+
+        delay = backoff_ms(endpoint[0], self.backoff_min, self.backoff_max)
+        endpoint[0] += 1
+        endpoint[1] = time.ticks_add(time.ticks_ms(), delay)
+
+    def available(self, ip: str, port: int = 502, unit: int = 1) -> bool:
+        """
+        Check if an endpoint may be used now.
+
+        :return: False while the endpoint is backing off after failures, True otherwise.
+        """
+        import utime as time
+
+        endpoint = self._endpoint(ip, port, unit)
+        return endpoint[0] == 0 or time.ticks_diff(time.ticks_ms(), endpoint[1]) >= 0
+
+    async def _connect(self, ip: str, port: int) -> bool:
+        """
+        Open the connection of a socket, bounded by the pool timeout.
+
+        :return: True if connected, False otherwise.
+        """
+        import uasyncio as asyncio
+
+        connection = self._connections[(ip, port)]
+        if connection.connected:
+            return True
+        try:
+            await asyncio.wait_for(connection.connect(), self.timeout)
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            print('Error connecting to {}:{}. {}'.format(ip, port, e))
+            for key, endpoint in self._endpoints.items():
+                if key[0] == ip and key[1] == port:
+                    self._failed(endpoint)
+            return False
+
+    async def request(self, ip: str, unit: int, pdu: bytes, port: int = 502) -> bytes:
+        """
+        Send a request PDU to an endpoint and wait for its response.
+
+        Raises OSError at once while the endpoint is backing off.
+
+        :param ip: IP address of the slave or gateway.
+        :param unit: Unit ID of the slave.
+        :param pdu: Request PDU starting with the function code.
+        :param port: TCP port of the slave.
+        :return: Response PDU.
+        """
+        import utime as time
+
+        endpoint = self._endpoint(ip, port, unit)
+        if not self.available(ip, port, unit):
+            raise OSError('endpoint {}:{} unit {} is backing off'.format(ip, port, unit))
+        if not await self._connect(ip, port):
+            raise OSError('endpoint {}:{} is not reachable'.format(ip, port))
+
+        endpoint[2] = time.ticks_ms()
+        try:
+            response = await self._connections[(ip, port)].request(unit, pdu)
+        except OSError:
+            self._failed(endpoint)
+            raise
+        endpoint[0] = 0
+        return response
+
+    async def read_block(self, ip: str, unit: int, table: str, starting_addr: int, qty: int, port: int = 502) -> Union[list, tuple]:
+        """
+        Read a contiguous block of one register table from an endpoint.
+
+        :param ip: IP address of the slave or gateway.
+        :param unit: Unit ID of the slave.
+        :param table: Register table: 'COILS', 'ISTS', 'HREGS' or 'IREGS'.
+        :param starting_addr: First address of the block.
+        :param qty: Number of registers or bits to read.
+        :param port: TCP port of the slave.
+        :return: Unsigned register values or bit states.
+        """
+        pdu = struct.pack('>BHH', MODBUS_READ_FUNCTIONS[table], starting_addr, qty)
+        return modbus_read_values(table, await self.request(ip, unit, pdu, port), qty)
+
+    async def run(self, interval_ms: int = 1000) -> None:
+        """
+        Reconnect failed endpoints and probe idle connections in the background.
+
+        Usage: asyncio.create_task(pool.run())
+
+        :param interval_ms: Check interval in milliseconds.
+        """
+        import uasyncio as asyncio
+        import utime as time
+
+        while True:
+            now = time.ticks_ms()
+            for key, endpoint in self._endpoints.items():
+                connection = self._connections[(key[0], key[1])]
+                if endpoint[0] and time.ticks_diff(now, endpoint[1]) >= 0 and not connection.connected:
+                    asyncio.create_task(self._connect(key[0], key[1]))
+                elif connection.connected and not connection.outstanding and time.ticks_diff(now, endpoint[2]) >= self.keepalive * 1000:
+                    asyncio.create_task(self._probe(key))
+                    endpoint[2] = now
+            await asyncio.sleep_ms(interval_ms)
+
+    async def _probe(self, key: Tuple[str, int, int]) -> None:
+        """
+        Keep an idle connection alive, any answer including an exception response counts.
+        """
+        try:
+            await self.request(key[0], key[2], struct.pack('>BHH', 0x03, 0, 1), key[1])
+        except (OSError, ValueError):
+            pass
+
+    async def close(self) -> None:
+        """
+        Close all connections of the pool.
+        """
+        for connection in self._connections.values():
+            await connection.close()
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus MasterTCP class
+#
+#--------------------------------------------------------------------
+class MelaModbusMasterTCP(MelaModbusMaster):
+    """
+    A class to manage Modbus TCP connections.
+    """
+
+    def __init__(self, config: dict = None, wifi: bool = False):
+        """
+        Initialize the Modbus TCP master with the given configuration and wifi status.
+
+        :param config: Configuration dictionary containing 'slave_ip', 'port', 'timeout', 'always_reconnect', optional 'backoff_min' and 'backoff_max' (reconnect delays in seconds) and optional 'cache' (setup_cache arguments), 'diagnostics' (setup_diagnostics arguments) and 'write_queue' (setup_write_queue arguments).
+        :param wifi: Boolean indicating if wifi is connected.
+        """
+        if config is None:
+            raise ValueError('Error. Configuration is required.')
+        
+        self.config = config
+        self._pipeline = None
+        self._connection = None
+        self._wifi = wifi
+        self._failures = 0
+        self._retry_at = 0
+        self.connection = self.reconnect(config, wifi)
+        if config.get('cache'):
+            self.setup_cache(**config['cache'])
+        if config.get('diagnostics'):
+            self.setup_diagnostics(**config['diagnostics'])
+        if config.get('write_queue'):
+            self.setup_write_queue(**config['write_queue'])
+
+    def setup_diagnostics(self, max_keys: int = 8, diagnostics: MelaDiagnostics = None) -> MelaDiagnostics:
+        """
+        Enable the transaction statistics for the umodbus requests and the pipelines of this master.
+
+        :param max_keys: Maximum number of (slave, function code) pairs.
+        :param diagnostics: Statistics object to share.
+        :return: Diagnostics instance.
+        """
+        diagnostics = super().setup_diagnostics(max_keys, diagnostics)
+        if self._pipeline is not None:
+            self._pipeline.diagnostics = diagnostics
+        return diagnostics
+
+    @property
+    def connection(self) -> Any:
+        """
+        Get the umodbus connection, connecting again once the backoff after a failure has passed.
+
+        Raises OSError at once while the slave is backing off. The connection attempt after
+        the backoff blocks for up to 'timeout', see reconnect.
+
+        :return: umodbus TCP connection.
+        """
+        if self._connection is None:
+            self._connection = self.reconnect(self.config, self._wifi)
+            if self._connection is None:
+                raise OSError('Error. Slave {} not connected.'.format(self.config['slave_ip']))
+        return self._connection
+
+    @connection.setter
+    def connection(self, connection: Any) -> None:
+        self._connection = connection
+
+    def _send_receive(self, slave_addr: int, modbus_pdu: bytes, count: bool) -> bytes:
+        """
+        Replacement of the umodbus request exchange which drops the connection on a socket error
+        and times the request if diagnostics are enabled, a socket error counts as timeout.
+        """
+        import utime as time
+
+        connection = self._connection
+        start = time.ticks_us()
+        error = None
+        try:
+            return type(connection)._send_receive(connection, slave_addr=slave_addr, modbus_pdu=modbus_pdu, count=count)
+        except OSError:
+            error = 'timeout'
+            self.close_connection()
+            self._failed()
+            raise
+        finally:
+            if self.diagnostics is not None:
+                self.diagnostics.transaction(slave_addr, modbus_pdu[0], time.ticks_diff(time.ticks_us(), start), error)
+
+    def pipeline(self, window: int = None) -> MelaModbusTCPPipeline:
+        """
+        Create a pipelined connection to the configured slave.
+
+        :param window: Maximum number of outstanding transactions, default 'window' from the configuration or 4.
+        :return: Pipeline instance, its coroutines must run in the asyncio loop.
+        """
+        pipeline = MelaModbusTCPPipeline(
+            slave_ip=self.config['slave_ip'],
+            slave_port=self.config['port'],
+            window=window or self.config.get('window', 4),
+            timeout=self.config.get('timeout', 5.0)
+        )
+        pipeline.diagnostics = self.diagnostics
+        return pipeline
+
+    async def transact_async(self, slave_addr: int, pdu: bytes) -> bytes:
+        """
+        Send a raw request PDU over the pipelined connection, created on first use, and wait for the response.
+
+        :param slave_addr: Unit ID of the slave.
+        :param pdu: Request PDU (function code and data).
+        :return: Response PDU including exception responses.
+        """
+        if self._pipeline is None:
+            self._pipeline = self.pipeline()
+        return await self._pipeline.request(slave_addr, pdu)
+
+    async def poll_async(self, plan: MelaPollPlan) -> Dict[str, Any]:
+        """
+        Execute a poll plan from an asyncio task over a pipelined connection, created on first use.
+
+        :param plan: Poll plan created with poll_plan.
+        :return: Dictionary of point values.
+        """
+        if self._pipeline is None:
+            self._pipeline = self.pipeline()
+        return await self._pipeline.poll(plan)
+
+    def reconfigure(self, config: dict, wifi: bool = False) -> bool:
+        """
+        Take a new configuration in place and connect again with it.
+
+        :param config: Configuration dictionary as in the constructor.
+        :param wifi: Wifi connection object.
+        :return: False, no task needs a restart.
+        """
+        self.close()
+        self.config = config
+        self._wifi = wifi
+        self._failures = 0
+        self.connection = self.reconnect(config, wifi)
+        self.cache = None
+        if config.get('cache'):
+            self.setup_cache(**config['cache'])
+        if config.get('write_queue'):
+            self.setup_write_queue(**config['write_queue'])
+        return False
+
+    def close(self) -> None:
+        """
+        Close the umodbus socket and the pipelined connection, outstanding pipeline requests fail.
+        """
+        self.close_connection()
+        if self._pipeline is not None and self._pipeline._writer is not None:
+            self._pipeline._writer.close()
+        self._pipeline = None
+
+    def close_connection(self) -> None:
+        """
+        Close the umodbus socket, the next request connects again.
+        """
+        if self._connection is not None:
+            try:
+                self._connection._sock.close()
+            except OSError:
+                pass
+        self._connection = None
+
+    def pool(self) -> MelaModbusTCPPool:
+        """
+        Create a connection pool for polling several slaves.
+
+        :return: Pool instance configured from 'timeout', 'window', 'keepalive', 'backoff_min' and 'backoff_max'.
+        """
+        return MelaModbusTCPPool(
+            timeout=self.config.get('timeout', 5.0),
+            window=self.config.get('window', 1),
+            keepalive=self.config.get('keepalive', 30),
+            backoff_min=self.config.get('backoff_min', 1.0),
+            backoff_max=self.config.get('backoff_max', 60.0)
+        )
+
+    def reconnect(self, config: dict = None, wifi: bool = False) -> Any:
+        """
+        Reconnect to the Modbus TCP slave.
+
+        Makes one connection attempt, bounded by 'timeout'. After a failure the next attempt is
+        made on the first request once the backoff has passed, starting at 'backoff_min'
+        seconds and doubling up to 'backoff_max'. The attempt runs in the caller, so a request
+        blocks for up to 'timeout' once per backoff period while the slave is down; requests in
+        between fail at once. Use pool() to reconnect in the background of the asyncio loop.
+
+        :param config: Configuration dictionary containing 'slave_ip', 'port', and 'timeout', and 'always_reconnect'.
+        :param wifi: Boolean indicating if wifi is connected.
+        :return: Connection or None while backing off with 'always_reconnect' set.
+        """
+        import utime as time
+
+        if not wifi:
+            raise ConnectionError('Error. Wifi not connected.')
+
+        if config is None:
+            raise ValueError('Error. Configuration is required.')
+
+        if self._failures and time.ticks_diff(time.ticks_ms(), self._retry_at) < 0:
+            return None
+        try:
+            connection = self._open(config)
+        except OSError as e:
+            print('Error reconnecting to slave. {}'.format(e))
+            self._failed()
+            if not config.get('always_reconnect', False):
+                raise
+            print('Retrying in {} ms...'.format(time.ticks_diff(self._retry_at, time.ticks_ms())))
+            return None
+        self._failures = 0
+        connection._send_receive = self._send_receive
+        return connection
+
+    def _open(self, config: dict) -> Any:
+        """
+        Open the umodbus connection with the socket timeout set before the connect.
+        """
+        from umodbus.tcp import TCP as ModbusTCPMaster
+        import socket
+
+        connection = object.__new__(ModbusTCPMaster)
+        connection.trans_id_ctr = 0
+        connection._sock = socket.socket()
+        connection._sock.settimeout(config.get('timeout', 5.0))  # optional, timeout in seconds, default 5.0
+        try:
+            connection._sock.connect(socket.getaddrinfo(config['slave_ip'], config['port'])[0][-1])
+        except OSError:
+            connection._sock.close()
+            raise
+        return connection
+
+    def _failed(self) -> None:
+        """
+        Schedule the next connection attempt with exponential backoff and jitter.
+        """
+        import utime as time
+
+        delay = backoff_ms(self._failures, self.config.get('backoff_min', 1.0), self.config.get('backoff_max', 60.0))
+        self._failures += 1
+        self._retry_at = time.ticks_add(time.ticks_ms(), delay)
+
+
+#--------------------------------------------------------------------
+#
+#    Modbus runtime class
+#
+#--------------------------------------------------------------------
+class MelaRuntime:
+    """
+    A class to run all Modbus roles of a board and the application jobs under one asyncio scheduler.
+    """
+
+    SERVICES = {'slave485': ('slave485', 'telemetry485'), 'slaveTCP': ('slaveTCP', 'telemetryTCP'),
+                'master485': ('writes485',), 'masterTCP': ('writesTCP',), 'gatewayTCP485': ('gatewayTCP485',)}
+
+    def __init__(self, plc: Mela):
+        """
+        Initialize the runtime of a board.
+
+        The slaves and the gateway are served by their own tasks, which wake when the UART has
+        received a frame or a socket is readable. Periodic jobs, e.g. the poll plans of the
+        masters, run in one scheduler task: of the jobs which are due the one with the highest
+        priority runs first, and the scheduler yields to the serving tasks after each job.
+
+        :param plc: Mela object with the Modbus roles created.
+        """
+        import uasyncio as asyncio
+
+        self.plc = plc
+        self.jobs = []
+        self.errors = 0
+        self.tasks = {}
+        self._wake = asyncio.Event()
+
+    def every(self, period_ms: int, job: Callable, priority: int = 0) -> list:
+        """
+        Run a job periodically.
+
+        :param period_ms: Period in milliseconds.
+        :param job: Function without arguments, it may return a coroutine which is awaited.
+        :param priority: Priority among the jobs due at the same time, higher first.
+        :return: Job entry [next run ticks_ms, priority, period_ms, job], pass it to cancel.
+        """
+        import utime as time
+
+        entry = [time.ticks_ms(), priority, period_ms, job]
+        self.jobs.append(entry)
+        self.jobs.sort(key=lambda j: -j[1])
+        self._wake.set()
+        return entry
+
+    def poll(self, master: MelaModbusMaster, plan: MelaPollPlan, period_ms: int, callback: Callable = None, priority: int = 0) -> list:
+        """
+        Execute a poll plan periodically with the master's poll_async.
+
+        Usage: plc.start_runtime().poll(plc.modbus_master485, plan, 1000, print)
+
+        :param master: Modbus master wrapper.
+        :param plan: Poll plan of the master.
+        :param period_ms: Period in milliseconds.
+        :param callback: Function called with the dictionary of point values.
+        :param priority: Priority among the jobs due at the same time, higher first.
+        :return: Job entry.
+        """
+        async def job():
+            values = await master.poll_async(plan)
+            if callback:
+                callback(values)
+
+        return self.every(period_ms, job, priority)
+
+    def cancel(self, entry: list) -> None:
+        """
+        Stop a periodic job.
+
+        :param entry: Job entry returned by every or poll.
+        """
+        if entry in self.jobs:
+            self.jobs.remove(entry)
+
+    def start_services(self) -> None:
+        """
+        Create the serving tasks of the roles which exist and have no task yet.
+        """
+        import uasyncio as asyncio
+
+        plc = self.plc
+        services = []
+        if plc.modbus_slave485:
+            services.append(('slave485', plc.modbus_slave485.serve))
+        if plc.modbus_slaveTCP:
+            services.append(('slaveTCP', self._serve_tcp))
+        if plc.modbus_gateway:
+            services.append(('gatewayTCP485', plc.modbus_gateway.serve))
+        for slave in (plc.modbus_slave485, plc.modbus_slaveTCP):
+            if slave and slave._sources:
+                services.append(('telemetry' + ('485' if slave is plc.modbus_slave485 else 'TCP'), slave.telemetry))
+        for master in (plc.modbus_master485, plc.modbus_masterTCP):
+            if master and master.writes:
+                services.append(('writes' + ('485' if master is plc.modbus_master485 else 'TCP'), master.writes.run))
+        for name, service in services:
+            if name not in self.tasks:
+                self.tasks[name] = asyncio.create_task(service())
+
+    def stop(self, role: str) -> None:
+        """
+        Cancel the tasks of a role, e.g. before the role is reconfigured or removed.
+
+        :param role: Modbus role: 'slave485', 'master485', 'slaveTCP', 'masterTCP' or 'gatewayTCP485'.
+        """
+        for name in self.SERVICES.get(role, ()):
+            task = self.tasks.pop(name, None)
+            if task is not None:
+                task.cancel()
+
+    async def _serve_tcp(self) -> None:
+        """
+        Serve the TCP slave with the asyncio server, which wakes when a client socket is readable.
+
+        Without 'async_server' the socket bound by umodbus for process() is closed first.
+        """
+        slave = self.plc.modbus_slaveTCP
+        if slave.connection.get_bound_status():
+            slave.close()
+        await slave.serve()
+
+    async def _run_jobs(self) -> None:
+        """
+        Run the periodic jobs which are due, highest priority first, and sleep until the next one.
+        """
+        import uasyncio as asyncio
+        import utime as time
+
+        while True:
+            now = time.ticks_ms()
+            due = None
+            wait = 1000
+            for entry in self.jobs:
+                delta = time.ticks_diff(entry[0], now)
+                if delta <= 0:
+                    due = entry
+                    break
+                wait = min(wait, delta)
+            if due is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait / 1000)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            due[0] = time.ticks_add(due[0], due[2])
+            if time.ticks_diff(due[0], now) <= 0:
+                due[0] = time.ticks_add(now, due[2])
+            try:
+                result = due[3]()
+                if hasattr(result, 'send'):
+                    await result
+            except Exception as e:
+                self.errors += 1
+                print('Runtime job error: {}'.format(e))
+            await asyncio.sleep_ms(0)
+
+    async def run(self) -> None:
+        """
+        Serve all roles and run the jobs, attaching the network roles of a staged boot when the WLAN is up.
+
+        Usage: asyncio.run(plc.start_runtime().run())
+        """
+        import uasyncio as asyncio
+
+        self.start_services()
+        jobs = asyncio.create_task(self._run_jobs())
+        if self.plc._network_pending is not None and await self.plc.network_stage():
+            self.start_services()
+        await jobs
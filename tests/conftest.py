@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+pytest setup, the tests are skipped if umodbus can not be imported.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(__file__))
+
+import pytest
+import support
+
+UMODBUS = support.install()
+
+
+def pytest_collection_modifyitems(config, items):
+    if not UMODBUS:
+        marker = pytest.mark.skip(reason='umodbus not found, set MELA_UMODBUS')
+        for item in items:
+            item.add_marker(marker)
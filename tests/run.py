@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Test runner for the MicroPython unix port, which has no pytest.
+
+Usage: MELA_UMODBUS=~/micropython-modbus micropython tests/run.py [test_module ...]
+"""
+import sys
+
+BASE = __file__.rsplit('/', 1)[0] if '/' in __file__ else '.'
+sys.path.insert(0, BASE)
+
+import support
+
+MODULES = ('test_bank', 'test_cache', 'test_changes', 'test_codec', 'test_config', 'test_diagnostics', 'test_engine', 'test_gateway', 'test_health', 'test_logger', 'test_pipeline', 'test_poll', 'test_pool', 'test_reload', 'test_telemetry', 'test_wlan', 'test_writes')
+
+
+def main(modules: list) -> int:
+    if not support.install():
+        print('umodbus not found, set MELA_UMODBUS')
+        return 1
+    failed = 0
+    for name in modules or MODULES:
+        module = __import__(name)
+        for test in sorted(attr for attr in dir(module) if attr.startswith('test_')):
+            try:
+                getattr(module, test)()
+                print('PASS', name, test)
+            except support.Skipped as e:
+                print('SKIP', name, test, e)
+            except Exception as e:
+                failed += 1
+                print('FAIL', name, test, repr(e))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
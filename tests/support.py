@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Host setup shared by the tests, under pytest on CPython and under run.py on the MicroPython unix port.
+
+The stand-in machine, network and ds1307 modules of the benchmarks are installed and lib/mela
+is put on the path. umodbus is not part of this repository, set MELA_UMODBUS to the directory
+which contains the umodbus package if it is not installed.
+"""
+import os
+import sys
+
+ROOT = __file__.rsplit('/', 2)[0] if __file__.count('/') > 1 else '..'
+sys.path.insert(0, ROOT + '/bench')
+
+import host
+
+IS_MICROPYTHON = host.IS_MICROPYTHON
+
+
+try:
+    import pytest
+    skip = pytest.skip
+    Skipped = pytest.skip.Exception
+except ImportError:
+    class Skipped(Exception):
+        """
+        Raised by skip when the tests run without pytest.
+        """
+
+    def skip(reason: str) -> None:
+        raise Skipped(reason)
+
+
+def install() -> bool:
+    """
+    Install the host environment.
+
+    :return: True if umodbus can be imported, False otherwise.
+    """
+    getenv = getattr(os, 'getenv', None)
+    umodbus = getenv('MELA_UMODBUS') if getenv else None
+    host.install([ROOT + '/lib'] + ([umodbus] if umodbus else []))
+    try:
+        import umodbus
+        return True
+    except ImportError:
+        return False
+
+
+def slave485(register_definitions: dict, **config) -> 'MelaModbusSlave485':
+    """
+    Create an RTU slave on a loopback UART.
+
+    :param register_definitions: Register definitions of the slave.
+    :param config: Further configuration keys, e.g. register_bank=True.
+    :return: Slave instance.
+    """
+    from mela.mela import MelaModbusSlave485
+
+    config = dict({'address': 10, 'baudrate': 115200, 'load_definitions_from_config': True,
+                   'register_definitions': register_definitions}, **config)
+    return MelaModbusSlave485(config)
+
+
+def bus(register_definitions: dict, **master_config) -> tuple:
+    """
+    Create a master and slave 10 on the simulated RS485 bus.
+
+    :param register_definitions: Register definitions of the slave.
+    :param master_config: Further master configuration keys, e.g. cache={'ttl': 100}.
+    :return: (master, slave, list collecting the request PDUs the slave answers).
+    """
+    import host_rs485
+    from mela.mela import MelaModbusMaster485
+
+    line = host_rs485.RS485Bus(baudrate=115200)
+    slave = line.add_slave(10, register_definitions, latency_ms=0)
+    requests = []
+    answer = slave.answer
+    slave.answer = lambda pdu: requests.append(bytes(pdu)) or answer(pdu)
+    master = MelaModbusMaster485(dict({'baudrate': 115200}, **master_config), uart=line.port())
+    return master, slave, requests
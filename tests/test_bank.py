@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Register bank storage of sparse definitions, from the bank and through the RTU engine.
+"""
+import struct
+
+import support
+
+DEFINITIONS = {
+    'HREGS': {
+        'A': {'register': 0, 'len': 1, 'val': 1},
+        'B': {'register': 4, 'len': 2, 'val': [2, 3]},
+        'C': {'register': 40000, 'len': 1, 'val': 4}
+    },
+    'COILS': {
+        'LOW': {'register': 0, 'len': 1, 'val': 1},
+        'HIGH': {'register': 9000, 'len': 1, 'val': 1}
+    }
+}
+
+
+def test_sparse_tables_are_split():
+    from mela.mela import MelaRegisterBank
+
+    bank = MelaRegisterBank(DEFINITIONS)
+    assert [(block[0], block[1]) for block in bank.tables['HREGS']] == [(0, 6), (40000, 1)]
+    assert sum(len(block[2]) for blocks in bank.tables.values() for block in blocks) == 16
+    assert bank.values('HREGS', 0, 6) == [1, 0, 0, 0, 2, 3]
+    assert bank.values('HREGS', 40000, 1) == [4]
+    assert bank.values('COILS', 9000, 1) == [1]
+    assert bank.values('HREGS', 100, 1) is None
+    assert bank.values('HREGS', 5, 2) is None
+    assert not bank.write('HREGS', 20000, [1])
+
+
+def test_holes_are_illegal_addresses():
+    for mode in ({'register_bank': True}, {'register_bank': True, 'rtu_engine': True}):
+        slave = support.slave485(DEFINITIONS, **mode)
+        for pdu in (struct.pack('>BHH', 0x03, 100, 1), struct.pack('>BHH', 0x06, 20000, 1),
+                    struct.pack('>BHH', 0x05, 5000, 0xFF00)):
+            assert slave.process_pdu(pdu) == bytes((pdu[0] | 0x80, 0x02)), (mode, pdu)
+        assert slave.process_pdu(struct.pack('>BHH', 0x03, 40000, 1)) == struct.pack('>BBH', 0x03, 2, 4), mode
+        if slave.engine is not None:
+            from test_engine import load
+
+            for pdu in (struct.pack('>BHH', 0x03, 100, 1), struct.pack('>BHH', 0x06, 20000, 1)):
+                length = slave.engine.respond(load(slave.engine, pdu))
+                assert bytes(slave.engine.tx[1:length - 2]) == bytes((pdu[0] | 0x80, 0x02)), pdu
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Read-through cache of the masters: time to live, LRU eviction and invalidation by writes.
+"""
+import support
+
+DEFINITIONS = {
+    'HREGS': {'SETPOINTS': {'register': 0, 'len': 8, 'val': list(range(8))}},
+    'IREGS': {'INPUTS': {'register': 0, 'len': 4, 'val': [1, 2, 3, 4]}}
+}
+
+
+def test_ttl():
+    import utime as time
+    from mela.mela import MelaReadCache
+
+    cache = MelaReadCache(ttl=40, ttls={'HREGS': 0})
+    cache.put(10, 'IREGS', 0, 4, [1, 2, 3, 4])
+    cache.put(10, 'HREGS', 0, 4, [5, 6, 7, 8])
+    cache.put(10, 'ISTS', 0, 4, [1, 0, 1, 0], ttl=200)
+    assert cache.get(10, 'IREGS', 1, 2) == (2, 3)
+    assert cache.get(10, 'IREGS', 2, 4) is None and cache.get(11, 'IREGS', 0, 1) is None
+    assert cache.get(10, 'HREGS', 0, 1) is None and len(cache.entries) == 2
+    time.sleep_ms(60)
+    assert cache.get(10, 'IREGS', 0, 1) is None and cache.get(10, 'ISTS', 0, 4) == (1, 0, 1, 0)
+    assert cache.stats['hits'] == 2 and cache.stats['misses'] == 4
+
+
+def test_lru_eviction():
+    from mela.mela import MelaReadCache
+
+    cache = MelaReadCache(size=2)
+    cache.put(10, 'IREGS', 0, 1, [1])
+    cache.put(10, 'IREGS', 1, 1, [2])
+    assert cache.get(10, 'IREGS', 0, 1) == (1,)
+    cache.put(10, 'IREGS', 2, 1, [3])
+    assert cache.get(10, 'IREGS', 1, 1) is None
+    assert cache.get(10, 'IREGS', 0, 1) == (1,) and cache.get(10, 'IREGS', 2, 1) == (3,)
+    cache.put(10, 'IREGS', 2, 1, [4])
+    assert cache.evictions == 1 and cache.get(10, 'IREGS', 2, 1) == (4,)
+
+
+def test_invalidation():
+    from mela.mela import MelaReadCache
+
+    cache = MelaReadCache()
+    for slave in (10, 11):
+        cache.put(slave, 'HREGS', 0, 4, [0, 1, 2, 3])
+        cache.put(slave, 'HREGS', 4, 4, [4, 5, 6, 7])
+        cache.put(slave, 'IREGS', 0, 4, [0, 1, 2, 3])
+    cache.invalidate(10, 'HREGS', 3, 2)
+    assert sorted(cache.entries) == [(10, 'IREGS', 0, 4), (11, 'HREGS', 0, 4), (11, 'HREGS', 4, 4), (11, 'IREGS', 0, 4)]
+    cache.invalidate(0, 'HREGS', 7, 1)
+    assert sorted(cache.entries) == [(10, 'IREGS', 0, 4), (11, 'HREGS', 0, 4), (11, 'IREGS', 0, 4)]
+
+
+def test_master_reads_through():
+    import uasyncio as asyncio
+
+    master, slave, requests = support.bus(DEFINITIONS, cache={'ttl': 5000})
+    assert list(master.read_block(10, 'HREGS', 0, 8)) == list(range(8))
+    assert list(master.read_block(10, 'HREGS', 2, 3)) == [2, 3, 4] and len(requests) == 1
+    assert list(master.read_block(10, 'HREGS', 0, 1, ttl=0)) == [0] and len(requests) == 2
+    master.write_single_register(10, 3, 99)
+    assert list(master.read_block(10, 'HREGS', 2, 3)) == [2, 99, 4] and len(requests) == 4
+    assert list(asyncio.run(master.read_block_async(10, 'HREGS', 3, 1))) == [99] and len(requests) == 4
+    asyncio.run(master.write_async(10, 'HREGS', 4, [7]))
+    assert list(asyncio.run(master.read_block_async(10, 'HREGS', 4, 1))) == [7] and len(requests) == 6
+    assert master.cache.stats['hits'] == 2 and master.cache.saved_us > 0
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Change tracking of registers written by a master, in every storage mode.
+"""
+import support
+
+DEFINITIONS = {
+    'HREGS': {'SETPOINT': {'register': 0, 'len': 1, 'val': 0}},
+    'IREGS': {'VALUE': {'register': 0, 'len': 1, 'val': 0}}
+}
+MODES = ({'register_bank': False}, {'register_bank': True}, {'register_bank': True, 'rtu_engine': True})
+
+
+def pair(mode: dict) -> tuple:
+    from machine import UART
+    from mela.mela import MelaModbusMaster485
+
+    slave = support.slave485(DEFINITIONS, change_tracking={'address': 100, 'table': 'IREGS'}, **mode)
+    master = MelaModbusMaster485({'baudrate': 115200})
+    UART.link(master.connection._uart, slave.connection._itf._uart, on_receive=slave.process)
+    return slave, master
+
+
+def test_master_write_is_tracked():
+    for mode in MODES:
+        slave, master = pair(mode)
+        assert list(master.read_block(10, 'IREGS', 100, 3)) == [0, 0, 0], mode
+        master.write_single_register(10, 0, 1234)
+        assert list(master.read_block(10, 'IREGS', 100, 3)) == [1, 1, 0], mode
+        assert slave.read_values('HREGS', 0, 1) == [1234], mode
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Typed points: initial values from the configuration and set_point, in every storage and definition mode.
+"""
+import support
+
+POINTS = {
+    'U16': ({'register': 0, 'len': 1, 'type': 'u16', 'val': 65000}, 65000, [65000]),
+    'I16': ({'register': 1, 'len': 1, 'type': 'i16', 'val': -2}, -2, [0xFFFE]),
+    'U32': ({'register': 2, 'len': 2, 'type': 'u32', 'val': 70000}, 70000, [1, 4464]),
+    'I32': ({'register': 4, 'len': 2, 'type': 'i32', 'val': -70000}, -70000, [0xFFFE, 0xEE90]),
+    'F32': ({'register': 6, 'len': 2, 'type': 'float32', 'val': 1.5}, 1.5, [0x3FC0, 0]),
+    'F32LE': ({'register': 8, 'len': 2, 'type': 'float32', 'order': 'little', 'val': 1.5}, 1.5, [0, 0x3FC0]),
+    'SCALED': ({'register': 10, 'len': 1, 'type': 'i16', 'scale': 0.1, 'val': 21.5}, 21.5, [215]),
+    'RAW': ({'register': 11, 'len': 2, 'val': [7, 8]}, None, [7, 8]),
+}
+MODES = ({'register_bank': False}, {'register_bank': True},
+         {'register_bank': False, 'compact_definitions': True}, {'register_bank': True, 'compact_definitions': True})
+
+
+def definitions(table: str) -> dict:
+    return {table: dict((name, dict(point[0])) for name, point in POINTS.items())}
+
+
+def rows(table: str) -> dict:
+    result = []
+    for name, (definition, value, words) in POINTS.items():
+        options = dict((k, v) for k, v in definition.items() if k not in ('register', 'len', 'type', 'val'))
+        result.append([name, definition['register'], definition['len'], definition.get('type'), definition['val'], options])
+    return {table: result}
+
+
+def check(slave, table: str, mode: dict) -> None:
+    for name, (definition, value, words) in POINTS.items():
+        assert slave.read_values(table, definition['register'], len(words)) == words, (mode, name)
+        if value is not None:
+            assert abs(slave.get_point(name) - value) < 1e-6, (mode, name)
+
+
+def test_initial_values():
+    for table in ('HREGS', 'IREGS'):
+        for mode in MODES:
+            check(support.slave485(definitions(table), **mode), table, mode)
+            check(support.slave485(rows(table), **mode), table, dict(mode, rows=True))
+
+
+def test_point_table_rows():
+    from mela.mela import MelaPointTable
+
+    points = MelaPointTable(rows('HREGS')['HREGS'])
+    again = MelaPointTable(points.rows())
+    for name, (definition, value, words) in POINTS.items():
+        assert again[name]['val'] == words, name
+
+
+def test_set_point():
+    for mode in MODES:
+        slave = support.slave485(definitions('HREGS'), **mode)
+        for name, (definition, value, words) in POINTS.items():
+            if value is not None:
+                slave.set_point(name, 0)
+                slave.set_point(name, value)
+        check(slave, 'HREGS', mode)
+
+
+def test_codecs_per_instance():
+    first = support.slave485({}, load_definitions_from_config=False)
+    second = support.slave485({}, load_definitions_from_config=False)
+    first.codecs['HREGS'] = None
+    assert second.codecs == {}
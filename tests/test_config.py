@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+The compiled configuration snapshot: rebuilding it on a FAT like file system and after a broken 'config.json'.
+"""
+import os
+
+import support
+
+DIRECTORY = 'test_config'
+
+
+class FatOS:
+    """
+    The os module of a file system which does not rename over an existing file.
+    """
+
+    def __getattr__(self, name: str):
+        return getattr(os, name)
+
+    def rename(self, source: str, target: str) -> None:
+        if target in os.listdir('.'):
+            raise OSError(17)
+        os.rename(source, target)
+
+
+def write(text: str) -> None:
+    with open('config.json', 'w') as config_file:
+        config_file.write(text)
+
+
+def snapshot(baudrate: int) -> str:
+    return '{"config": {"modbus": {"connect_type": false, "master485": {"baudrate": %d}}}}' % baudrate
+
+
+def run(test) -> None:
+    import mela.mela
+
+    cwd = os.getcwd()
+    try:
+        os.mkdir(DIRECTORY)
+    except OSError:
+        pass
+    os.chdir(DIRECTORY)
+    system = mela.mela.os
+    mela.mela.os = FatOS()
+    try:
+        test()
+    finally:
+        mela.mela.os = system
+        for name in os.listdir('.'):
+            os.remove(name)
+        os.chdir(cwd)
+        os.rmdir(DIRECTORY)
+
+
+def test_snapshot_is_replaced():
+    from mela.mela import MelaConfig
+
+    def test():
+        write(snapshot(9600))
+        assert MelaConfig(compiled=True).modbus_master485['baudrate'] == 9600
+        write(snapshot(19200))
+        assert MelaConfig(compiled=True).modbus_master485['baudrate'] == 19200
+        config = MelaConfig(compiled=True)
+        assert config._index is not None and config._data is None
+        config.data = {'config': {'modbus': {'master485': {'baudrate': 38400}}}}
+        assert config.save_config()
+        assert MelaConfig(compiled=True).modbus_master485['baudrate'] == 38400
+        assert 'config.json.tmp' not in os.listdir('.') and 'config.bin.tmp' not in os.listdir('.')
+
+    run(test)
+
+
+def test_broken_file_is_not_compiled():
+    from mela.mela import MelaConfig
+
+    def test():
+        write('{"config": ')
+        config = MelaConfig(compiled=True)
+        assert config._index is None
+        assert 'config.bin' not in os.listdir('.')
+        write(snapshot(9600))
+        assert MelaConfig(compiled=True).modbus_master485['baudrate'] == 9600
+
+    run(test)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Diagnostics: duration histograms, the transaction keys of a master and the register mirror of a slave.
+"""
+import support
+
+DEFINITIONS = {'HREGS': {'SETPOINT': {'register': 0, 'len': 1, 'val': 5}}}
+
+
+def test_histogram():
+    from mela.mela import MelaHistogram
+
+    histogram = MelaHistogram()
+    assert histogram.percentile(50) == 0
+    for us in (10, 63, 64, 127, 128, 1000):
+        histogram.add(us)
+    assert list(histogram.buckets[:5]) == [2, 2, 1, 0, 1]
+    assert histogram.count == 6 and histogram.total == 1392 and histogram.max == 1000
+    assert histogram.percentile(50) == 128 and histogram.percentile(99) == 1000
+    histogram.add(1 << 30)
+    assert histogram.buckets[MelaHistogram.BUCKETS - 1] == 1
+    histogram.reset()
+    assert histogram.count == 0 and sum(histogram.buckets) == 0 and histogram.percentile(99) == 0
+
+
+def test_overflow_key():
+    from mela.mela import MelaDiagnostics
+
+    diagnostics = MelaDiagnostics(max_keys=3)
+    diagnostics.transaction(10, 3, 1000)
+    diagnostics.transaction(10, 0x83, 2000)
+    diagnostics.transaction(11, 3, 0, 'timeout')
+    diagnostics.transaction(12, 3, 500)
+    diagnostics.transaction(13, 16, 0, 'crc')
+    diagnostics.transaction(11, 3, 700)
+    assert sorted(diagnostics.transactions) == [(0, 0), (10, 3), (11, 3)]
+    assert diagnostics.transactions[(10, 3)][0].count == 2
+    assert diagnostics.transactions[(11, 3)][1:] == [1, 0] and diagnostics.transactions[(11, 3)][0].count == 1
+    assert diagnostics.transactions[(0, 0)][0].count == 1 and diagnostics.transactions[(0, 0)][1:] == [0, 1]
+
+    words = diagnostics.registers()
+    assert len(words) == MelaDiagnostics.block_length(3) == 32
+    key = words.index(10, 8)
+    assert words[key:key + 8] == [10, 3, 2, 10, 20, 20, 0, 0]
+    assert diagnostics.registers(40)[32:] == [0] * 8
+    assert len(diagnostics.registers(10)) == 10
+    diagnostics.reset()
+    assert diagnostics.transactions == {} and diagnostics.registers() == [0] * 32
+
+
+def test_master_transactions():
+    master, slave, requests = support.bus(DEFINITIONS, timeout=50, diagnostics={'max_keys': 2})
+    assert list(master.read_block(10, 'HREGS', 0, 1)) == [5]
+    master.write_single_register(10, 0, 7)
+    slave.timeout_rate = 1.0
+    try:
+        master.read_block(10, 'HREGS', 0, 1)
+        assert False, 'read from a dead slave'
+    except OSError:
+        pass
+    transactions = master.diagnostics.transactions
+    assert sorted(transactions) == [(0, 0), (10, 3)]
+    assert transactions[(10, 3)][0].count == 1 and transactions[(10, 3)][1] == 1
+    assert transactions[(0, 0)][0].count == 1 and transactions[(0, 0)][1] == 0
+
+
+def test_register_mirror():
+    from machine import UART
+    from mela.mela import MelaDiagnostics, MelaModbusMaster485
+
+    length = MelaDiagnostics.block_length(2)
+    for mode in ({'register_bank': False}, {'register_bank': True}, {'register_bank': True, 'rtu_engine': True}):
+        slave = support.slave485(DEFINITIONS, diagnostics={'address': 900, 'max_keys': 2, 'interval': 0}, **mode)
+        master = MelaModbusMaster485({'baudrate': 115200})
+        UART.link(master.connection._uart, slave.connection._itf._uart, on_receive=slave.process)
+        first = list(master.read_block(10, 'IREGS', 900, length))
+        assert first[4] == 0 and len(first) == length, mode
+        master.read_block(10, 'HREGS', 0, 1)
+        words = list(master.read_block(10, 'IREGS', 900, length))
+        assert words[4] == 2 and words[0] == 2, (mode, words)
+        assert words[8:] == [0] * (length - 8), mode
+        assert slave.read_values('HREGS', 0, 1) == [5], mode
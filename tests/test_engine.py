@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+RTU engine: responses as the Mela request handler builds them, without heap allocation.
+"""
+import gc
+import struct
+
+import support
+
+DEFINITIONS = {
+    'COILS': {'COILS': {'register': 0, 'len': 16, 'val': [1, 0] * 8}},
+    'ISTS': {'ISTS': {'register': 0, 'len': 16, 'val': [0, 1] * 8}},
+    'HREGS': {'HREGS': {'register': 0, 'len': 32, 'val': list(range(32))}},
+    'IREGS': {'IREGS': {'register': 0, 'len': 8, 'val': [0] * 8}}
+}
+REQUESTS = (
+    ('FC01', struct.pack('>BHH', 0x01, 0, 16)),
+    ('FC02', struct.pack('>BHH', 0x02, 3, 9)),
+    ('FC03', struct.pack('>BHH', 0x03, 0, 32)),
+    ('FC04', struct.pack('>BHH', 0x04, 0, 8)),
+    ('FC05', struct.pack('>BHH', 0x05, 2, 0xFF00)),
+    ('FC06', struct.pack('>BHH', 0x06, 3, 1234)),
+    ('FC15', struct.pack('>BHHBH', 0x0F, 0, 16, 2, 0x5AA5)),
+    ('FC16', struct.pack('>BHHB', 0x10, 0, 16, 32) + struct.pack('>16H', *range(16)))
+)
+
+
+def engine():
+    return support.slave485(DEFINITIONS, register_bank=True, rtu_engine=True).engine
+
+
+def load(engine, pdu: bytes) -> int:
+    """
+    Put a request frame for the slave into the receive buffer of the engine.
+
+    :return: Frame length.
+    """
+    import host_rs485
+
+    frame = bytes((engine.address,)) + pdu
+    frame += host_rs485.crc16(frame)
+    engine.rx[:len(frame)] = frame
+    return len(frame)
+
+
+def test_respond_matches_process_pdu():
+    rtu = engine()
+    for name, pdu in REQUESTS:
+        length = rtu.respond(load(rtu, pdu))
+        assert bytes(rtu.tx[1:length - 2]) == rtu.slave.process_pdu(pdu), name
+
+
+def test_respond_allocates_nothing():
+    if not support.IS_MICROPYTHON:
+        support.skip('gc.mem_alloc deltas are only meaningful on MicroPython')
+    rtu = engine()
+    for name, pdu in REQUESTS:
+        n = load(rtu, pdu)
+        rtu.respond(n)
+        gc.collect()
+        gc.disable()
+        try:
+            before = gc.mem_alloc()
+            for _ in range(10):
+                rtu.respond(n)
+            used = gc.mem_alloc() - before
+        finally:
+            gc.enable()
+        assert used == 0, '{} allocated {} bytes in 10 responses'.format(name, used)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Gateway request merging over the simulated RS485 bus.
+"""
+import struct
+
+import support
+
+DEFINITIONS = {'HREGS': {'SETPOINT': {'register': 0, 'len': 1, 'val': 1}}}
+
+
+class Writer:
+    """
+    Stream writer of a client connection, collecting the MBAP responses.
+    """
+
+    def __init__(self):
+        self.responses = []
+
+    def write(self, data) -> None:
+        self.responses.append(bytes(data[7:]))
+
+    async def drain(self) -> None:
+        pass
+
+
+def gateway():
+    import network
+    import host_rs485
+    from mela.mela import MelaModbusGateway, MelaModbusMaster485
+
+    bus = host_rs485.RS485Bus(baudrate=115200)
+    slave = bus.add_slave(10, DEFINITIONS, latency_ms=1)
+    functions = []
+    answer = slave.answer
+    slave.answer = lambda pdu: functions.append(pdu[0]) or answer(pdu)
+    master = MelaModbusMaster485({'baudrate': 115200}, uart=bus.port())
+    return MelaModbusGateway({'port': 502}, network.WLAN(), master), functions
+
+
+def run(gw) -> None:
+    import uasyncio as asyncio
+
+    async def main():
+        worker = asyncio.create_task(gw._bus())
+        while gw._queue:
+            await asyncio.sleep_ms(5)
+        worker.cancel()
+
+    asyncio.run(main())
+
+
+def test_read_after_write_is_not_merged():
+    gw, functions = gateway()
+    a, b = Writer(), Writer()
+    read = struct.pack('>BHH', 0x03, 0, 1)
+    gw.submit(10, read, a, 1)
+    gw.submit(10, struct.pack('>BHH', 0x06, 0, 99), b, 2)
+    gw.submit(10, read, b, 3)
+    run(gw)
+    assert functions == [0x03, 0x06, 0x03]
+    assert a.responses == [b'\x03\x02\x00\x01']
+    assert b.responses == [struct.pack('>BHH', 0x06, 0, 99), b'\x03\x02\x00\x63']
+
+
+def test_identical_reads_are_merged():
+    gw, functions = gateway()
+    a, b = Writer(), Writer()
+    read = struct.pack('>BHH', 0x03, 0, 1)
+    gw.submit(10, read, a, 1)
+    gw.submit(10, read, b, 2)
+    run(gw)
+    assert functions == [0x03]
+    assert gw.merged == 1
+    assert a.responses == b.responses == [b'\x03\x02\x00\x01']
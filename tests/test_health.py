@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+RS485 slave health: adaptive response timeouts and the per-slave circuit breaker.
+"""
+import support
+
+DEFINITIONS = {'HREGS': {'SETPOINT': {'register': 0, 'len': 1, 'val': 5}}}
+
+
+def test_timeout_bounds():
+    from mela.mela import MelaBusHealth
+
+    health = MelaBusHealth(min_timeout=20, max_timeout=500)
+    assert health.timeout_us(10) == 500000
+    health.success(10, 5000)
+    assert health.timeout_us(10) == 20000
+    health.success(11, 40000)
+    assert health.timeout_us(11) == 120000
+    for _ in range(100):
+        health.success(11, 40000)
+    assert 40000 <= health.timeout_us(11) < 45000
+    health.success(12, 400000)
+    assert health.timeout_us(12) == 500000
+    assert health.gap_us(11, 1750) == 1750
+    health.success(11, 40000, gap_us=2000)
+    assert health.gap_us(11, 1750) == 4000
+
+
+def test_breaker():
+    import utime as time
+    from mela.mela import MelaBusHealth
+
+    health = MelaBusHealth(failures=3, retry=40, retry_max=100)
+    for _ in range(2):
+        assert health.allow(10)
+        health.failure(10)
+    assert not health.is_open(10) and health.allow(10)
+    health.failure(10, crc=True)
+    assert health.is_open(10) and not health.allow(10) and health.allow(11)
+
+    delays = []
+    for _ in range(4):
+        state = health.slaves[10]
+        delays.append(time.ticks_diff(state[health.NEXT_TRY], time.ticks_ms()))
+        time.sleep_ms(delays[-1] + 5)
+        assert health.allow(10)
+        health.failure(10)
+    assert [(d + 5) // 10 * 10 for d in delays] == [40, 80, 100, 100], delays
+    health.success(10, 1000)
+    assert not health.is_open(10) and health.allow(10)
+    stats = health.stats[10]
+    assert stats['timeouts'] == 6 and stats['crc_errors'] == 1 and stats['skipped'] == 1 and not stats['open']
+
+
+def test_dead_slave_is_skipped():
+    import utime as time
+
+    master, slave, requests = support.bus(DEFINITIONS, timeout=100, adaptive={'min_timeout': 5, 'failures': 2, 'retry': 50})
+    assert list(master.read_block(10, 'HREGS', 0, 1)) == [5]
+    assert 5000 <= master.health.timeout_us(10) < 100000
+    slave.timeout_rate = 1.0
+    for _ in range(2):
+        try:
+            master.read_block(10, 'HREGS', 0, 1)
+            assert False, 'read from a dead slave'
+        except OSError:
+            pass
+    assert master.health.is_open(10) and len(requests) == 3
+    start = time.ticks_ms()
+    try:
+        master.read_block(10, 'HREGS', 0, 1)
+        assert False, 'read through an open circuit'
+    except OSError as e:
+        assert 'skipped' in str(e)
+    assert time.ticks_diff(time.ticks_ms(), start) < 5 and len(requests) == 3
+    slave.timeout_rate = 0.0
+    time.sleep_ms(60)
+    assert list(master.read_block(10, 'HREGS', 0, 1)) == [5] and not master.health.is_open(10)
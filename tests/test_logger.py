@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Register history in rotating segment files: rotation, queries and a change of the logged registers.
+"""
+import os
+
+import support
+
+DIRECTORY = 'test_logger'
+
+
+def logger(registers: list = (('IREGS', 1, 4),), **config):
+    from mela.mela import MelaLogger
+
+    return MelaLogger(dict({'directory': DIRECTORY, 'registers': [list(r) for r in registers], 'batch': 4}, **config))
+
+
+def segments() -> list:
+    return sorted(name for name in os.listdir(DIRECTORY) if name.endswith('.seg'))
+
+
+def clean() -> None:
+    try:
+        for name in os.listdir(DIRECTORY):
+            os.remove(DIRECTORY + '/' + name)
+        os.rmdir(DIRECTORY)
+    except OSError:
+        pass
+
+
+def run(test) -> None:
+    clean()
+    try:
+        test()
+    finally:
+        clean()
+
+
+def test_rotation():
+    def test():
+        history = logger(segment_records=3, max_segments=2)
+        for t in range(1, 8):
+            history.log([t, 0, 0, 0], t)
+        history.flush()
+        assert segments() == ['00000002.seg', '00000003.seg']
+        assert [t for t, values in history.query()] == [4, 5, 6, 7]
+        again = logger(segment_records=3, max_segments=2)
+        assert again.records == 4 and again.span == (4, 7)
+        again.log([8, 0, 0, 0], 8)
+        again.flush()
+        assert [t for t, values in again.query()] == [4, 5, 6, 7, 8]
+
+    run(test)
+
+
+def test_query():
+    def test():
+        history = logger(segment_records=4)
+        for t in range(10, 30, 2):
+            history.log([t, t + 1, 0xFFFF, 0], t)
+        assert list(history.query(15, 20)) == [(16, (16, 17, 0xFFFF, 0)), (18, (18, 19, 0xFFFF, 0)), (20, (20, 21, 0xFFFF, 0))]
+        assert [t for t, values in history.query(21, limit=2)] == [22, 24]
+        assert list(history.query(100)) == []
+        history.log([1, 0, 0, 0], 5)
+        assert [t for t, values in history.query(0, 10)] == [10, 5]
+        assert len(segments()) == 4
+
+    run(test)
+
+
+def test_layout_change():
+    def test():
+        history = logger()
+        for t in range(1, 4):
+            history.log([t, 2, 3, 4], t)
+        history.flush()
+        for registers in ((('IREGS', 1, 1),), (('IREGS', 2, 4),)):
+            changed = logger(registers)
+            assert changed.records == 0 and list(changed.query()) == []
+            changed.log([9] * changed.words, 10)
+            changed.flush()
+            assert list(changed.query()) == [(10, tuple([9] * changed.words))]
+        assert segments() == ['00000001.seg', '00000002.seg', '00000003.seg']
+        assert os.stat(DIRECTORY + '/00000001.seg')[6] == len(history.header) + 3 * history.record_size
+        again = logger()
+        assert list(again.query()) == [(1, (1, 2, 3, 4)), (2, (2, 2, 3, 4)), (3, (3, 2, 3, 4))]
+
+    run(test)
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Modbus TCP pipeline against a local stream server.
+"""
+import struct
+
+import support
+
+PORT = 5021
+
+
+def exchange(response) -> tuple:
+    """
+    Send one read through a pipeline to a server which answers with response(tid).
+
+    :return: (result or exception of the request, pipeline connected afterwards, outstanding transactions).
+    """
+    import uasyncio as asyncio
+    from mela.mela import MelaModbusTCPPipeline
+
+    async def serve(reader, writer):
+        try:
+            header = await reader.readexactly(7)
+            await reader.readexactly(struct.unpack('>HHHB', header)[2] - 1)
+            writer.write(response(struct.unpack('>H', header[:2])[0]))
+            await writer.drain()
+            await reader.read(1)
+        except (OSError, EOFError):
+            pass
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(serve, '127.0.0.1', PORT)
+        pipeline = MelaModbusTCPPipeline('127.0.0.1', PORT, timeout=2)
+        try:
+            result = await pipeline.read_block(1, 'HREGS', 0, 1)
+        except OSError as e:
+            result = e
+        await asyncio.sleep_ms(10)
+        state = (result, pipeline.connected, pipeline.outstanding)
+        await pipeline.close()
+        server.close()
+        await server.wait_closed()
+        return state
+
+    return asyncio.run(main())
+
+
+def test_response():
+    assert exchange(lambda tid: struct.pack('>HHHBBBH', tid, 0, 5, 1, 0x03, 2, 1234)) == ((1234,), True, 0)
+
+
+def test_invalid_header():
+    import utime as time
+
+    for pid, length in ((0, 0), (0, 1), (0, 255), (1, 5)):
+        start = time.ticks_ms()
+        result, connected, outstanding = exchange(lambda tid: struct.pack('>HHHB', tid, pid, length, 1) + bytes(8))
+        assert isinstance(result, OSError) and 'MBAP' in str(result), (pid, length, result)
+        assert time.ticks_diff(time.ticks_ms(), start) < 1000, (pid, length)
+        assert not connected and outstanding == 0, (pid, length)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Poll plans: merging points into read blocks and splitting the responses, over the simulated RS485 bus.
+"""
+import support
+
+DEFINITIONS = {
+    'HREGS': {
+        'COUNT': {'register': 0, 'len': 1, 'type': 'u16', 'val': 7},
+        'TOTAL': {'register': 1, 'len': 2, 'type': 'u32', 'val': 70000},
+        'LEVEL': {'register': 5, 'len': 2, 'type': 'float32', 'val': 1.5},
+        'TEMP': {'register': 7, 'len': 1, 'type': 'i16', 'scale': 0.1, 'val': -21.5},
+        'RAW': {'register': 8, 'len': 2, 'val': [3, 4]},
+        'FAR': {'register': 40, 'len': 1, 'val': 9}
+    },
+    'IREGS': {'INPUT': {'register': 0, 'len': 1, 'val': 5}}
+}
+
+
+def points(**extra) -> dict:
+    result = {}
+    for table, definitions in DEFINITIONS.items():
+        for name, definition in definitions.items():
+            point = dict(definition, slave=10, table=table)
+            del point['val']
+            result[name] = point
+    result.update(extra)
+    return result
+
+
+def blocks(plan) -> list:
+    return [(block[0], block[1], block[2], block[3], [name for name, offset, length in block[4]]) for block in plan.blocks]
+
+
+def test_gap_merging():
+    from mela.mela import MelaPollPlan
+
+    assert blocks(MelaPollPlan(points())) == [
+        (10, 'HREGS', 0, 10, ['COUNT', 'TOTAL', 'LEVEL', 'TEMP', 'RAW']),
+        (10, 'HREGS', 40, 1, ['FAR']),
+        (10, 'IREGS', 0, 1, ['INPUT'])
+    ]
+    assert blocks(MelaPollPlan(points(), max_gap=1)) == [
+        (10, 'HREGS', 0, 3, ['COUNT', 'TOTAL']),
+        (10, 'HREGS', 5, 5, ['LEVEL', 'TEMP', 'RAW']),
+        (10, 'HREGS', 40, 1, ['FAR']),
+        (10, 'IREGS', 0, 1, ['INPUT'])
+    ]
+    assert len(MelaPollPlan(points(), max_gap=30)) == 2
+    other = MelaPollPlan(points(OTHER={'slave': 11, 'table': 'HREGS', 'register': 2}))
+    assert (11, 'HREGS', 2, 1, ['OTHER']) in blocks(other) and len(other) == 4
+
+
+def test_quantity_limit():
+    from mela.mela import MelaPollPlan
+
+    plan = MelaPollPlan({'A': {'slave': 1, 'table': 'HREGS', 'register': 0, 'len': 100},
+                         'B': {'slave': 1, 'table': 'HREGS', 'register': 102, 'len': 23},
+                         'C': {'slave': 1, 'table': 'HREGS', 'register': 125, 'len': 2}})
+    assert [(block[2], block[3]) for block in plan.blocks] == [(0, 125), (125, 2)]
+    coils = MelaPollPlan({'A': {'slave': 1, 'table': 'COILS', 'register': 0, 'len': 1999},
+                          'B': {'slave': 1, 'table': 'COILS', 'register': 1999, 'len': 2}})
+    assert [(block[2], block[3]) for block in coils.blocks] == [(0, 1999), (1999, 2)]
+    for bad in ({'slave': 1, 'table': 'HREGS', 'register': 0, 'len': 126}, {'slave': 1, 'table': 'LOGS', 'register': 0}):
+        try:
+            MelaPollPlan({'A': bad})
+            assert False, bad
+        except ValueError:
+            pass
+
+
+def test_split_typed_values():
+    from mela.mela import MelaPollPlan
+
+    plan = MelaPollPlan(points(), max_gap=1)
+    values = {}
+    plan.split(plan.blocks[0], [7, 1, 4464], values)
+    plan.split(plan.blocks[1], [0x3FC0, 0, 0xFF29, 3, 4], values)
+    assert values == {'COUNT': 7, 'TOTAL': 70000, 'LEVEL': 1.5, 'TEMP': -21.5, 'RAW': (3, 4)}
+    error = OSError('timeout')
+    plan.split(plan.blocks[2], error, values)
+    assert values['FAR'] is None and plan.errors == [(10, 'HREGS', 40, 1, error)]
+
+
+def test_poll_over_bus():
+    import uasyncio as asyncio
+
+    master, slave, requests = support.bus(DEFINITIONS)
+    plan = master.poll_plan(points(MISSING={'slave': 11, 'table': 'HREGS', 'register': 0}))
+    master.timeout = 20
+    expected = {'COUNT': 7, 'TOTAL': 70000, 'LEVEL': 1.5, 'TEMP': -21.5, 'RAW': (3, 4), 'FAR': 9, 'INPUT': 5, 'MISSING': None}
+    values = master.poll(plan)
+    assert abs(values.pop('TEMP') + 21.5) < 1e-6 and abs(expected.pop('TEMP') + 21.5) < 1e-6
+    assert values == expected
+    assert len(requests) == 3 and len(plan.errors) == 1 and plan.errors[0][0] == 11
+    values = asyncio.run(master.poll_async(plan))
+    assert values['TOTAL'] == 70000 and values['MISSING'] is None and len(requests) == 6
+    assert master.poll(master.poll_plan(points(), max_gap=0)) == master.poll(master.poll_plan(points()))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Modbus TCP connection pool against local stream servers: backoff with jitter, background reconnects, keepalive and fail-fast.
+"""
+import struct
+
+import support
+
+PORT = 5031
+DEAD = 5039
+
+
+class Server:
+    """
+    Modbus TCP server answering every read with the register value 1234, or not at all when silent.
+    """
+
+    def __init__(self, port: int, silent: bool = False):
+        self.port = port
+        self.silent = silent
+        self.requests = []
+        self.server = None
+
+    async def start(self) -> 'Server':
+        import uasyncio as asyncio
+
+        self.server = await asyncio.start_server(self.serve, '127.0.0.1', self.port)
+        return self
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def serve(self, reader, writer) -> None:
+        try:
+            while True:
+                header = await reader.readexactly(7)
+                tid, pid, length, unit = struct.unpack('>HHHB', header)
+                pdu = await reader.readexactly(length - 1)
+                self.requests.append(pdu)
+                if not self.silent:
+                    writer.write(struct.pack('>HHHBBBH', tid, 0, 5, unit, pdu[0], 2, 1234))
+                    await writer.drain()
+        except (OSError, EOFError):
+            pass
+        writer.close()
+
+
+def pool(**config):
+    from mela.mela import MelaModbusTCPPool
+
+    return MelaModbusTCPPool(**dict({'timeout': 0.2, 'backoff_min': 0.1, 'backoff_max': 0.4}, **config))
+
+
+def test_backoff_jitter():
+    from mela.mela import backoff_ms
+
+    for failures, delay in ((0, 100), (1, 200), (2, 400), (3, 400), (40, 400)):
+        delays = [backoff_ms(failures, 0.1, 0.4) for _ in range(200)]
+        assert delay // 2 <= min(delays) and max(delays) < delay, (failures, min(delays), max(delays))
+        assert len(set(delays)) > 10, failures
+
+
+def test_backoff_and_background_reconnect():
+    import uasyncio as asyncio
+    import utime as time
+
+    async def main():
+        connections = pool()
+        try:
+            await connections.read_block('127.0.0.1', 1, 'HREGS', 0, 1, PORT)
+            assert False, 'connected to a closed port'
+        except OSError:
+            pass
+        assert not connections.available('127.0.0.1', PORT, 1)
+        start = time.ticks_ms()
+        try:
+            await connections.read_block('127.0.0.1', 1, 'HREGS', 0, 1, PORT)
+            assert False, 'request while backing off'
+        except OSError as e:
+            assert 'backing off' in str(e)
+        assert time.ticks_diff(time.ticks_ms(), start) < 20
+
+        server = await Server(PORT).start()
+        runner = asyncio.create_task(connections.run(10))
+        await asyncio.sleep_ms(150)
+        assert connections._connections[('127.0.0.1', PORT)].connected
+        assert await connections.read_block('127.0.0.1', 1, 'HREGS', 0, 1, PORT) == (1234,)
+        assert connections._endpoints[('127.0.0.1', PORT, 1)][0] == 0
+        runner.cancel()
+        await connections.close()
+        await server.stop()
+
+    asyncio.run(main())
+
+
+def test_keepalive():
+    import uasyncio as asyncio
+
+    async def main():
+        server = await Server(PORT).start()
+        connections = pool(keepalive=0.05)
+        assert await connections.read_block('127.0.0.1', 1, 'HREGS', 0, 1, PORT) == (1234,)
+        runner = asyncio.create_task(connections.run(10))
+        await asyncio.sleep_ms(200)
+        runner.cancel()
+        assert len(server.requests) >= 3
+        assert all(pdu == struct.pack('>BHH', 0x03, 0, 1) for pdu in server.requests)
+        await connections.close()
+        await server.stop()
+
+    asyncio.run(main())
+
+
+def test_dead_slave_fails_fast():
+    import uasyncio as asyncio
+    import utime as time
+
+    async def main():
+        alive = await Server(PORT).start()
+        dead = await Server(DEAD, silent=True).start()
+        connections = pool(timeout=0.1, backoff_min=10, backoff_max=10)
+
+        async def timed(port: int) -> tuple:
+            start = time.ticks_ms()
+            try:
+                result = await connections.read_block('127.0.0.1', 1, 'HREGS', 0, 1, port)
+            except OSError as e:
+                result = e
+            return result, time.ticks_diff(time.ticks_ms(), start)
+
+        results = await asyncio.gather(timed(DEAD), timed(PORT))
+        assert isinstance(results[0][0], OSError) and results[0][1] < 500, results[0]
+        assert results[1][0] == (1234,) and results[1][1] < 50, results[1]
+        failed, elapsed = await timed(DEAD)
+        assert 'backing off' in str(failed) and elapsed < 20
+        assert (await timed(PORT))[0] == (1234,)
+        await connections.close()
+        await alive.stop()
+        await dead.stop()
+
+    asyncio.run(main())
+
+
+def test_single_master_retries_after_backoff():
+    import socket
+    import utime as time
+    from mela.mela import MelaModbusMasterTCP
+
+    config = {'slave_ip': '127.0.0.1', 'port': PORT, 'timeout': 0.2, 'always_reconnect': True,
+              'backoff_min': 0.05, 'backoff_max': 0.05}
+    master = MelaModbusMasterTCP(config, wifi=True)
+    for _ in range(3):
+        start = time.ticks_ms()
+        try:
+            master.connection
+            assert False, 'connected while backing off'
+        except OSError:
+            pass
+        assert time.ticks_diff(time.ticks_ms(), start) < 20
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(socket.getaddrinfo('127.0.0.1', PORT)[0][-1])
+    listener.listen(1)
+    try:
+        time.sleep_ms(60)
+        assert master.connection is not None and master._failures == 0
+    finally:
+        master.close()
+        listener.close()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Reloading the configuration in place, from 'config.json' and from the compiled snapshot.
+"""
+import os
+
+import support
+
+DIRECTORY = 'test_reload'
+
+
+def config(baudrate: int) -> dict:
+    return {'config': {
+        'wifi': {'connect_on_boot': True, 'networks': [{'ssid': 'LAN', 'key': '12345'}]},
+        'modbus': {
+            'connect_type': ['master485', 'slaveTCP'],
+            'master485': {'baudrate': baudrate},
+            'slaveTCP': {'port': 5020, 'load_definitions_from_config': True,
+                         'register_definitions': {'HREGS': {'SETPOINT': {'register': 0, 'len': 1, 'val': 0}}}}
+        }
+    }}
+
+
+def write(data: dict) -> None:
+    import ujson as json
+
+    with open('config.json', 'w') as config_file:
+        json.dump(data, config_file)
+
+
+def reconfigured(wrapper, calls: list, name: str) -> None:
+    original = wrapper.reconfigure
+
+    def reconfigure(*args):
+        calls.append(name)
+        return original(*args)
+
+    wrapper.reconfigure = reconfigure
+
+
+def enter() -> str:
+    cwd = os.getcwd()
+    try:
+        os.mkdir(DIRECTORY)
+    except OSError:
+        pass
+    os.chdir(DIRECTORY)
+    return cwd
+
+
+def leave(cwd: str) -> None:
+    for name in os.listdir('.'):
+        os.remove(name)
+    os.chdir(cwd)
+    os.rmdir(DIRECTORY)
+
+
+def test_only_changed_role_is_reconfigured():
+    from mela.mela import Mela
+
+    cwd = enter()
+    try:
+        for compiled in (False, True):
+            write(config(9600))
+            plc = Mela(compiled_config=compiled)
+            calls = []
+            reconfigured(plc.modbus_master485, calls, 'master485')
+            reconfigured(plc.modbus_slaveTCP, calls, 'slaveTCP')
+            write(config(19200))
+            assert plc.reload_config() == ['modbus.master485'], compiled
+            assert calls == ['master485'], compiled
+            assert plc.config.modbus_master485['baudrate'] == 19200, compiled
+            assert plc.reload_config() == [], compiled
+            plc.modbus_slaveTCP.close()
+    finally:
+        leave(cwd)
+
+
+def test_broken_file_keeps_running_configuration():
+    from mela.mela import Mela
+
+    cwd = enter()
+    try:
+        for compiled in (False, True):
+            write(config(9600))
+            plc = Mela(compiled_config=compiled)
+            with open('config.json', 'w') as config_file:
+                config_file.write('{"config": {"modbus": ')
+            assert plc.reload_config(save=True) == [], compiled
+            assert plc.roles == ['master485', 'slaveTCP'], compiled
+            assert plc.modbus_master485 is not None and plc.modbus_slaveTCP is not None, compiled
+            assert plc.config.modbus_master485['baudrate'] == 9600, compiled
+            with open('config.json') as config_file:
+                assert config_file.read() == '{"config": {"modbus": ', compiled
+            plc.modbus_slaveTCP.close()
+    finally:
+        leave(cwd)
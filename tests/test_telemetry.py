@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+Telemetry publisher: sampling into the shadow buffer and the swap in commit, in every storage mode.
+"""
+import support
+
+DEFINITIONS = {'IREGS': {
+    'LEVEL': {'register': 0, 'len': 2, 'type': 'float32', 'val': 0},
+    'COUNT': {'register': 2, 'len': 1, 'val': 0}
+}}
+MODES = ({'register_bank': False}, {'register_bank': True})
+
+
+class Source:
+    """
+    Telemetry source returning 1, 2, 3... and counting its calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self) -> int:
+        self.calls += 1
+        return self.calls
+
+
+def test_sample_and_commit():
+    import utime as time
+
+    for mode in MODES:
+        slave = support.slave485(DEFINITIONS, **mode)
+        level, count = Source(), Source()
+        slave.publish('LEVEL', level, 0)
+        slave.publish('COUNT', count, 50)
+        assert slave.commit() == 0
+        slave.sample()
+        assert slave.read_values('IREGS', 0, 3) == [0, 0, 0], mode
+        assert slave.commit() == 2
+        assert slave.get_point('LEVEL') == 1.0 and slave.read_values('IREGS', 2, 1) == [1], mode
+        slave.sample()
+        assert level.calls == 2 and count.calls == 1, mode
+        assert slave.commit() == 1 and slave.get_point('LEVEL') == 2.0
+        time.sleep_ms(60)
+        slave.timer_callback()
+        assert slave.commit() == 2 and slave.read_values('IREGS', 2, 1) == [2], mode
+
+
+def test_sample_during_commit():
+    for mode in MODES:
+        slave = support.slave485(DEFINITIONS, **mode)
+        level = Source()
+        slave.publish('LEVEL', level, 0)
+        slave.sample()
+        buffers = (slave._staged, slave._spare)
+        set_point = slave.set_point
+
+        def interrupted(name, value):
+            slave.set_point = set_point
+            slave.sample()
+            set_point(name, value)
+
+        slave.set_point = interrupted
+        assert slave.commit() == 1
+        assert slave.get_point('LEVEL') == 1.0 and slave._staged == {'LEVEL': 2}, mode
+        assert (slave._spare, slave._staged) == buffers and not buffers[0]
+        assert slave.commit() == 1 and slave.get_point('LEVEL') == 2.0 and slave.commit() == 0, mode
+
+
+def test_process_commits():
+    slave = support.slave485(DEFINITIONS)
+    slave.publish('COUNT', lambda: 42)
+    slave.sample()
+    slave.process()
+    assert slave.read_values('IREGS', 2, 1) == [42]
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+WLAN connection manager: the cached access point first, the scan as fallback, scans in run only when allowed.
+"""
+import os
+
+import support
+
+DIRECTORY = 'test_wlan'
+NEAR = b'\x02\x00\x00\x00\x00\x01'
+FAR = b'\x02\x00\x00\x00\x00\x02'
+CONFIG = {'networks': [{'ssid': 'LAN', 'key': '12345'}], 'direct_timeout': 50, 'connect_timeout': 50,
+          'check_interval': 10, 'roam_interval': 0}
+
+
+class Station:
+    """
+    Station interface which connects on the next poll to the reachable access points.
+    """
+
+    def __init__(self, reachable: tuple):
+        self.reachable = reachable
+        self.attempts = []
+        self.pending = None
+        self.connected = False
+        self.rssi = -55
+
+    def active(self, state: bool = None) -> bool:
+        return True
+
+    def connect(self, ssid: str, key: str, bssid: bytes = None) -> None:
+        self.attempts.append(bssid)
+        self.pending = bssid
+
+    def disconnect(self) -> None:
+        self.connected = False
+        self.pending = None
+
+    def isconnected(self) -> bool:
+        if self.pending is not None and self.pending in self.reachable:
+            self.connected = True
+            self.pending = None
+        return self.connected
+
+    def status(self, param: str = None) -> int:
+        if param == 'rssi':
+            return self.rssi
+        return 201 if self.pending is not None and self.pending not in self.reachable else 1001
+
+    def ifconfig(self) -> tuple:
+        return ('127.0.0.1', '255.0.0.0', '127.0.0.1', '127.0.0.1')
+
+
+class Info:
+    """
+    Scan results of the access points, counting the scans.
+    """
+
+    def __init__(self):
+        self.scans = 0
+
+    def wlan_scan(self, prn: bool = True) -> list:
+        self.scans += 1
+        return [(b'LAN', FAR, 11, -60, 3, False), (b'LAN', NEAR, 6, -40, 3, False), (b'OTHER', bytes(6), 1, -30, 3, False)]
+
+
+def manager(reachable: tuple, cached: bytes = None, **config):
+    from mela.mela import MelaWLAN
+
+    if cached:
+        with open(MelaWLAN.CACHE_FILE, 'w') as cache_file:
+            cache_file.write('{"ssid": "LAN", "bssid": "%s", "channel": 11}' % cached.hex())
+    elif MelaWLAN.CACHE_FILE in os.listdir('.'):
+        os.remove(MelaWLAN.CACHE_FILE)
+    wlan = MelaWLAN(dict(CONFIG, **config), Info())
+    wlan.sta_if = Station(reachable)
+    return wlan
+
+
+def run(test) -> None:
+    cwd = os.getcwd()
+    try:
+        os.mkdir(DIRECTORY)
+    except OSError:
+        pass
+    os.chdir(DIRECTORY)
+    try:
+        test()
+    finally:
+        for name in os.listdir('.'):
+            os.remove(name)
+        os.chdir(cwd)
+        os.rmdir(DIRECTORY)
+
+
+def test_direct_connection():
+    def test():
+        wlan = manager((FAR,), FAR)
+        assert not wlan.step() and wlan._state == 'direct'
+        assert wlan.step()
+        assert wlan.sta_if.attempts == [FAR] and wlan.info.scans == 0
+
+    run(test)
+
+
+def test_scan_fallback():
+    import utime as time
+
+    def test():
+        wlan = manager((NEAR,), FAR)
+        assert not wlan.step() and wlan._state == 'direct'
+        assert not wlan.step() and wlan._state == 'scanned'
+        assert wlan.sta_if.attempts == [FAR, NEAR] and wlan.info.scans == 1
+        assert wlan.step() and wlan._state is None
+        assert wlan.last['bssid'] == NEAR and wlan.load_last()['bssid'] == NEAR
+
+        wlan = manager((FAR,), FAR)
+        wlan.sta_if.status = lambda param=None: 1001
+        assert not wlan.step()
+        wlan.sta_if.reachable = ()
+        assert not wlan.step() and wlan._state == 'direct'
+        time.sleep_ms(60)
+        assert not wlan.step() and wlan._state == 'scanned' and wlan.info.scans == 1
+
+        wlan = manager((), None)
+        assert not wlan.step() and wlan.info.scans == 1 and wlan.sta_if.attempts == [NEAR]
+
+    run(test)
+
+
+def test_no_scan():
+    def test():
+        wlan = manager((), FAR)
+        for _ in range(4):
+            assert not wlan.step(scan=False)
+        assert wlan.info.scans == 0 and wlan.sta_if.attempts == [FAR, FAR]
+        wlan.sta_if.reachable = (FAR,)
+        assert not wlan.step(scan=False)
+        assert wlan.step(scan=False) and wlan.info.scans == 0
+
+    run(test)
+
+
+def test_run_scans_only_when_allowed():
+    import uasyncio as asyncio
+
+    async def serve(wlan, ms: int) -> None:
+        task = asyncio.create_task(wlan.run())
+        await asyncio.sleep_ms(ms)
+        task.cancel()
+
+    def test():
+        for run_scan in (False, True):
+            wlan = manager((FAR, NEAR), FAR, run_scan=run_scan)
+            assert not wlan.step() and wlan.step()
+            wlan.sta_if.rssi = -90
+            wlan.sta_if.connected = False
+            asyncio.run(serve(wlan, 100))
+            assert wlan.sta_if.isconnected(), run_scan
+            if run_scan:
+                assert wlan.info.scans >= 1 and wlan.current[1] == NEAR
+            else:
+                assert wlan.info.scans == 0 and wlan.sta_if.attempts == [FAR, FAR]
+
+    run(test)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: UTF-8 -*-
+"""
+The background write queue of a master over the simulated RS485 bus.
+"""
+import support
+
+DEFINITIONS = {
+    'HREGS': {'SETPOINTS': {'register': 0, 'len': 8, 'val': [0] * 8}},
+    'COILS': {'OUTPUTS': {'register': 0, 'len': 8, 'val': [0] * 8}}
+}
+
+
+def queue() -> tuple:
+    master, slave, requests = support.bus(DEFINITIONS, write_queue={'delay_ms': 0})
+    return master.writes, slave, requests
+
+
+def test_negative_values():
+    import uasyncio as asyncio
+
+    writes, slave, requests = queue()
+    single = writes.write(10, 'HREGS', 0, -2)
+    multiple = writes.write(10, 'HREGS', 2, [-1, -32768])
+    assert writes.flush() == 2
+    assert single.error is None and single.result and multiple.error is None and multiple.result
+    assert slave.read_values('HREGS', 0, 4) == [0xFFFE, 0, 0xFFFF, 0x8000]
+
+    writes.write(10, 'HREGS', 0, -3)
+    assert asyncio.run(writes.flush_async()) == 1
+    assert slave.read_values('HREGS', 0, 1) == [0xFFFD]
+
+
+def test_supersede():
+    writes, slave, requests = queue()
+    done = []
+    first = writes.write(10, 'HREGS', 1, 100, callback=done.append)
+    second = writes.write(10, 'HREGS', 1, 200, callback=done.append)
+    assert writes.pending == 1 and writes.replaced == 1 and not first.done
+    assert writes.flush() == 1
+    assert first.done and second.done and first.result and second.result and done == [first, second]
+    assert [pdu[0] for pdu in requests] == [0x06] and slave.read_values('HREGS', 1, 1) == [200]
+    assert writes.stats == {'writes': 2, 'replaced': 1, 'frames': 1, 'errors': 0, 'pending': 0}
+
+
+def test_merging():
+    master, slave, requests = support.bus(DEFINITIONS, write_queue={'delay_ms': 0, 'max_registers': 3})
+    writes = master.writes
+    writes.write(10, 'HREGS', 0, [1, 2])
+    writes.write(10, 'HREGS', 2, [3, 4])
+    writes.write(10, 'HREGS', 7, 8)
+    writes.write(10, 'COILS', 3, True)
+    writes.write(10, 'COILS', 1, [True, False])
+    assert writes.flush() == 4
+    assert [pdu[0] for pdu in requests] == [0x0F, 0x10, 0x06, 0x06]
+    assert requests[1][1:5] == b'\x00\x00\x00\x03' and requests[2][1:5] == b'\x00\x03\x00\x04'
+    assert slave.read_values('HREGS', 0, 8) == [1, 2, 3, 4, 0, 0, 0, 8]
+    assert slave.read_values('COILS', 0, 4) == [False, True, False, True]
+
+
+def test_run():
+    import uasyncio as asyncio
+
+    writes, slave, requests = queue()
+    writes.delay_ms = 20
+
+    async def main():
+        task = asyncio.create_task(writes.run())
+        handles = [writes.write(10, 'COILS', i, True) for i in range(3)]
+        await asyncio.sleep_ms(5)
+        assert not requests
+        await asyncio.sleep_ms(50)
+        task.cancel()
+        return handles
+
+    handles = asyncio.run(main())
+    assert all(handle.done and handle.result for handle in handles)
+    assert [pdu[0] for pdu in requests] == [0x0F] and slave.read_values('COILS', 0, 3) == [True] * 3